@@ -1,30 +1,86 @@
 from django.contrib import admin
+from django.utils import timezone
 from django.utils.html import format_html
 from .models import *
 from django.core.cache import cache
 from django import forms
-from django.shortcuts import render
+from django.shortcuts import get_object_or_404, render
 from django.urls import path, reverse
 from django.contrib import messages
 import csv
-import random
-import string
 import zipfile
 import io
 import os
 from PIL import Image
 from django.core.files.base import ContentFile
-from io import TextIOWrapper, StringIO
-from django.http import HttpResponseRedirect, HttpResponse
+from io import TextIOWrapper
+from django.http import FileResponse, Http404, HttpResponseRedirect, HttpResponse, JsonResponse
 from django.core.exceptions import ValidationError
-from django.contrib.auth.models import User
-from django.db.models import Case, When, Value, IntegerField
+from django.db.models import Case, When, Value, IntegerField, Q
+from django.forms.models import BaseInlineFormSet
 from .admin_widgets import YearSelectorWidget
+from .admin_changelist import CachedRowsChangeList
 from .forms import PersonForm
+from . import cache_tags, facilitators, import_jobs, import_preview, people_import, result_cache
+
+
+# Columns cached for each ParticipationInline row: the form fields plus what
+# the row header (str(participation)) needs
+PARTICIPATION_INLINE_ROW_FIELDS = (
+    'person', 'group', 'hours', 'special_recognition', 'elementary', 'senior', 'years',
+    'person__cached_str', 'group__name',
+)
+
+
+def order_participations(queryset):
+    """Sort facilitators first, then by first and last name."""
+    facilitator_ids = facilitators.get_facilitator_role_ids()
+    if not facilitator_ids:
+        return queryset.order_by('person__user__first_name', 'person__user__last_name')
+    return queryset.annotate(
+        sort_order=Case(
+            When(person__role_id__in=facilitator_ids, then=Value(1)),
+            default=Value(2),
+            output_field=IntegerField(),
+        )
+    ).order_by('sort_order', 'person__user__first_name', 'person__user__last_name')
+
+
+def get_participation_inline_rows(parent_model, parent_id, queryset=None, refresh=False):
+    """
+    Return the participations shown in the inline of a group or person.
+
+    ``parent_model`` is 'group' or 'person'.  Rows are cached as tuples, so a
+    hit rebuilds the instances without querying the database.
+    """
+    if queryset is None:
+        queryset = order_participations(Participation.objects.filter(**{f'{parent_model}_id': parent_id}))
+    parent_tag = cache_tags.group_tag(parent_id) if parent_model == 'group' else cache_tags.person_tag(parent_id)
+    return result_cache.get_rows(
+        f'participation_inline_{parent_model}_{parent_id}',
+        queryset,
+        PARTICIPATION_INLINE_ROW_FIELDS,
+        tags=(parent_tag, cache_tags.PARTICIPATION_INLINES),
+        timeout=300,  # Cache for 5 minutes
+        refresh=refresh,
+    )
+
+
+class ParticipationInlineFormSet(BaseInlineFormSet):
+    def get_queryset(self):
+        # Bound formsets look existing objects up by pk, so keep them on the database
+        if self.is_bound or self.instance.pk is None:
+            return super().get_queryset()
+        if not hasattr(self, '_cached_rows'):
+            self._cached_rows = get_participation_inline_rows(
+                self.fk.name, self.instance.pk, queryset=super().get_queryset()
+            )
+        return self._cached_rows
 
 
 class ParticipationInline(admin.TabularInline):
     model = Participation
+    formset = ParticipationInlineFormSet
     extra = 0
     exclude = ('is_public',)
     show_change_link = True
@@ -36,85 +92,19 @@ class ParticipationInline(admin.TabularInline):
         models.JSONField: {'widget': YearSelectorWidget()},
     }
     
-    def get_formset(self, request, obj=None, **kwargs):
-        if obj:
-            request._parent_obj = obj
-        return super().get_formset(request, obj, **kwargs)
-    
     def get_queryset(self, request):
-        parent_obj = getattr(request, '_parent_obj', None)
-        if not parent_obj:
-            return super().get_queryset(request)
-        
-        # Generate cache key
-        parent_model = parent_obj.__class__.__name__.lower()
-        parent_id = parent_obj.pk
-        page = request.GET.get('page', 1)
-        cache_key = f'participation_inline_{parent_model}_{parent_id}_page{page}'
-        
-        # Try to get cached queryset
-        cached_queryset = cache.get(cache_key)
-        if cached_queryset is not None:
-            return cached_queryset
-        
-        # Optimize base queryset with select_related and only
-        queryset = super().get_queryset(request).select_related(
-            'person',
-            'person__user',
-            'person__role'
-        ).only(
-            'id',
-            'person__id',
-            'person__user__first_name',
-            'person__user__last_name',
-            'person__role__id',
-            'person__role__title',
-            'years',
-            'hours',
-            'special_recognition'
-        )
-        
-        # Filter by parent object
-        if parent_model == 'group':
-            queryset = queryset.filter(group_id=parent_id)
-        elif parent_model == 'person':
-            queryset = queryset.filter(person_id=parent_id)
-        
-        # Optimize sorting by using a more efficient approach
-        facilitator_ids = cache.get('facilitator_role_ids')
-        if facilitator_ids is None:
-            facilitator_ids = list(Role.objects.filter(title__iexact='facilitator').values_list('id', flat=True))
-            cache.set('facilitator_role_ids', facilitator_ids, 3600)  # Cache for 1 hour
-        
-        if facilitator_ids:
-            # Use a more efficient sorting approach
-            queryset = queryset.extra(
-                select={
-                    'sort_order': f"""
-                        CASE 
-                            WHEN experiences_person.role_id IN ({','.join(map(str, facilitator_ids))}) THEN 1 
-                            ELSE 2 
-                        END
-                    """
-                },
-                order_by=['sort_order', 'person__user__first_name', 'person__user__last_name']
-            )
-        else:
-            queryset = queryset.order_by('person__user__first_name', 'person__user__last_name')
-        
-        # Cache the queryset with a shorter TTL for better data freshness
-        cache.set(cache_key, queryset, 300)  # Cache for 5 minutes
-        
-        return queryset
+        # Rows are cached by ParticipationInlineFormSet, only the query is built here
+        return order_participations(super().get_queryset(request))
         
     def has_add_permission(self, request, obj=None):
         if obj and obj.__class__.__name__.lower() == 'group':
             # Use a more efficient count query
             count_key = f'participation_count_group_{obj.pk}'
-            count = cache.get(count_key)
+            count_tags = (cache_tags.group_tag(obj.pk),)
+            count = cache_tags.get(count_key, count_tags)
             if count is None:
                 count = Participation.objects.filter(group_id=obj.pk).count()
-                cache.set(count_key, count, 300)  # Cache for 5 minutes
+                cache_tags.set(count_key, count, count_tags, 300)  # Cache for 5 minutes
                 
             if count > 500:
                 return False
@@ -126,6 +116,21 @@ class VisibilityModelAdmin(admin.ModelAdmin):
     list_display = ('get_name', 'visibility_badge', 'last_modified')
     list_filter = ('is_public',)
     actions = ['make_public', 'make_private']
+
+    # Columns cached per changelist page (see CachedRowsChangeList); leave
+    # empty to render the changelist straight from the database
+    changelist_row_fields = ()
+    changelist_cache_tags = ()
+    changelist_cache_timeout = 60 * 15
+    
+    def get_changelist(self, request, **kwargs):
+        if self.changelist_row_fields:
+            return CachedRowsChangeList
+        return super().get_changelist(request, **kwargs)
+
+    def get_changelist_row_data(self, objects):
+        """Return {pk: {column: value}} for columns computed from other tables, for a whole page."""
+        return {}
     
     def get_name(self, obj):
         return str(obj)
@@ -144,29 +149,31 @@ class VisibilityModelAdmin(admin.ModelAdmin):
     visibility_badge.short_description = 'Visibility'
     
     def make_public(self, request, queryset):
-        updated = queryset.update(is_public=True)
+        # update() skips auto_now, so bump last_modified for incremental backups
+        updated = queryset.update(is_public=True, last_modified=timezone.now())
+        # update() sends no signals, so drop the cached changelist pages here
+        cache_tags.invalidate(*self.changelist_cache_tags)
         self.message_user(request, f'{updated} items are now public.')
     make_public.short_description = "Make selected items public"
     
     def make_private(self, request, queryset):
-        updated = queryset.update(is_public=False)
+        updated = queryset.update(is_public=False, last_modified=timezone.now())
+        cache_tags.invalidate(*self.changelist_cache_tags)
         self.message_user(request, f'{updated} items are now private.')
     make_private.short_description = "Make selected items private"
 
 
+# Rows that change something listed by the import preview
+PREVIEW_ROWS = 200
+
+
 class CSVUploadForm(forms.Form):
     csv_file = forms.FileField(label='CSV File')
     create_users = forms.BooleanField(required=False, label='Create new users')
-
-
-def generate_password(length=10):
-    """Generate a random pronounceable password"""
-    vowels = 'aeiou'
-    consonants = 'bcdfghjklmnpqrstvwxyz'
-    first_part = ''.join(random.choice(consonants) + random.choice(vowels) for _ in range(length//2))
-    number_part = ''.join(random.choice(string.digits) for _ in range(2))
-    special_char = random.choice('!@#$%^&*')
-    return first_part.capitalize() + number_part + special_char
+    preview = forms.BooleanField(
+        required=False, label='Preview only',
+        help_text='Show what the import would create, update or skip, without changing anything',
+    )
 
 
 @admin.register(Role)
@@ -180,34 +187,12 @@ class RoleAdmin(admin.ModelAdmin):
         
         # If this is an update and title changed, we need to clear caches that depend on role titles
         if change and 'title' in form.changed_data:
-            # Get all persons with this role
-            affected_persons = Person.objects.filter(role=obj)
-            for person in affected_persons:
-                # Clear person cache
-                cache.delete(f'participation_inline_person_{person.pk}')
-                
-                # Clear cache for all groups this person is in
-                for group in person.groups.all():
-                    cache.delete(f'participation_inline_group_{group.pk}')
+            # Role titles drive sorting and display in every participation inline
+            cache_tags.invalidate(cache_tags.PARTICIPATION_INLINES, cache_tags.PERSON_LIST)
     
     def delete_model(self, request, obj):
-        # Get all persons with this role before deleting
-        affected_persons = list(Person.objects.filter(role=obj).values_list('id', flat=True))
-        affected_groups = set()
-        
-        # Get all groups these persons are in
-        for person_id in affected_persons:
-            person_groups = Group.objects.filter(members__id=person_id)
-            affected_groups.update(person_groups.values_list('id', flat=True))
-        
         super().delete_model(request, obj)
-        
-        # Clear caches
-        for person_id in affected_persons:
-            cache.delete(f'participation_inline_person_{person_id}')
-        
-        for group_id in affected_groups:
-            cache.delete(f'participation_inline_group_{group_id}')
+        cache_tags.invalidate(cache_tags.PARTICIPATION_INLINES, cache_tags.PERSON_LIST)
 
 
 class GuardianStudentInline(admin.TabularInline):
@@ -289,168 +274,34 @@ class PersonAdmin(VisibilityModelAdmin):
                  self.admin_site.admin_view(self.download_guardian_csv_template),
                  name='download_guardian_csv_template'),
                  
-            path('download-imported-users/', 
+            path('import-jobs/<int:job_id>/',
+                 self.admin_site.admin_view(self.import_job_view),
+                 name='import_job'),
+
+            path('import-jobs/<int:job_id>/status/',
+                 self.admin_site.admin_view(self.import_job_status),
+                 name='import_job_status'),
+
+            path('import-jobs/<int:job_id>/report/',
+                 self.admin_site.admin_view(self.download_import_report),
+                 name='import_job_report'),
+
+            path('import-jobs/<int:job_id>/resume/',
+                 self.admin_site.admin_view(self.resume_import_job),
+                 name='import_job_resume'),
+
+            path('import-jobs/<int:job_id>/credentials/',
                  self.admin_site.admin_view(self.download_imported_users),
-                 name='download_imported_users'),
+                 name='import_job_credentials'),
         ]
         return custom_urls + urls
     
     def import_people_csv_view(self, request):
-        """View to import people from CSV file."""
+        """View to import people from CSV file, as a background job."""
         if request.method == 'POST':
             form = CSVUploadForm(request.POST, request.FILES)
             if form.is_valid():
-                csv_file = request.FILES['csv_file']
-                create_users = form.cleaned_data['create_users']
-                
-                # Process the CSV file
-                csv_file_wrapper = TextIOWrapper(csv_file.file, encoding='utf-8-sig')
-                csv_reader = csv.DictReader(csv_file_wrapper)
-                
-                # Validate CSV structure
-                required_fields = ['email', 'role']
-                for field in required_fields:
-                    if field not in csv_reader.fieldnames:
-                        messages.error(request, f"CSV file missing required '{field}' column")
-                        return HttpResponseRedirect(request.path)
-                
-                # Track results for display
-                created_users = []
-                updated_people = 0
-                skipped_rows = 0
-                errors = []
-                
-                # Process each row
-                for row in csv_reader:
-                    try:
-                        # Check required fields
-                        email = row.get('email', '').strip()
-                        role_title = row.get('role', '').strip().lower()  # Normalize role to lowercase
-                        
-                        if not email or not role_title:
-                            errors.append(f"Row {csv_reader.line_num}: Missing required fields")
-                            skipped_rows += 1
-                            continue
-                        
-                        # Check if role exists (case-insensitive)
-                        try:
-                            # Use case-insensitive query
-                            role = Role.objects.filter(title__iexact=role_title).first()
-                            if not role:
-                                raise Role.DoesNotExist
-                        except Role.DoesNotExist:
-                            errors.append(f"Row {csv_reader.line_num}: Role '{role_title}' does not exist")
-                            skipped_rows += 1
-                            continue
-                        
-                        # Get or create user
-                        first_name = row.get('first_name', '').strip()
-                        last_name = row.get('last_name', '').strip()
-                        graduating_year = row.get('graduating_year', '').strip()
-                        
-                        try:
-                            user = User.objects.get(email=email)
-                            # Update existing user info if provided
-                            if first_name and not user.first_name:
-                                user.first_name = first_name
-                            if last_name and not user.last_name:
-                                user.last_name = last_name
-                            user.save()
-                            
-                        except User.DoesNotExist:
-                            if create_users:
-                                # Create new user
-                                username = email.split('@')[0]
-                                # Make sure username is unique
-                                base_username = username
-                                counter = 1
-                                while User.objects.filter(username=username).exists():
-                                    username = f"{base_username}{counter}"
-                                    counter += 1
-                                    
-                                # Generate password
-                                password = generate_password()
-                                
-                                # Create user
-                                user = User.objects.create_user(
-                                    username=username,
-                                    email=email,
-                                    password=password,
-                                    first_name=first_name,
-                                    last_name=last_name
-                                )
-                                
-                                created_users.append({
-                                    'email': email,
-                                    'username': username,
-                                    'password': password,
-                                    'name': f"{first_name} {last_name}".strip()
-                                })
-                            else:
-                                errors.append(f"Row {csv_reader.line_num}: User with email '{email}' does not exist and create_users is not checked")
-                                skipped_rows += 1
-                                continue
-                        
-                        # Get or create person
-                        person, created = Person.objects.get_or_create(
-                            user=user,
-                            defaults={
-                                'role': role,
-                                'graduating_year': graduating_year if graduating_year else None
-                            }
-                        )
-                        
-                        if not created:
-                            # Update existing person
-                            if graduating_year:
-                                person.graduating_year = graduating_year
-                            person.role = role
-                            person.save()
-                            updated_people += 1
-                    
-                    except Exception as e:
-                        errors.append(f"Row {csv_reader.line_num}: {str(e)}")
-                        skipped_rows += 1
-                
-                # Show results
-                if created_users:
-                    messages.success(request, f"Created {len(created_users)} new users")
-                    
-                    # Provide CSV download for created users
-                    csv_output = StringIO()
-                    csv_writer = csv.writer(csv_output)
-                    csv_writer.writerow(['Username', 'Email', 'Password', 'Name'])
-                    for user_data in created_users:
-                        csv_writer.writerow([
-                            user_data['username'], 
-                            user_data['email'],
-                            user_data['password'],
-                            user_data['name']
-                        ])
-                    
-                    # Store the CSV data in the session for download
-                    request.session['user_import_csv'] = csv_output.getvalue()
-                    
-                    # Link to download the CSV
-                    download_url = reverse('admin:download_imported_users')
-                    messages.info(request, format_html(
-                        'Download <a href="{}">user credentials CSV</a> to share with new users.', 
-                        download_url
-                    ))
-                
-                if updated_people > 0:
-                    messages.success(request, f"Updated {updated_people} existing people")
-                    
-                if skipped_rows > 0:
-                    messages.warning(request, f"Skipped {skipped_rows} rows due to errors")
-                    
-                for error in errors[:10]:  # Show first 10 errors
-                    messages.error(request, error)
-                    
-                if len(errors) > 10:
-                    messages.error(request, f"... and {len(errors) - 10} more errors")
-                    
-                return HttpResponseRedirect(reverse('admin:experiences_person_changelist'))
+                return self.submit_import(request, form, 'people', {'create_users': form.cleaned_data['create_users']})
         else:
             form = CSVUploadForm()
             
@@ -462,102 +313,11 @@ class PersonAdmin(VisibilityModelAdmin):
         return render(request, 'admin/people_csv_form.html', context)
     
     def import_guardians_csv_view(self, request):
-        """View to import guardian-student relations from CSV file."""
+        """View to import guardian-student relations from CSV file, as a background job."""
         if request.method == 'POST':
             form = CSVUploadForm(request.POST, request.FILES)
             if form.is_valid():
-                csv_file = request.FILES['csv_file']
-                
-                # Process the CSV file
-                csv_file_wrapper = TextIOWrapper(csv_file.file, encoding='utf-8-sig')
-                csv_reader = csv.DictReader(csv_file_wrapper)
-                
-                # Validate CSV structure
-                required_fields = ['guardian_email', 'student_email', 'relationship']
-                for field in required_fields:
-                    if field not in csv_reader.fieldnames:
-                        messages.error(request, f"CSV file missing required '{field}' column")
-                        return HttpResponseRedirect(request.path)
-                
-                # Track results for display
-                created_relations = 0
-                skipped_rows = 0
-                errors = []
-                
-                # Process each row
-                for row in csv_reader:
-                    try:
-                        # Check required fields
-                        guardian_email = row.get('guardian_email', '').strip()
-                        student_email = row.get('student_email', '').strip()
-                        relationship = row.get('relationship', '').strip()
-                        
-                        if not guardian_email or not student_email or not relationship:
-                            errors.append(f"Row {csv_reader.line_num}: Missing required fields")
-                            skipped_rows += 1
-                            continue
-                        
-                        # Check if users exist
-                        try:
-                            guardian_user = User.objects.get(email=guardian_email)
-                        except User.DoesNotExist:
-                            errors.append(f"Row {csv_reader.line_num}: Guardian with email '{guardian_email}' not found")
-                            skipped_rows += 1
-                            continue
-                            
-                        try:
-                            student_user = User.objects.get(email=student_email)
-                        except User.DoesNotExist:
-                            errors.append(f"Row {csv_reader.line_num}: Student with email '{student_email}' not found")
-                            skipped_rows += 1
-                            continue
-                        
-                        # Check if people exist
-                        try:
-                            guardian = Person.objects.get(user=guardian_user)
-                        except Person.DoesNotExist:
-                            errors.append(f"Row {csv_reader.line_num}: Guardian person record for '{guardian_email}' not found")
-                            skipped_rows += 1
-                            continue
-                            
-                        try:
-                            student = Person.objects.get(user=student_user)
-                        except Person.DoesNotExist:
-                            errors.append(f"Row {csv_reader.line_num}: Student person record for '{student_email}' not found")
-                            skipped_rows += 1
-                            continue
-                        
-                        # Create or update the relationship
-                        relation, created = GuardianStudent.objects.get_or_create(
-                            guardian=guardian,
-                            student=student,
-                            defaults={'relationship': relationship}
-                        )
-                        
-                        if not created:
-                            relation.relationship = relationship
-                            relation.save()
-                        
-                        created_relations += 1
-                    
-                    except Exception as e:
-                        errors.append(f"Row {csv_reader.line_num}: {str(e)}")
-                        skipped_rows += 1
-                
-                # Show results
-                if created_relations > 0:
-                    messages.success(request, f"Created/updated {created_relations} guardian-student relationships")
-                    
-                if skipped_rows > 0:
-                    messages.warning(request, f"Skipped {skipped_rows} rows due to errors")
-                    
-                for error in errors[:10]:  # Show first 10 errors
-                    messages.error(request, error)
-                    
-                if len(errors) > 10:
-                    messages.error(request, f"... and {len(errors) - 10} more errors")
-                    
-                return HttpResponseRedirect(reverse('admin:experiences_guardianstulient_changelist'))
+                return self.submit_import(request, form, 'guardians')
         else:
             form = CSVUploadForm()
             
@@ -567,7 +327,87 @@ class PersonAdmin(VisibilityModelAdmin):
             'opts': self.model._meta,
         }
         return render(request, 'admin/people_csv_form.html', context)
-    
+
+    def submit_import(self, request, form, kind, options=None):
+        """Queue the import of the uploaded CSV and show its job page, or show its preview."""
+        csv_file = request.FILES['csv_file']
+        for field in import_jobs.missing_columns(kind, csv_file):
+            messages.error(request, f"CSV file missing required '{field}' column")
+            return HttpResponseRedirect(request.path)
+        if form.cleaned_data['preview']:
+            return self.preview_import(request, kind, csv_file, options or {})
+
+        job = import_jobs.submit(kind, csv_file, options, request.user)
+        messages.info(request, f"Import #{job.pk} queued; it runs in the background")
+        return HttpResponseRedirect(reverse('admin:import_job', args=[job.pk]))
+
+    def preview_import(self, request, kind, csv_file, options):
+        """What importing the uploaded CSV would do, row by row, without writing anything."""
+        reader = csv.DictReader(TextIOWrapper(csv_file.file, encoding='utf-8-sig', newline=''))
+        result = import_preview.preview(kind, reader, options.get('create_users', False))
+        columns = import_preview.REQUIRED_COLUMNS[kind]
+        changes = [
+            {'line': line, 'values': [row.get(column) for column in columns], 'outcome': outcome, 'message': message}
+            for line, row, outcome, message in result.outcomes
+            if outcome != people_import.ImportResult.UNCHANGED
+        ]
+        context = {
+            'title': 'Import Preview',
+            'result': result,
+            'users_created': len(result.created_users),
+            'columns': columns,
+            'changes': changes[:PREVIEW_ROWS],
+            'more_changes': max(len(changes) - PREVIEW_ROWS, 0),
+            'import_url': request.path,
+            'opts': self.model._meta,
+        }
+        return render(request, 'admin/import_preview.html', context)
+
+    def get_import_job(self, request, job_id):
+        """The import job ``job_id``; 404 unless the user submitted it or is a superuser."""
+        job = get_object_or_404(ImportJob, pk=job_id)
+        if not import_jobs.can_view(job, request.user):
+            raise Http404("No such import job")
+        return job
+
+    def import_job_view(self, request, job_id):
+        """Progress and results of an import job."""
+        job = self.get_import_job(request, job_id)
+        context = {
+            'title': f'Import #{job.pk}',
+            'job': job,
+            'errors': import_jobs.read_errors(job),
+            'resumable': import_jobs.is_resumable(job),
+            'has_credentials': bool(job.users_created and import_jobs.get_credentials_path(job, request.user)),
+            'opts': self.model._meta,
+        }
+        return render(request, 'admin/import_job.html', context)
+
+    def import_job_status(self, request, job_id):
+        """JSON state of an import job, polled by its page."""
+        return JsonResponse(self.get_import_job(request, job_id).as_dict())
+
+    def download_import_report(self, request, job_id):
+        """The per-row report of an import job."""
+        job = self.get_import_job(request, job_id)
+        try:
+            report = open(import_jobs.get_path(job.pk, import_jobs.REPORT_FILE), 'rb')
+        except FileNotFoundError:
+            raise Http404("This import has no report yet")
+        return FileResponse(
+            report, as_attachment=True, filename=f'import_{job.pk}_report.csv', content_type='text/csv',
+        )
+
+    def resume_import_job(self, request, job_id):
+        """Queue an interrupted or failed import job again from its checkpoint."""
+        job = self.get_import_job(request, job_id)
+        if request.method == 'POST':
+            if import_jobs.resume(job):
+                messages.success(request, f"Import #{job.pk} resumes after row {job.rows_processed}")
+            else:
+                messages.error(request, f"Import #{job.pk} cannot be resumed")
+        return HttpResponseRedirect(reverse('admin:import_job', args=[job.pk]))
+
     def download_csv_template(self, request):
         """Provide a downloadable example CSV template."""
         csv_content = "email,role,first_name,last_name,graduating_year\n"
@@ -588,31 +428,70 @@ class PersonAdmin(VisibilityModelAdmin):
         response['Content-Disposition'] = 'attachment; filename="guardian_relationships_template.csv"'
         return response
     
-    def download_imported_users(self, request):
-        """Download CSV with user credentials for newly created users."""
-        csv_data = request.session.get('user_import_csv', '')
-        if not csv_data:
+    def download_imported_users(self, request, job_id):
+        """Download CSV with user credentials for the users created by an import job."""
+        job = self.get_import_job(request, job_id)
+        # Only for the admin who ran the import, until the credentials expire
+        path = import_jobs.get_credentials_path(job, request.user)
+        try:
+            credentials = open(path, 'rb') if path else None
+        except FileNotFoundError:
+            credentials = None
+        if credentials is None:
             messages.error(request, "No user data available for download")
-            return HttpResponseRedirect(reverse('admin:experiences_person_changelist'))
-        
-        response = HttpResponse(csv_data, content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="imported_user_credentials.csv"'
-        
-        # Clear the session data
-        del request.session['user_import_csv']
-        
-        return response
+            return HttpResponseRedirect(reverse('admin:import_job', args=[job.pk]))
+
+        # Served once: the passwords are not kept on disk
+        os.remove(path)
+        return FileResponse(
+            credentials, as_attachment=True, filename='imported_user_credentials.csv', content_type='text/csv',
+        )
 
     def get_full_name(self, obj):
         return obj.user.get_full_name() or obj.user.username
 
+    def get_changelist_row_data(self, objects):
+        """Participations, guardians and students for a whole page in one query each."""
+        row_data = {obj.pk: {'participations': set(), 'guardians': [], 'students': []} for obj in objects}
+        if not row_data:
+            return {}
+
+        participations = Participation.objects.filter(person_id__in=row_data).values_list('person_id', 'group__name')
+        for person_id, group_name in participations:
+            row_data[person_id]['participations'].add(group_name)
+
+        relationships = GuardianStudent.objects.filter(
+            Q(student_id__in=row_data) | Q(guardian_id__in=row_data)
+        ).select_related('guardian__user', 'guardian__role', 'student__user', 'student__role').order_by('pk')
+        for relationship in relationships:
+            if relationship.student_id in row_data:
+                row_data[relationship.student_id]['guardians'].append(str(relationship.guardian))
+            if relationship.guardian_id in row_data:
+                row_data[relationship.guardian_id]['students'].append(str(relationship.student))
+
+        return {
+            pk: {
+                'participations': ", ".join(sorted(data['participations'])) or "-",
+                'guardians': ", ".join(data['guardians']) or "-",
+                'students': ", ".join(data['students']) or "-",
+            }
+            for pk, data in row_data.items()
+        }
+
     def get_guardians(self, obj):
+        # Precomputed for the whole changelist page
+        row_data = getattr(obj, '_changelist_row_data', None)
+        if row_data:
+            return row_data['guardians']
         guardians = obj.guardians.all()
         if not guardians:
             return "-"
         return ", ".join([str(g) for g in guardians])
 
     def get_students(self, obj):
+        row_data = getattr(obj, '_changelist_row_data', None)
+        if row_data:
+            return row_data['students']
         students = obj.students.all()
         if not students:
             return "-"
@@ -620,9 +499,14 @@ class PersonAdmin(VisibilityModelAdmin):
 
     def get_participations(self, obj):
         """Return a formatted string of participations for this person"""
+        row_data = getattr(obj, '_changelist_row_data', None)
+        if row_data:
+            return row_data['participations']
+
         # Try to get from cache
         cache_key = f'person_participations_display_{obj.pk}'
-        cached_display = cache.get(cache_key)
+        display_tags = (cache_tags.person_tag(obj.pk),)
+        cached_display = cache_tags.get(cache_key, display_tags)
         
         if cached_display is not None:
             return cached_display
@@ -637,7 +521,7 @@ class PersonAdmin(VisibilityModelAdmin):
         display = ", ".join(sorted(set(group_names)))
         
         # Cache for a reasonable time
-        cache.set(cache_key, display, 3600)  # Cache for 1 hour
+        cache_tags.set(cache_key, display, display_tags, 3600)  # Cache for 1 hour
         
         return display
     get_participations.short_description = "Participations"
@@ -681,38 +565,21 @@ class PersonAdmin(VisibilityModelAdmin):
         # Everyone with admin access can view
         return True
 
+    # Columns cached per changelist page; get_participations, get_guardians
+    # and get_students come from get_changelist_row_data()
+    changelist_row_fields = (
+        'user__username', 'user__first_name', 'user__last_name', 'user__is_active',
+        'role__title', 'graduating_year', 'is_public', 'last_modified',
+        'show_activities_publicly', 'show_guardians_publicly', 'cached_str',
+    )
+    changelist_cache_tags = (cache_tags.PERSON_LIST,)
+
     def get_queryset(self, request):
-        # Cache key includes user id to handle different permissions
-        cache_key = f'person_admin_list_{request.user.id}'
-        cached_qs = cache.get(cache_key)
-        
-        if cached_qs is not None:
-            return cached_qs
-        
-        # Base queryset with permission filtering
-        qs = super().get_queryset(request)
-        
-        # Filter based on user permissions
-        if request.user.is_superuser or request.user.groups.filter(name='Administrators').exists():
-            # No filtering needed for admins, but still optimize the query
-            qs = qs.select_related('user', 'role').prefetch_related(
-                'guardian_relationships', 
-                'student_relationships',
-                'participation_set__group',  # Corrected: Access groups via participation_set
-                'participation_set'
-            )
-        else:
-            # Regular users can only see their own profile
-            qs = qs.filter(user=request.user).select_related('user', 'role').prefetch_related(
-                'guardian_relationships', 
-                'student_relationships',
-                'participation_set__group',  # Corrected: Access groups via participation_set
-                'participation_set'
-            )
-        
-        # Cache the queryset for 15 minutes
-        cache.set(cache_key, qs, 60 * 15)
-        
+        qs = super().get_queryset(request).select_related('user', 'role')
+
+        # Regular users can only see their own profile
+        if not (request.user.is_superuser or request.user.groups.filter(name='Administrators').exists()):
+            qs = qs.filter(user=request.user)
         return qs
 
     def save_model(self, request, obj, form, change):
@@ -721,14 +588,14 @@ class PersonAdmin(VisibilityModelAdmin):
                 obj.user = request.user  # Force the user to be the current user
         super().save_model(request, obj, form, change)
         
-        # Clear caches related to this person
-        cache.delete(f'participation_inline_person_{obj.pk}')
-        
-        # Also clear caches for any groups this person is a member of
-        # This is important because person.role affects sorting in ParticipationInline
-        for participation in obj.participation_set.all(): # Corrected: Iterate through participations
-            if participation.group: # Access group via participation
-                cache.delete(f'participation_inline_group_{participation.group.pk}')
+        # Clear caches related to this person, plus the inlines of any groups
+        # they are a member of (person.role affects sorting in ParticipationInline)
+        group_ids = obj.participation_set.values_list('group_id', flat=True).distinct()
+        cache_tags.invalidate(
+            cache_tags.person_tag(obj.pk),
+            cache_tags.PERSON_LIST,
+            *[cache_tags.group_tag(group_id) for group_id in group_ids]
+        )
         
         # Show generated password if a new user was created via the form
         if hasattr(form, 'generated_password') and form.generated_password:
@@ -754,10 +621,11 @@ class GroupAdmin(VisibilityModelAdmin):
         if obj:
             # Display participation count in the form
             count_key = f'participation_count_group_{obj.pk}'
-            count = cache.get(count_key)
+            count_tags = (cache_tags.group_tag(obj.pk),)
+            count = cache_tags.get(count_key, count_tags)
             if count is None:
                 count = Participation.objects.filter(group_id=obj.pk).count()
-                cache.set(count_key, count, 3600)
+                cache_tags.set(count_key, count, count_tags, 3600)
                 
             if count > 100:
                 form.base_fields['participation_warning'] = forms.CharField(
@@ -768,53 +636,24 @@ class GroupAdmin(VisibilityModelAdmin):
                 )
         return form
     
-    def get_queryset(self, request):
-        # Cache the queryset for the list view
-        cache_key = f'group_admin_list_{request.user.id}'
-        cached_qs = cache.get(cache_key)
-        
-        if cached_qs is not None:
-            return cached_qs
-        
-        # Get base queryset with optimized prefetching
-        qs = super().get_queryset(request).prefetch_related(
-            'members',
-            'core_competency_1', 
-            'core_competency_2', 
-            'core_competency_3'
-        )
-        
-        # Cache the queryset for 15 minutes
-        cache.set(cache_key, qs, 60 * 15)
-        return qs
+    changelist_row_fields = (
+        'name', 'description', 'is_public', 'last_modified',
+        'core_competency_1__title', 'core_competency_1__is_active',
+        'core_competency_2__title', 'core_competency_2__is_active',
+        'core_competency_3__title', 'core_competency_3__is_active',
+    )
+    changelist_cache_tags = (cache_tags.GROUP_LIST,)
     
     def save_model(self, request, obj, form, change):
         # Call parent method first
         super().save_model(request, obj, form, change)
-        # Clear cache for this group
-        cache.delete(f'participation_inline_group_{obj.pk}')
-        cache.delete(f'group_facilitators_{obj.pk}')
-        
-        # Clear pagination caches for this group
-        for page in range(1, 100):  # Clear a reasonable number of pages
-            cache.delete(f'participation_inline_group_{obj.pk}_page{page}')
-        
-        # Clear the admin list cache for all staff users
-        for user in User.objects.filter(is_staff=True):
-            cache.delete(f'group_admin_list_{user.id}')
+        # Clear every cache entry for this group (inline pages, counts)
+        # and the admin list for all staff users
+        cache_tags.invalidate(cache_tags.group_tag(obj.pk), cache_tags.GROUP_LIST)
         
     def delete_model(self, request, obj):
         # Clear cache before deletion
-        cache.delete(f'participation_inline_group_{obj.pk}')
-        cache.delete(f'group_facilitators_{obj.pk}')
-        
-        # Clear pagination caches for this group
-        for page in range(1, 100):  # Clear a reasonable number of pages
-            cache.delete(f'participation_inline_group_{obj.pk}_page{page}')
-        
-        # Clear the admin list cache for all staff users
-        for user in User.objects.filter(is_staff=True):
-            cache.delete(f'group_admin_list_{user.id}')
+        cache_tags.invalidate(cache_tags.group_tag(obj.pk), cache_tags.GROUP_LIST)
         
         super().delete_model(request, obj)
         
@@ -823,72 +662,28 @@ class GroupAdmin(VisibilityModelAdmin):
         result = super().save_related(request, form, formsets, change)
         # Clear cache when members change via m2m
         if form.instance.pk:
-            cache.delete(f'participation_inline_group_{form.instance.pk}')
-            cache.delete(f'group_facilitators_{form.instance.pk}')
-            
-            # Clear pagination caches for this group
-            for page in range(1, 100):  # Clear a reasonable number of pages
-                cache.delete(f'participation_inline_group_{form.instance.pk}_page{page}')
-            
-            # Clear the admin list cache for all staff users
-            for user in User.objects.filter(is_staff=True):
-                cache.delete(f'group_admin_list_{user.id}')
+            cache_tags.invalidate(cache_tags.group_tag(form.instance.pk), cache_tags.GROUP_LIST)
             
         return result
     
     def clear_participation_cache(self, request, queryset):
         """Action to clear all participation caches for selected groups"""
-        count = 0
-        for group in queryset:
-            cache.delete(f'participation_inline_group_{group.pk}')
-            cache.delete(f'group_facilitators_{group.pk}')
-            # Clear pagination caches
-            for page in range(1, 100):
-                cache.delete(f'participation_inline_group_{group.pk}_page{page}')
-            count += 1
-        self.message_user(request, f"Cleared participation caches for {count} groups")
+        group_ids = list(queryset.values_list('pk', flat=True))
+        cache_tags.invalidate(*[cache_tags.group_tag(group_id) for group_id in group_ids])
+        self.message_user(request, f"Cleared participation caches for {len(group_ids)} groups")
     clear_participation_cache.short_description = "Clear participation cache for selected groups"
     
     def rebuild_facilitators_cache(self, request, queryset):
-        """Action to rebuild facilitator caches for selected groups"""
-        count = 0
-        for group in queryset:
-            # Get facilitator role IDs from cache or DB
-            facilitator_ids = cache.get('facilitator_role_ids')
-            if facilitator_ids is None:
-                facilitator_ids = list(Role.objects.filter(title__iexact='facilitator').values_list('id', flat=True))
-                cache.set('facilitator_role_ids', facilitator_ids, 3600)  # Cache for 1 hour
-                
-            # Find facilitators for this group and cache them    
-            facilitators = group.members.filter(role__id__in=facilitator_ids).select_related('user')
-            facilitator_names = [f"{p.user.first_name} {p.user.last_name}" for p in facilitators]
-            cache.set(f'group_facilitators_{group.pk}', facilitator_names, 86400)  # Cache for 1 day
-            count += 1
-            
-        self.message_user(request, f"Rebuilt facilitator cache for {count} groups")
+        """Action to rebuild the facilitator index (it covers every group)"""
+        index = facilitators.rebuild()
+        count = sum(1 for group_id in queryset.values_list('pk', flat=True) if group_id in index['all'])
+        self.message_user(request, f"Rebuilt facilitator index ({count} of the selected groups have facilitators)")
     rebuild_facilitators_cache.short_description = "Rebuild facilitator cache for selected groups"
 
     @admin.display(description='Facilitators')
     def get_facilitators(self, obj):
-        # Try to get from cache
-        facilitator_names = cache.get(f'group_facilitators_{obj.pk}')
-        if facilitator_names is not None:
-            return ", ".join(facilitator_names) if facilitator_names else "-"
-            
-        # If not in cache, get facilitator role IDs
-        facilitator_ids = cache.get('facilitator_role_ids')
-        if facilitator_ids is None:
-            facilitator_ids = list(Role.objects.filter(title__iexact='facilitator').values_list('id', flat=True))
-            cache.set('facilitator_role_ids', facilitator_ids, 3600)  # Cache for 1 hour
-            
-        # Get facilitators for this group
-        facilitators = obj.members.filter(role__id__in=facilitator_ids).select_related('user')
-        facilitator_names = [f"{p.user.first_name} {p.user.last_name}" for p in facilitators]
-        
-        # Cache for future use
-        cache.set(f'group_facilitators_{obj.pk}', facilitator_names, 86400)  # Cache for 1 day
-        
-        # Return formatted string
+        # Read from the shared facilitator index, no query per group
+        facilitator_names = facilitators.get_facilitators([obj.pk])[obj.pk]
         return ", ".join(facilitator_names) if facilitator_names else "-"
 
     def has_view_permission(self, request, obj=None):
@@ -903,10 +698,7 @@ class GroupAdmin(VisibilityModelAdmin):
         # If this is a specific group, check if user is a facilitator of this group
         if obj:
             # Get facilitator role IDs
-            facilitator_ids = cache.get('facilitator_role_ids')
-            if facilitator_ids is None:
-                facilitator_ids = list(Role.objects.filter(title__iexact='facilitator').values_list('id', flat=True))
-                cache.set('facilitator_role_ids', facilitator_ids, 3600)  # Cache for 1 hour
+            facilitator_ids = facilitators.get_facilitator_role_ids()
             
             # Check if user is a facilitator in this group
             try:
@@ -923,6 +715,24 @@ class GroupAdmin(VisibilityModelAdmin):
         return request.user.is_superuser or request.user.groups.filter(name='Administrators').exists()
 
 
+class SchoolYearListFilter(admin.SimpleListFilter):
+    """Filters participations by school year with a join on ParticipationYear."""
+    title = 'school year'
+    parameter_name = 'school_year'
+
+    def lookups(self, request, model_admin):
+        years = ParticipationYear.objects.values_list('year', flat=True).distinct().order_by('-year')
+        return [(year, format_years([year])) for year in years]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            try:
+                return queryset.in_school_year(int(self.value()))
+            except ValueError:
+                return queryset.none()
+        return queryset
+
+
 @admin.register(Participation)                
 class ParticipationAdmin(VisibilityModelAdmin):
     list_display = ('person', 'group', 'hours', 'special_recognition', 'years_display', 'elementary', 'senior', 'is_public')
@@ -933,25 +743,22 @@ class ParticipationAdmin(VisibilityModelAdmin):
         models.JSONField: {'widget': YearSelectorWidget()},
     }
     
+    changelist_row_fields = (
+        'person__cached_str', 'group__name', 'hours', 'special_recognition',
+        'elementary', 'senior', 'is_public',
+    )
+    changelist_cache_tags = (cache_tags.PARTICIPATION_LIST,)
+    
     def get_queryset(self, request):
-        # Cache the queryset for the list view
-        cache_key = f'participation_admin_list_{request.user.id}'
-        cached_qs = cache.get(cache_key)
-        
-        if cached_qs is not None:
-            return cached_qs
-        
-        # If not cached, get the queryset with select_related to optimize joins
-        qs = super().get_queryset(request).select_related(
-            'person', 
-            'person__user', 
-            'person__role',
-            'group'
-        )
-        
-        # Cache the queryset for 15 minutes - will be invalidated when records change
-        cache.set(cache_key, qs, 60 * 15)
-        return qs
+        return super().get_queryset(request).select_related('person', 'group')
+
+    def get_list_filter(self, request):
+        return (SchoolYearListFilter, *self.list_filter)
+
+    def get_changelist_row_data(self, objects):
+        """The school years of a whole page, from ParticipationYear in one query."""
+        years = get_years_by_participation([obj.pk for obj in objects])
+        return {pk: {'years': format_years(years)} for pk, years in years.items()}
     
     def years_display(self, obj):
         # Cache the formatted years for each participation
@@ -973,11 +780,12 @@ class ParticipationAdmin(VisibilityModelAdmin):
         # Call the parent save_model method first
         super().save_model(request, obj, form, change)
         
-        # Clear cache for related Group and Person
-        if obj.group:
-            cache.delete(f'participation_inline_group_{obj.group.pk}')
-        if obj.person:
-            cache.delete(f'participation_inline_person_{obj.person.pk}')
+        # Clear cache for related Group and Person, and the admin list for all users
+        cache_tags.invalidate(
+            cache_tags.group_tag(obj.group_id),
+            cache_tags.person_tag(obj.person_id),
+            cache_tags.PARTICIPATION_LIST,
+        )
             
         # Clear the widget cache for this specific participation
         # This ensures that when a participation's years change, the widget HTML is regenerated
@@ -986,26 +794,18 @@ class ParticipationAdmin(VisibilityModelAdmin):
         
         # Clear the years display cache
         cache.delete(f'participation_years_display_{obj.pk}')
-        
-        # Clear the admin list cache for all users
-        # This is a bit aggressive, but ensures everyone sees the updated data
-        for user in User.objects.filter(is_staff=True):
-            cache.delete(f'participation_admin_list_{user.id}')
     
     def delete_model(self, request, obj):
         # Cache clear before deletion to make sure we have the relation info
-        if obj.group:
-            cache.delete(f'participation_inline_group_{obj.group.pk}')
-        if obj.person:
-            cache.delete(f'participation_inline_person_{obj.person.pk}')
+        cache_tags.invalidate(
+            cache_tags.group_tag(obj.group_id),
+            cache_tags.person_tag(obj.person_id),
+            cache_tags.PARTICIPATION_LIST,
+        )
             
         # Clear the years display cache
         cache.delete(f'participation_years_display_{obj.pk}')
         
-        # Clear the admin list cache for all users
-        for user in User.objects.filter(is_staff=True):
-            cache.delete(f'participation_admin_list_{user.id}')
-        
         # Call the parent delete_model method
         super().delete_model(request, obj)
 
@@ -1018,6 +818,10 @@ class ParticipationAdmin(VisibilityModelAdmin):
     }
     
     def years_display(self, obj):
+        # Precomputed for the whole changelist page
+        row_data = getattr(obj, '_changelist_row_data', None)
+        if row_data:
+            return row_data['years']
         return obj.format_school_years()
     years_display.short_description = "School Years"
     
@@ -1049,9 +853,18 @@ class ModelVisibilitySettingsAdmin(admin.ModelAdmin):
     readonly_fields = ('last_modified', 'modified_by')
 
     def save_model(self, request, obj, form, change):
-        super().save_model(request, obj, form, change)
         obj.modified_by = request.user
-        cache.delete(f'model_visibility_{obj.model_name}')  # Clear cache on save
+        super().save_model(request, obj, form, change)
+        # Every process reloads its ModelVisibilityMiddleware snapshot on the next request
+        cache_tags.invalidate(cache_tags.MODEL_VISIBILITY)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        cache_tags.invalidate(cache_tags.MODEL_VISIBILITY)
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        cache_tags.invalidate(cache_tags.MODEL_VISIBILITY)
 
 class BadgeZipUploadForm(forms.Form):
     """Form for uploading a zip file containing badge images."""
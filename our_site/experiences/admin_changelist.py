@@ -0,0 +1,79 @@
+import hashlib
+
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import InvalidPage
+
+from . import cache_tags, result_cache
+
+
+class CachedRowsChangeList(ChangeList):
+    """
+    Changelist that caches the rows of each result page as compact tuples.
+
+    The model admin lists the columns it displays in ``changelist_row_fields``
+    and the tags that invalidate them in ``changelist_cache_tags``.  Columns
+    computed from other tables come from ``get_changelist_row_data()``, which
+    receives the whole page at once and is cached with it.  On a hit the page,
+    its counts and the paginator are rebuilt without any query.
+    """
+
+    def get_results_cache_key(self, request):
+        params = request.GET.urlencode()
+        digest = hashlib.md5('&'.join(sorted(params.split('&'))).encode()).hexdigest()
+        return f'changelist_rows_{self.opts.label_lower}_{request.user.pk}_{digest}'
+
+    def get_results(self, request):
+        model_admin = self.model_admin
+        fields = model_admin.changelist_row_fields
+        key = self.get_results_cache_key(request)
+        tags = model_admin.changelist_cache_tags
+
+        cached = cache_tags.get(key, tags)
+        if cached is not None and 'row_data' in cached and result_cache.is_valid(cached['rows'], fields):
+            result_count = cached['result_count']
+            full_result_count = cached['full_result_count']
+            paginator = model_admin.get_paginator(request, self.queryset, self.list_per_page)
+            # Seed the cached_property so the paginator never runs COUNT(*)
+            paginator.count = result_count
+            result_list = result_cache.load(self.model, cached['rows'], self.queryset.db)
+            row_data = cached['row_data']
+        else:
+            paginator = model_admin.get_paginator(request, self.queryset, self.list_per_page)
+            result_count = paginator.count
+            if model_admin.show_full_result_count:
+                full_result_count = self.root_queryset.count()
+            else:
+                full_result_count = None
+
+            if (self.show_all and result_count <= self.list_max_show_all) or result_count <= self.list_per_page:
+                page_queryset = self.queryset._clone()
+            else:
+                try:
+                    page_queryset = paginator.page(self.page_num).object_list
+                except InvalidPage:
+                    raise IncorrectLookupParameters
+
+            rows = result_cache.dump(page_queryset, fields)
+            result_list = result_cache.load(self.model, rows, self.queryset.db)
+            row_data = model_admin.get_changelist_row_data(result_list)
+            cache_tags.set(key, {
+                'result_count': result_count,
+                'full_result_count': full_result_count,
+                'rows': rows,
+                'row_data': row_data,
+            }, tags, model_admin.changelist_cache_timeout)
+
+        for obj in result_list:
+            obj._changelist_row_data = row_data.get(obj.pk, {})
+
+        self.result_count = result_count
+        self.show_full_result_count = model_admin.show_full_result_count
+        # Admin actions are shown if there is at least one entry
+        # or if entries are not counted because show_full_result_count is disabled
+        self.show_admin_actions = not self.show_full_result_count or bool(full_result_count)
+        self.full_result_count = full_result_count
+        self.result_list = result_list
+        self.can_show_all = result_count <= self.list_max_show_all
+        self.multi_page = result_count > self.list_per_page
+        self.paginator = paginator
@@ -5,6 +5,8 @@ from django.core.cache import cache
 import datetime
 import json
 
+from .models import normalize_years
+
 class YearSelectorWidget(forms.Widget):
     """
     A custom widget that displays a list of checkboxes for year selection.
@@ -23,17 +25,8 @@ class YearSelectorWidget(forms.Widget):
     def get_context(self, name, value, attrs):
         context = super().get_context(name, value, attrs)
         
-        # Convert value from JSON list [2020, 2024, 2025] to a list of years if it exists
-        current_years = set()
-        if value:
-            if isinstance(value, list):
-                current_years = set(value)
-            else:
-                try:
-                    # Handle case when it might come in as a string
-                    current_years = set(json.loads(value))
-                except (TypeError, json.JSONDecodeError):
-                    current_years = set()
+        # The value is a JSON list [2020, 2024, 2025], or its string when the form is redisplayed
+        current_years = set(normalize_years(value))
         
         # Try to get year choices from cache
         cache_key = 'year_selector_choices'
@@ -0,0 +1,120 @@
+"""
+Tag-based cache invalidation for the experiences admin.
+
+Entries are stored under a key that embeds the current generation of every
+tag they depend on (e.g. ``group:42`` or ``participation-list``).  Invalidating
+a tag is a single version bump: every key built from the old generation simply
+stops being looked up and ages out of the cache on its own, so admin saves no
+longer need to sweep per-user or per-page keys.
+"""
+import time
+
+from django.core.cache import cache
+
+TAG_VERSION_PREFIX = 'cache_tag_version:'
+
+# Tags shared by the admin list views
+GROUP_LIST = 'group-list'
+PERSON_LIST = 'person-list'
+PARTICIPATION_LIST = 'participation-list'
+# Carried by every ParticipationInline entry so role changes can drop them all
+PARTICIPATION_INLINES = 'participation-inlines'
+# The facilitator index and facilitator role ids (see facilitators.py)
+FACILITATORS = 'facilitators'
+# The guardian/student adjacency index (see guardianship.py)
+GUARDIANSHIP = 'guardianship'
+# ModelVisibilitySettings snapshot of ModelVisibilityMiddleware
+MODEL_VISIBILITY = 'model-visibility'
+
+
+def group_tag(pk):
+    return f'group:{pk}'
+
+
+def person_tag(pk):
+    return f'person:{pk}'
+
+
+def _version_key(tag):
+    return f'{TAG_VERSION_PREFIX}{tag}'
+
+
+def _new_generation():
+    # Seed from the clock rather than 1 so a version key that was culled from
+    # the cache can never come back at a value an old entry was stored under.
+    return int(time.time() * 1000)
+
+
+def get_tag_versions(tags):
+    """Return a {tag: generation} dict, initialising any unknown tags."""
+    keys = {_version_key(tag): tag for tag in tags}
+    found = cache.get_many(keys)
+    versions = {}
+    for key, tag in keys.items():
+        version = found.get(key)
+        if version is None:
+            version = _new_generation()
+            if not cache.add(key, version, timeout=None):
+                version = cache.get(key, version)
+        versions[tag] = version
+    return versions
+
+
+def make_key(key, tags):
+    """Build the concrete cache key for ``key`` under the current tag generations."""
+    if not tags:
+        return key
+    versions = get_tag_versions(tags)
+    suffix = '.'.join(str(versions[tag]) for tag in sorted(versions))
+    return f'{key}@{suffix}'
+
+
+def get(key, tags, default=None):
+    return cache.get(make_key(key, tags), default)
+
+
+def set(key, value, tags, timeout=None):
+    cache.set(make_key(key, tags), value, timeout)
+
+
+def invalidate(*tags):
+    """Invalidate every entry registered under any of ``tags``."""
+    for tag in tags:
+        key = _version_key(tag)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Unknown tag: nothing can be cached under it yet, just seed it
+            cache.set(key, _new_generation(), timeout=None)
+
+
+class TaggedMemo:
+    """
+    A value built from the database (e.g. the facilitator or guardianship
+    index), shared through the cache under ``tags`` and kept in process memory
+    until one of the tags is invalidated.  Only the value of the current tag
+    generations is held, keyed by its concrete (versioned) cache key.
+    """
+    def __init__(self, key, tags, build, timeout):
+        self.key = key
+        self.tags = tags
+        self.build = build
+        self.timeout = timeout
+        self.memo = {}
+
+    def get(self, refresh=False):
+        key = make_key(self.key, self.tags)
+        if not refresh and key in self.memo:
+            return self.memo[key]
+
+        value = None if refresh else cache.get(key)
+        if value is None:
+            value = self.build()
+            cache.set(key, value, self.timeout)
+        self.memo.clear()
+        self.memo[key] = value
+        return value
+
+    def clear(self):
+        """Forget the in-process copy; the next get() reads the cache."""
+        self.memo.clear()
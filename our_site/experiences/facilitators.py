@@ -0,0 +1,87 @@
+"""
+Facilitator index for the group admin.
+
+Answers "who facilitates group G (in school year Y)" for any number of groups
+from one prebuilt map instead of a Person and Participation query per group.
+The index is built with a single query, stored in the cache under the
+``facilitators`` tag and kept in process memory until the tag is invalidated
+by the Participation, Person, Role and User signals in models.py.
+"""
+from django.utils import timezone
+
+from . import cache_tags
+from .models import Participation, Role
+
+INDEX_KEY = 'facilitator_index'
+INDEX_TIMEOUT = 60 * 60 * 24  # 1 day; the tag is bumped on every relevant change
+
+
+def current_school_year(date=None):
+    """School years run from September to August, so March 2025 is in school year 2024."""
+    date = date or timezone.now()
+    return date.year if date.month >= 9 else date.year - 1
+
+
+def get_facilitator_role_ids():
+    role_ids = cache_tags.get('facilitator_role_ids', (cache_tags.FACILITATORS,))
+    if role_ids is None:
+        role_ids = list(Role.objects.filter(title__iexact='facilitator').values_list('id', flat=True))
+        cache_tags.set('facilitator_role_ids', role_ids, (cache_tags.FACILITATORS,), INDEX_TIMEOUT)
+    return role_ids
+
+
+def build_index():
+    """
+    Build the index in one query.
+
+    The years come from the ParticipationYear table, joined in: one row per
+    participation and year, with a NULL year for participations without any.
+    Returns ``{'all': {group_id: [names]}, 'years': {year: {group_id: [names]}}}``
+    with names sorted alphabetically.
+    """
+    participations = Participation.objects.filter(
+        person__role__title__iexact='facilitator'
+    ).values_list(
+        'group_id', 'year_rows__year', 'person__user__first_name', 'person__user__last_name', 'person__user__username'
+    )
+
+    all_years = {}
+    by_year = {}
+    for group_id, year, first_name, last_name, username in participations:
+        name = f'{first_name} {last_name}'.strip() or username
+        names = all_years.setdefault(group_id, [])
+        if name not in names:
+            names.append(name)
+        if year is not None:
+            names = by_year.setdefault(year, {}).setdefault(group_id, [])
+            if name not in names:
+                names.append(name)
+    for groups in [all_years, *by_year.values()]:
+        for names in groups.values():
+            names.sort(key=str.lower)
+    return {'all': all_years, 'years': by_year}
+
+
+_index = cache_tags.TaggedMemo(INDEX_KEY, (cache_tags.FACILITATORS,), build_index, INDEX_TIMEOUT)
+
+
+def get_index(refresh=False):
+    return _index.get(refresh)
+
+
+def get_facilitators(group_ids, year=None):
+    """
+    Return {group_id: [facilitator names]} for ``group_ids``.
+
+    With ``year`` only facilitators who participated in that school year are
+    listed, otherwise every facilitator of the group.
+    """
+    index = get_index()
+    groups = index['all'] if year is None else index['years'].get(year, {})
+    return {group_id: groups.get(group_id, []) for group_id in group_ids}
+
+
+def rebuild():
+    """Invalidate and rebuild the index, for the admin action and the management command."""
+    cache_tags.invalidate(cache_tags.FACILITATORS)
+    return get_index(refresh=True)
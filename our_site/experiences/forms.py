@@ -1,6 +1,7 @@
 from django import forms
 from .models import Role, Person, Group, Participation, CoreCompetency, Theme, Badges, Pathways
 from .admin_widgets import YearSelectorWidget
+from .principal import Principal
 from django.contrib.auth.models import User
 from django.utils.crypto import get_random_string
 import json
@@ -222,18 +223,22 @@ class ParticipationForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         self.user = kwargs.pop('user', None)
+        # Views pass the request's principal so admin status and the Person are looked up once
+        self.principal = kwargs.pop('principal', None)
+        if self.principal is None and self.user:
+            self.principal = Principal(self.user)
         super(ParticipationForm, self).__init__(*args, **kwargs)
         
         # Restrict person choices based on user permissions
-        if self.user and not (self.user.is_superuser or self.user.groups.filter(name='Administrators').exists()):
-            try:
+        if self.principal and not self.principal.is_admin:
+            person = self.principal.person
+            if person is not None:
                 # If not admin/superuser, only allow selecting themselves
-                person = Person.objects.get(user=self.user)
                 self.fields['person'].queryset = Person.objects.filter(id=person.id)
                 self.fields['person'].initial = person
                 self.fields['person'].widget.attrs['disabled'] = True  # Make it read-only
                 self.fields['person'].required = False  # Not required in form since we'll set it in save
-            except Person.DoesNotExist:
+            else:
                 # If no person record, empty queryset
                 self.fields['person'].queryset = Person.objects.none()
 
@@ -247,10 +252,9 @@ class ParticipationForm(forms.ModelForm):
         person = self.cleaned_data.get("person", None)
         
         # If the field is disabled, it won't be in cleaned_data, so we need to get it manually
-        if not person and self.user and not (self.user.is_superuser or self.user.groups.filter(name='Administrators').exists()):
-            try:
-                person = Person.objects.get(user=self.user)
-            except Person.DoesNotExist:
+        if not person and self.principal and not self.principal.is_admin:
+            person = self.principal.person
+            if person is None:
                 raise forms.ValidationError("User profile not found.")
                 
         return person
@@ -289,11 +293,9 @@ class ParticipationForm(forms.ModelForm):
         instance = super(ParticipationForm, self).save(commit=False)
         
         # If person is None (because disabled field), set it
-        if instance.person is None and self.user and not (self.user.is_superuser or self.user.groups.filter(name='Administrators').exists()):
-            try:
-                instance.person = Person.objects.get(user=self.user)
-            except Person.DoesNotExist:
-                pass
+        if instance.person_id is None and self.principal and not self.principal.is_admin:
+            if self.principal.person is not None:
+                instance.person = self.principal.person
                 
         if commit:
             instance.save()
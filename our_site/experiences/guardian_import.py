@@ -0,0 +1,160 @@
+"""
+Import of guardian-student relationships from a CSV (PersonAdmin "Import
+Guardians", run as a background job by import_jobs.py, and
+``manage.py import_guardians``).
+
+Each row names the guardian and the student by email; both must already
+have a person.  The admin view and the command used to look up the two users
+and the two people and get_or_create the relationship one row at a time, five
+or more queries per row.  ``GuardianImporter`` works on chunks of rows
+instead:
+
+* the people of all the chunk's emails are read with one query (users
+  without a person come back with a NULL person id), into a dict,
+* the relationships of those guardians with one more,
+* new relationships are written with one bulk_create(ignore_conflicts=True),
+  so a pair inserted concurrently is not an error, and changed ones (a new
+  ``relationship`` label, or reactivated) with one bulk_update,
+* the person list and guardianship caches are invalidated once, by
+  ``finish()``, as bulk writes send no signals.
+
+A row of a pair that is already active with the same label is "unchanged".
+"""
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from . import cache_tags
+from .models import GuardianStudent
+from .people_import import LOOKUP_BATCH_SIZE, ImportResult, chunked
+
+REQUIRED_COLUMNS = ('guardian_email', 'student_email', 'relationship')
+
+
+def missing_columns(fieldnames):
+    return [column for column in REQUIRED_COLUMNS if column not in (fieldnames or ())]
+
+
+class GuardianImporter:
+    """
+    Imports rows chunk by chunk, with the same interface as PeopleImporter.
+
+    Everything but ``write`` only reads; import_preview.py runs it over a
+    whole file without writing.
+    """
+    def __init__(self):
+        self.result = ImportResult()
+
+    def parse(self, rows, result):
+        """
+        The fields of the valid rows of ``rows``, a list of ``(line number,
+        CSV row dict)``; the others are recorded as skipped in ``result``.
+        """
+        parsed = []
+        for line, row in rows:
+            guardian_email = (row.get('guardian_email') or '').strip()
+            student_email = (row.get('student_email') or '').strip()
+            relationship = (row.get('relationship') or '').strip()
+            if not guardian_email or not student_email or not relationship:
+                result.skip(line, row, "Missing required fields")
+                continue
+            parsed.append((line, row, guardian_email, student_email, relationship))
+        return parsed
+
+    def load_people(self, emails):
+        """The person ids (None for a user without a person) of the users with each of ``emails``."""
+        people = {}
+        for batch in chunked(sorted(emails), LOOKUP_BATCH_SIZE):
+            for email, person_id in User.objects.filter(email__in=batch).values_list('email', 'person'):
+                people.setdefault(email, []).append(person_id)
+        return people
+
+    def find(self, people, email, label):
+        """The person id of ``email``, or None and the reason there is none."""
+        person_ids = people.get(email)
+        if not person_ids:
+            return None, f"{label} with email '{email}' not found"
+        if len(person_ids) > 1:
+            return None, f"{len(person_ids)} users have the email '{email}'"
+        if person_ids[0] is None:
+            return None, f"{label} person record for '{email}' not found"
+        return person_ids[0], None
+
+    def resolve(self, parsed, people, result):
+        """The ``parsed`` rows with the person ids of their guardian and student; rows without are skipped."""
+        pairs = []
+        for line, row, guardian_email, student_email, relationship in parsed:
+            guardian_id, error = self.find(people, guardian_email, 'Guardian')
+            if error is None:
+                student_id, error = self.find(people, student_email, 'Student')
+            if error is not None:
+                result.skip(line, row, error)
+                continue
+            pairs.append((line, row, guardian_id, student_id, relationship))
+        return pairs
+
+    def load_relations(self, pairs):
+        """The relationships of the guardians of ``pairs``, by (guardian id, student id)."""
+        relations = {}
+        for batch in chunked(sorted({pair[2] for pair in pairs}), LOOKUP_BATCH_SIZE):
+            for relation in GuardianStudent.objects.filter(guardian_id__in=batch).only(
+                'guardian_id', 'student_id', 'relationship', 'is_active',
+            ):
+                relations[relation.guardian_id, relation.student_id] = relation
+        return relations
+
+    def plan(self, pairs, relations, result):
+        """
+        Work out in memory what the rows of ``pairs`` change and record each
+        row's outcome in ``result``.  Returns the relationships to create and
+        to update, for ``write()``.
+        """
+        new_relations = {}
+        changed = {}
+        for line, row, guardian_id, student_id, relationship in pairs:
+            key = (guardian_id, student_id)
+            relation = relations.get(key)
+            if relation is None:
+                relation = GuardianStudent(
+                    guardian_id=guardian_id, student_id=student_id, relationship=relationship,
+                    notes=(row.get('notes') or '').strip(), is_active=True,
+                )
+                relations[key] = new_relations[key] = relation
+                result.record(line, row, ImportResult.CREATED)
+                continue
+            changes = []
+            if relation.relationship != relationship:
+                changes.append(f"relationship: '{relation.relationship}' -> '{relationship}'")
+                relation.relationship = relationship
+            if not relation.is_active:
+                changes.append("reactivated")
+                relation.is_active = True
+            if not changes:
+                result.record(line, row, ImportResult.UNCHANGED)
+                continue
+            if relation.pk is not None:
+                changed[key] = relation
+            result.record(line, row, ImportResult.UPDATED, '; '.join(changes))
+        return list(new_relations.values()), list(changed.values())
+
+    def import_chunk(self, rows):
+        """
+        Import ``rows``, a list of ``(line number, CSV row dict)``, in one
+        transaction and return their ImportResult.
+        """
+        chunk = ImportResult()
+        parsed = self.parse(rows, chunk)
+        pairs = self.resolve(parsed, self.load_people({email for fields in parsed for email in fields[2:4]}), chunk)
+        self.write(*self.plan(pairs, self.load_relations(pairs), chunk))
+        chunk.outcomes.sort(key=lambda outcome: outcome[0])
+        return chunk
+
+    def write(self, new_relations, changed):
+        with transaction.atomic():
+            GuardianStudent.objects.bulk_create(new_relations, ignore_conflicts=True)
+            if changed:
+                GuardianStudent.objects.bulk_update(changed, ['relationship', 'is_active'])
+
+    def finish(self):
+        # The bulk writes sent no post_save signals
+        cache_tags.invalidate(cache_tags.PERSON_LIST, cache_tags.GUARDIANSHIP)
+        return self.result
@@ -0,0 +1,77 @@
+"""
+Guardian/student adjacency index for permission checks.
+
+"Is V a guardian or student of P" used to be a GuardianStudent query per check.
+The index holds every active GuardianStudent edge in both directions, is built
+with a single query, stored in the cache under the ``guardianship`` tag and kept
+in process memory until the GuardianStudent signals in models.py invalidate the
+tag, so single and bulk reachability checks never touch the database.
+"""
+
+from . import cache_tags
+from .models import GuardianStudent
+
+INDEX_KEY = 'guardianship_index'
+INDEX_TIMEOUT = 60 * 60 * 24  # 1 day; the tag is bumped on every relationship change
+
+EMPTY = frozenset()
+
+
+def build_index():
+    """
+    Build the index in one query.
+
+    Returns ``{'students': {guardian_id: frozenset(student_ids)},
+    'guardians': {student_id: frozenset(guardian_ids)}}`` for active edges.
+    """
+    students = {}
+    guardians = {}
+    edges = GuardianStudent.objects.filter(is_active=True).values_list('guardian_id', 'student_id')
+    for guardian_id, student_id in edges:
+        students.setdefault(guardian_id, set()).add(student_id)
+        guardians.setdefault(student_id, set()).add(guardian_id)
+    return {
+        'students': {pk: frozenset(ids) for pk, ids in students.items()},
+        'guardians': {pk: frozenset(ids) for pk, ids in guardians.items()},
+    }
+
+
+_index = cache_tags.TaggedMemo(INDEX_KEY, (cache_tags.GUARDIANSHIP,), build_index, INDEX_TIMEOUT)
+
+
+def get_index(refresh=False):
+    return _index.get(refresh)
+
+
+def students_of(person_id):
+    """Ids of the people ``person_id`` is an active guardian of."""
+    return get_index()['students'].get(person_id, EMPTY)
+
+
+def guardians_of(person_id):
+    """Ids of the active guardians of ``person_id``."""
+    return get_index()['guardians'].get(person_id, EMPTY)
+
+
+def can_view(viewer_id, person_id):
+    """True if the viewer is the person, one of their guardians or one of their students."""
+    if viewer_id is None:
+        return False
+    return (
+        viewer_id == person_id
+        or person_id in students_of(viewer_id)
+        or person_id in guardians_of(viewer_id)
+    )
+
+
+def listed_ids(viewer_id):
+    """The people whose records the list pages show the viewer: themselves and their students."""
+    if viewer_id is None:
+        return EMPTY
+    return students_of(viewer_id) | {viewer_id}
+
+
+def rebuild():
+    """Invalidate and rebuild the index, e.g. after GuardianStudent rows were bulk written."""
+    cache_tags.invalidate(cache_tags.GUARDIANSHIP)
+    return get_index(refresh=True)
@@ -0,0 +1,356 @@
+"""
+Background runner for the CSV imports of PersonAdmin ("Import People" and
+"Import Guardians").
+
+``submit`` stores the upload as ``imports/<job id>/upload.csv``, records an
+``ImportJob`` and hands it to a process-wide thread pool once the surrounding
+transaction commits (as backup_jobs does), so the request returns at once.
+The job reads the upload in chunks of IMPORT_CHUNK_SIZE rows and writes each
+chunk in one transaction together with its checkpoint: the rows done so far,
+the counters and the committed size of the report files.  The outcome of
+every row (the row itself, created/updated/skipped and the message) is
+appended to ``report.csv``, and the credentials of new users to
+``credentials.csv``; both are flushed to disk before the chunk commits, so
+no list of errors or credentials grows in memory or in the session.
+
+A job whose process died stays "running" with a ``checkpoint_at`` older than
+IMPORT_JOB_STALE_AFTER seconds.  ``resume`` (the Resume button of the job
+page, or ``manage.py resume_import_jobs``) queues it again, as it does
+failed jobs: the report files are cut back to the checkpoint and the import
+carries on after the last committed row.
+
+A job's page, status, report and resume are only for the admin who submitted
+it and superusers.  Only the admin who submitted a job can download its
+credentials, once, and only for IMPORT_CREDENTIALS_EXPIRE_AFTER seconds after the job finished.
+``clean_up`` (run after every job, and by ``manage.py clean_import_jobs``)
+deletes the credentials that expired, and the whole directory of jobs that
+finished IMPORT_FILES_EXPIRE_AFTER seconds ago or no longer exist.
+"""
+import csv
+import datetime
+import itertools
+import os
+import shutil
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from io import TextIOWrapper
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from . import guardian_import, people_import
+from .models import ImportJob
+from .people_import import ImportResult
+
+DEFAULT_WORKERS = 1
+DEFAULT_STALE_AFTER = 300  # seconds without a checkpoint before a running job counts as interrupted
+DEFAULT_CREDENTIALS_EXPIRE_AFTER = 60 * 60 * 24  # seconds after the job finished
+DEFAULT_FILES_EXPIRE_AFTER = 60 * 60 * 24 * 30
+UPLOAD_FILE = 'upload.csv'
+REPORT_FILE = 'report.csv'
+CREDENTIALS_FILE = 'credentials.csv'
+CREDENTIALS_COLUMNS = ['Username', 'Email', 'Password', 'Name']
+CHECKPOINT_FIELDS = [
+    'rows_processed', 'created_count', 'updated_count', 'unchanged_count', 'skipped_count', 'users_created',
+    'checkpoint', 'checkpoint_at',
+]
+MISSING_COLUMNS = {
+    'people': people_import.missing_columns,
+    'guardians': guardian_import.missing_columns,
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'IMPORT_JOB_WORKERS', DEFAULT_WORKERS),
+                thread_name_prefix='import-job',
+            )
+        return _executor
+
+
+def get_root():
+    return os.path.join(settings.BASE_DIR, 'imports')
+
+
+def get_path(job_id, name):
+    return os.path.join(get_root(), str(job_id), name)
+
+
+def get_importer(job):
+    if job.kind == 'people':
+        return people_import.PeopleImporter(job.options.get('create_users', False))
+    return guardian_import.GuardianImporter()
+
+
+def read_header(upload):
+    """The column names of the uploaded CSV ``upload``, leaving it rewound."""
+    wrapper = TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+    try:
+        return csv.DictReader(wrapper).fieldnames
+    finally:
+        # Do not let the wrapper close the upload
+        wrapper.detach()
+        upload.seek(0)
+
+
+def missing_columns(kind, upload):
+    return MISSING_COLUMNS[kind](read_header(upload))
+
+
+def submit(kind, upload, options=None, user=None):
+    """Store ``upload`` and queue its import of ``kind`` (an ImportJob.KIND_CHOICES key); return the job."""
+    if kind not in MISSING_COLUMNS:
+        raise ValueError(f"Unknown import kind '{kind}'")
+    job = ImportJob.objects.create(kind=kind, options=options or {}, created_by=user)
+    path = get_path(job.pk, UPLOAD_FILE)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        for chunk in upload.chunks():
+            f.write(chunk)
+    transaction.on_commit(lambda: get_executor().submit(work, job.pk))
+    return job
+
+
+def is_resumable(job):
+    """Whether ``job`` failed, or is queued or running but has not checkpointed for IMPORT_JOB_STALE_AFTER seconds."""
+    if not os.path.exists(get_path(job.pk, UPLOAD_FILE)):
+        return False
+    if job.state == ImportJob.FAILED:
+        return True
+    if job.is_active:
+        stale_after = getattr(settings, 'IMPORT_JOB_STALE_AFTER', DEFAULT_STALE_AFTER)
+        return timezone.now() - (job.checkpoint_at or job.created_at) > datetime.timedelta(seconds=stale_after)
+    return False
+
+
+def requeue(job):
+    """Mark a resumable ``job`` queued again; False when it is not resumable or someone else did it first."""
+    if not is_resumable(job):
+        return False
+    return bool(ImportJob.objects.filter(pk=job.pk, state=job.state, checkpoint_at=job.checkpoint_at).update(
+        state=ImportJob.QUEUED, finished_at=None,
+    ))
+
+
+def resume(job):
+    """Queue ``job`` again from its checkpoint; returns whether it was."""
+    if not requeue(job):
+        return False
+    transaction.on_commit(lambda: get_executor().submit(work, job.pk))
+    return True
+
+
+def is_expired(job, setting, default, now=None):
+    """Whether ``job`` finished more than the ``setting`` seconds ago."""
+    if job.is_active or job.finished_at is None:
+        return False
+    expire_after = datetime.timedelta(seconds=getattr(settings, setting, default))
+    return (now or timezone.now()) - job.finished_at > expire_after
+
+
+def can_view(job, user):
+    """Whether ``user`` may see ``job``'s progress and report, and resume it."""
+    return user.is_superuser or (job.created_by_id is not None and job.created_by_id == user.pk)
+
+
+def get_credentials_path(job, user):
+    """The credentials file of ``job`` if ``user`` may download it, else None."""
+    if job.created_by_id is None or job.created_by_id != user.pk or job.is_active:
+        return None
+    if is_expired(job, 'IMPORT_CREDENTIALS_EXPIRE_AFTER', DEFAULT_CREDENTIALS_EXPIRE_AFTER):
+        return None
+    path = get_path(job.pk, CREDENTIALS_FILE)
+    return path if os.path.exists(path) else None
+
+
+def clean_up(now=None):
+    """
+    Delete the expired credentials files, and the directories of jobs that
+    finished IMPORT_FILES_EXPIRE_AFTER seconds ago or were deleted; returns
+    the number of each.
+    """
+    now = now or timezone.now()
+    try:
+        job_ids = [int(name) for name in os.listdir(get_root()) if name.isdigit()]
+    except FileNotFoundError:
+        return 0, 0
+    jobs = ImportJob.objects.in_bulk(job_ids)
+    files_expire_after = getattr(settings, 'IMPORT_FILES_EXPIRE_AFTER', DEFAULT_FILES_EXPIRE_AFTER)
+    credentials = directories = 0
+    for job_id in job_ids:
+        directory = os.path.join(get_root(), str(job_id))
+        job = jobs.get(job_id)
+        if job is None:
+            # The job of a submit whose transaction has not committed yet is not visible here
+            age = now.timestamp() - os.path.getmtime(directory)
+            expired = age > files_expire_after
+        else:
+            expired = is_expired(job, 'IMPORT_FILES_EXPIRE_AFTER', DEFAULT_FILES_EXPIRE_AFTER, now)
+        if expired:
+            shutil.rmtree(directory, ignore_errors=True)
+            directories += 1
+            continue
+        path = get_path(job_id, CREDENTIALS_FILE)
+        if (
+            job is not None and os.path.exists(path)
+            and is_expired(job, 'IMPORT_CREDENTIALS_EXPIRE_AFTER', DEFAULT_CREDENTIALS_EXPIRE_AFTER, now)
+        ):
+            os.remove(path)
+            credentials += 1
+    return credentials, directories
+
+
+class Reports:
+    """
+    The report files of a job, opened for appending after their committed
+    part (``sizes``, the job's checkpoint).
+    """
+    def __init__(self, job, fieldnames, stack):
+        self.fieldnames = fieldnames
+        headers = {REPORT_FILE: ['line', *fieldnames, 'result', 'message']}
+        if job.kind == 'people':
+            headers[CREDENTIALS_FILE] = CREDENTIALS_COLUMNS
+        self.files = {}
+        for name, header in headers.items():
+            path = get_path(job.pk, name)
+            # The credentials are deleted once downloaded; start them again then
+            size = job.checkpoint.get(name, 0) if os.path.exists(path) else 0
+            f = stack.enter_context(open(path, 'a', newline='', encoding='utf-8'))
+            f.truncate(size)
+            if not size:
+                csv.writer(f).writerow(header)
+            self.files[name] = f
+        self.sizes = self.sync()
+
+    def sync(self):
+        sizes = {}
+        for name, f in self.files.items():
+            f.flush()
+            os.fsync(f.fileno())
+            sizes[name] = os.fstat(f.fileno()).st_size
+        return sizes
+
+    def write(self, result):
+        """Append the rows of ``result`` after the committed part; returns the new sizes."""
+        for name, f in self.files.items():
+            f.truncate(self.sizes[name])
+        report = csv.writer(self.files[REPORT_FILE])
+        for line, row, outcome, message in result.outcomes:
+            report.writerow([line, *(row.get(column) for column in self.fieldnames), outcome, message])
+        if CREDENTIALS_FILE in self.files:
+            credentials = csv.writer(self.files[CREDENTIALS_FILE])
+            for user in result.created_users:
+                credentials.writerow([user['username'], user['email'], user['password'], user['name']])
+        return self.sync()
+
+
+def save_checkpoint(job, result, sizes):
+    job.rows_processed += result.rows
+    job.created_count += result.created
+    job.updated_count += result.updated
+    job.unchanged_count += result.unchanged
+    job.skipped_count += result.skipped
+    job.users_created += len(result.created_users)
+    job.checkpoint = sizes
+    job.checkpoint_at = timezone.now()
+    job.save(update_fields=CHECKPOINT_FIELDS)
+
+
+def import_chunk(job, importer, reports, chunk):
+    try:
+        with transaction.atomic():
+            result = importer.import_chunk(chunk)
+            save_checkpoint(job, result, reports.write(result))
+    except Exception as e:
+        job.refresh_from_db(fields=CHECKPOINT_FIELDS)
+        result = ImportResult.failed(chunk, e)
+        with transaction.atomic():
+            save_checkpoint(job, result, reports.write(result))
+    reports.sizes = job.checkpoint
+
+
+def run(job):
+    path = get_path(job.pk, UPLOAD_FILE)
+    if job.rows_total is None:
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            job.rows_total = sum(1 for _ in csv.DictReader(f))
+        job.save(update_fields=['rows_total'])
+
+    chunk_size = getattr(settings, 'IMPORT_CHUNK_SIZE', people_import.DEFAULT_CHUNK_SIZE)
+    importer = get_importer(job)
+    try:
+        with ExitStack() as stack:
+            reader = csv.DictReader(stack.enter_context(open(path, newline='', encoding='utf-8-sig')))
+            reports = Reports(job, reader.fieldnames or [], stack)
+            job.checkpoint = reports.sizes
+            job.save(update_fields=['checkpoint'])
+            rows = ((reader.line_num, row) for row in reader)
+            for chunk in people_import.chunked(itertools.islice(rows, job.rows_processed, None), chunk_size):
+                import_chunk(job, importer, reports, chunk)
+    finally:
+        importer.finish()
+
+
+def run_job(job_id):
+    """Run a queued job from its checkpoint, recording its outcome on the job."""
+    now = timezone.now()
+    # Claim the job, so that a job queued twice by resume() runs once
+    claimed = ImportJob.objects.filter(pk=job_id, state=ImportJob.QUEUED).update(
+        state=ImportJob.RUNNING, checkpoint_at=now, errors='',
+    )
+    job = ImportJob.objects.get(pk=job_id)
+    if not claimed:
+        return job
+    if job.started_at is None:
+        job.started_at = now
+        job.save(update_fields=['started_at'])
+
+    try:
+        run(job)
+    except Exception:
+        job.state = ImportJob.FAILED
+        job.errors = traceback.format_exc()
+    else:
+        job.state = ImportJob.SUCCEEDED
+        # Only needed to resume
+        os.remove(get_path(job.pk, UPLOAD_FILE))
+    job.finished_at = timezone.now()
+    job.save(update_fields=['state', 'errors', 'finished_at'])
+    return job
+
+
+def work(job_id):
+    """Entry point of the pool threads."""
+    try:
+        run_job(job_id)
+        clean_up()
+    finally:
+        # Pool threads keep their own connections between jobs; do not leave them open
+        connections.close_all()
+
+
+def read_errors(job, limit=10):
+    """The line and message of the first ``limit`` skipped rows of the job's report."""
+    errors = []
+    try:
+        with open(get_path(job.pk, REPORT_FILE), newline='', encoding='utf-8') as f:
+            rows = csv.reader(f)
+            next(rows, None)
+            # line, the row's columns, result, message
+            for row in rows:
+                if row[-2] == ImportResult.SKIPPED:
+                    errors.append(f"Row {row[0]}: {row[-1]}")
+                    if len(errors) >= limit:
+                        break
+    except FileNotFoundError:
+        pass
+    return errors
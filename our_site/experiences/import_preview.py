@@ -0,0 +1,63 @@
+"""
+Dry runs of the people and guardian CSV imports.
+
+The guardian command's --dry-run used to run the whole import in a
+transaction and roll it back: as slow as the import, and holding the SQLite
+write lock all along.  ``preview`` reads the file into memory and runs the
+importers' read-only steps over all of it at once:
+
+* the reference data is read once for the whole file: roles and usernames
+  (people), the users and people of every email in the file, and the
+  guardians' existing relationships, with email__in/guardian_id__in lookups
+  of LOOKUP_BATCH_SIZE values,
+* every row is classified in memory as created, updated (with the fields it
+  changes), unchanged or skipped (with the reason), exactly as the import
+  would, including rows that repeat an email or pair of an earlier row.
+
+Nothing is written, so no write lock is taken and no passwords are hashed.
+"""
+import time
+
+from . import guardian_import, people_import
+from .people_import import ImportResult
+
+REQUIRED_COLUMNS = {
+    'people': people_import.REQUIRED_COLUMNS,
+    'guardians': guardian_import.REQUIRED_COLUMNS,
+}
+
+
+def preview_people(rows, create_users=False):
+    importer = people_import.PeopleImporter(create_users)
+    result = ImportResult()
+    parsed = importer.parse(rows, result)
+    importer.plan(parsed, importer.load_users({fields[2] for fields in parsed}), result)
+    return result
+
+
+def preview_guardians(rows):
+    importer = guardian_import.GuardianImporter()
+    result = ImportResult()
+    parsed = importer.parse(rows, result)
+    pairs = importer.resolve(parsed, importer.load_people({email for fields in parsed for email in fields[2:4]}), result)
+    importer.plan(pairs, importer.load_relations(pairs), result)
+    return result
+
+
+def preview(kind, reader, create_users=False):
+    """
+    What importing the rows of the ``csv.DictReader`` ``reader`` as ``kind``
+    ('people' or 'guardians') would do, as an ImportResult with the outcome of
+    every row, in line order.  ``created_users`` holds no passwords.
+    """
+    start_time = time.time()
+    rows = [(reader.line_num, row) for row in reader]
+    if kind == 'people':
+        result = preview_people(rows, create_users)
+    else:
+        result = preview_guardians(rows)
+    result.outcomes.sort(key=lambda outcome: outcome[0])
+    for user in result.created_users:
+        user['password'] = ''
+    result.elapsed = time.time() - start_time
+    return result
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+import time
+from experiences.models import Participation
+
+class Command(BaseCommand):
+    help = 'Rebuilds the ParticipationYear index table from Participation.years'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of participations synced per transaction (default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        start_time = time.time()
+        total_participations, total_rows = Participation.objects.sync_years(options['batch_size'])
+
+        elapsed_time = time.time() - start_time
+        self.stdout.write(self.style.SUCCESS(
+            f"Synced the years of {total_participations} participations ({total_rows} rows written) in {elapsed_time:.2f} seconds"
+        ))
@@ -0,0 +1,44 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from experiences import password_hashing, people_import
+
+class Command(BaseCommand):
+    help = 'Compares creating users one by one with create_user to hashing in parallel and bulk_create; all changes are rolled back'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100, help='Users to create with each method (default: 100)')
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Hashing processes (default: PASSWORD_HASH_WORKERS, or every core)',
+        )
+
+    def handle(self, *args, **options):
+        passwords = [people_import.generate_password() for _ in range(options['users'])]
+
+        with transaction.atomic():
+            start_time = time.time()
+            for i, password in enumerate(passwords):
+                User.objects.create_user(username=f'benchmark.serial{i}', password=password)
+            serial = time.time() - start_time
+            transaction.set_rollback(True)
+
+        with transaction.atomic():
+            start_time = time.time()
+            with password_hashing.ParallelHasher(options['workers']) as hasher:
+                hashes = hasher.hash(passwords)
+                workers = hasher.workers
+            User.objects.bulk_create(
+                User(username=f'benchmark.parallel{i}', password=hashed) for i, hashed in enumerate(hashes)
+            )
+            parallel = time.time() - start_time
+            transaction.set_rollback(True)
+
+        self.stdout.write(f"create_user, serial: {serial:.2f} seconds ({len(passwords) / serial:.1f} users/s)")
+        self.stdout.write(
+            f"{workers} hashing processes + bulk_create: {parallel:.2f} seconds ({len(passwords) / parallel:.1f} users/s)"
+        )
+        self.stdout.write(self.style.SUCCESS(f"Speedup: {serial / parallel:.1f}x; rolled back"))
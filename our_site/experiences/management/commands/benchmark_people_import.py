@@ -0,0 +1,49 @@
+import csv
+import io
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+from experiences import people_import
+from experiences.models import Role
+
+class Command(BaseCommand):
+    help = 'Imports a generated roster with the bulk people import and reports rows/s; all changes are rolled back'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=3000, help='Roster rows to import (default: 3000)')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=people_import.DEFAULT_CHUNK_SIZE,
+            help=f'Rows written per transaction (default: {people_import.DEFAULT_CHUNK_SIZE})',
+        )
+        parser.add_argument(
+            '--fast-hashing',
+            action='store_true',
+            help='Hash passwords with MD5 to time the database work alone',
+        )
+
+    def handle(self, *args, **options):
+        roster = io.StringIO()
+        writer = csv.writer(roster)
+        writer.writerow(['email', 'role', 'first_name', 'last_name', 'graduating_year'])
+        for i in range(options['rows']):
+            writer.writerow([f'benchmark.student{i}@example.com', 'Student', 'Student', f'Number {i}', 2030])
+        roster.seek(0)
+
+        hashers = ['django.contrib.auth.hashers.MD5PasswordHasher'] if options['fast_hashing'] else None
+        with transaction.atomic(), override_settings(**({'PASSWORD_HASHERS': hashers} if hashers else {})):
+            if not Role.objects.filter(title__iexact='student').exists():
+                Role.objects.create(title='Student')
+            result = people_import.import_people(
+                csv.DictReader(roster), create_users=True, chunk_size=options['chunk_size'],
+            )
+            transaction.set_rollback(True)
+
+        for error in result.errors[:10]:
+            self.stderr.write(error)
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result.rows} rows ({len(result.created_users)} users, {result.created} people) "
+            f"in {result.elapsed:.2f} seconds ({result.rows_per_second:.0f} rows/s); rolled back"
+        ))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from experiences import import_jobs
+
+class Command(BaseCommand):
+    help = 'Deletes the expired credentials of import jobs, and the files of old or deleted import jobs'
+
+    def handle(self, *args, **options):
+        credentials, directories = import_jobs.clean_up()
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {credentials} expired credentials files and {directories} import job directories"
+        ))
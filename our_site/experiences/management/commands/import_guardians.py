@@ -1,8 +1,8 @@
 import csv
+import time
 from django.core.management.base import BaseCommand
-from django.contrib.auth.models import User
-from experiences.models import Person, GuardianStudent
-from django.db import transaction
+from experiences import guardian_import, import_preview, people_import
+from experiences.people_import import ImportResult
 
 class Command(BaseCommand):
     help = 'Import guardian-student relationships from a CSV file'
@@ -12,7 +12,13 @@ class Command(BaseCommand):
         parser.add_argument(
             '--dry-run',
             action='store_true',
-            help='Run the import in dry-run mode (no changes will be made)',
+            help='Show what the import would do, without writing anything',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=people_import.DEFAULT_CHUNK_SIZE,
+            help=f'Rows resolved and written per batch (default: {people_import.DEFAULT_CHUNK_SIZE})',
         )
 
     def handle(self, *args, **options):
@@ -23,70 +29,46 @@ class Command(BaseCommand):
             self.stdout.write(self.style.WARNING('Running in dry-run mode - no changes will be made'))
 
         try:
-            with open(csv_file, 'r') as file:
+            with open(csv_file, 'r', newline='', encoding='utf-8-sig') as file:
                 reader = csv.DictReader(file)
-                
+
                 # Validate CSV headers
-                required_fields = ['guardian_email', 'student_email', 'relationship']
-                missing_fields = [field for field in required_fields if field not in reader.fieldnames]
+                missing_fields = guardian_import.missing_columns(reader.fieldnames)
                 if missing_fields:
                     self.stderr.write(self.style.ERROR(
                         f'Missing required fields in CSV: {", ".join(missing_fields)}'
                     ))
                     return
 
-                # Process each row
-                with transaction.atomic():
-                    for row in reader:
-                        try:
-                            # Get guardian
-                            guardian_user = User.objects.get(email=row['guardian_email'])
-                            guardian = Person.objects.get(user=guardian_user)
-
-                            # Get student
-                            student_user = User.objects.get(email=row['student_email'])
-                            student = Person.objects.get(user=student_user)
-
-                            # Check if relationship already exists
-                            relationship, created = GuardianStudent.objects.get_or_create(
-                                guardian=guardian,
-                                student=student,
-                                defaults={
-                                    'relationship': row['relationship'],
-                                    'notes': row.get('notes', ''),
-                                    'is_active': True
-                                }
-                            )
-
-                            if created:
-                                action = 'Created'
-                            else:
-                                if not relationship.is_active:
-                                    relationship.is_active = True
-                                    relationship.save()
-                                    action = 'Reactivated'
-                                else:
-                                    action = 'Already exists'
-
-                            self.stdout.write(self.style.SUCCESS(
-                                f'{action}: {guardian} -> {student} ({row["relationship"]})'
-                            ))
-
-                        except User.DoesNotExist as e:
-                            self.stderr.write(self.style.WARNING(
-                                f'Skipping row - User not found: {str(e)}'
-                            ))
-                        except Person.DoesNotExist as e:
-                            self.stderr.write(self.style.WARNING(
-                                f'Skipping row - Person not found: {str(e)}'
-                            ))
-                        except Exception as e:
-                            self.stderr.write(self.style.ERROR(
-                                f'Error processing row: {str(e)}'
-                            ))
+                if dry_run:
+                    # Classified in memory, without writing (see import_preview.py)
+                    result = import_preview.preview('guardians', reader)
+                    self.write_outcomes(result, options['verbosity'])
+                else:
+                    start_time = time.time()
+                    importer = guardian_import.GuardianImporter()
+                    # Each batch commits on its own, as in the import jobs, so the write lock
+                    # is held for one batch at a time; a failed batch skips its rows
+                    try:
+                        rows = ((reader.line_num, row) for row in reader)
+                        for chunk in people_import.chunked(rows, options['batch_size']):
+                            try:
+                                result = importer.import_chunk(chunk)
+                            except Exception as e:
+                                result = ImportResult.failed(chunk, e)
+                            importer.result.add(result)
+                            self.write_outcomes(result, options['verbosity'])
+                    finally:
+                        importer.finish()
+                    result = importer.result
+                    result.elapsed = time.time() - start_time
 
+                self.stdout.write(
+                    f'{result.rows} rows: {result.created} created, {result.updated} updated, '
+                    f'{result.unchanged} unchanged, {result.skipped} skipped in {result.elapsed:.2f} seconds '
+                    f'({result.rows_per_second:.0f} rows/s)'
+                )
                 if dry_run:
-                    transaction.set_rollback(True)
                     self.stdout.write(self.style.WARNING('Dry run completed - no changes were made'))
                 else:
                     self.stdout.write(self.style.SUCCESS('Import completed successfully'))
@@ -94,4 +76,20 @@ class Command(BaseCommand):
         except FileNotFoundError:
             self.stderr.write(self.style.ERROR(f'File not found: {csv_file}'))
         except Exception as e:
-            self.stderr.write(self.style.ERROR(f'Error: {str(e)}')) 
\ No newline at end of file
+            self.stderr.write(self.style.ERROR(f'Error: {str(e)}'))
+
+    def write_outcomes(self, result, verbosity):
+        """Skipped rows, and with --verbosity 2 every other row too."""
+        actions = {
+            ImportResult.CREATED: 'Created',
+            ImportResult.UPDATED: 'Updated',
+            ImportResult.UNCHANGED: 'Already exists',
+        }
+        for line, row, outcome, message in result.outcomes:
+            if outcome == ImportResult.SKIPPED:
+                self.stderr.write(self.style.WARNING(f'Skipping row {line} - {message}'))
+            elif verbosity >= 2:
+                self.stdout.write(self.style.SUCCESS(
+                    f'{actions[outcome]}: {row["guardian_email"]} -> {row["student_email"]} ({row["relationship"]})'
+                    + (f' [{message}]' if message else '')
+                ))
@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils import timezone
+import datetime
+import time
+from experiences.models import Person
+
+class Command(BaseCommand):
+    help = 'Rebuilds the cached string representation (cached_str) of people in bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--role',
+            action='store',
+            help='Only rebuild people with this role (id or title, case-insensitive)',
+        )
+        parser.add_argument(
+            '--since',
+            action='store',
+            help='Only rebuild people modified on or after this date (YYYY-MM-DD or ISO datetime)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of people read and written per batch (default: 500)',
+        )
+
+    def handle(self, *args, **options):
+        start_time = time.time()
+        people = Person.objects.all()
+
+        role = options.get('role')
+        if role:
+            if role.isdigit():
+                people = people.filter(role_id=int(role))
+            else:
+                people = people.filter(role__title__iexact=role)
+
+        since = options.get('since')
+        if since:
+            people = people.filter(last_modified__gte=self.parse_since(since))
+
+        total = people.count()
+        updated = people.rebuild_cached_str(batch_size=options['batch_size'])
+
+        elapsed_time = time.time() - start_time
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {total} people, updated {updated} cached strings in {elapsed_time:.2f} seconds"
+        ))
+
+    def parse_since(self, value):
+        since = parse_datetime(value)
+        if since is None:
+            date = parse_date(value)
+            if date is None:
+                raise CommandError(f"Invalid --since value '{value}', expected YYYY-MM-DD or an ISO datetime")
+            since = datetime.datetime.combine(date, datetime.time.min)
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+        return since
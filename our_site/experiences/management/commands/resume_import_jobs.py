@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from experiences import import_jobs
+from experiences.models import ImportJob
+
+class Command(BaseCommand):
+    help = 'Runs the failed and interrupted import jobs again from their checkpoints, in the foreground'
+
+    def add_arguments(self, parser):
+        parser.add_argument('job_ids', nargs='*', type=int, help='Only these jobs (default: all resumable jobs)')
+
+    def handle(self, *args, **options):
+        jobs = ImportJob.objects.exclude(state=ImportJob.SUCCEEDED).order_by('pk')
+        if options['job_ids']:
+            jobs = jobs.filter(pk__in=options['job_ids'])
+
+        resumed = 0
+        for job in jobs:
+            if not import_jobs.requeue(job):
+                continue
+            self.stdout.write(f"Resuming import #{job.pk} after row {job.rows_processed}")
+            job = import_jobs.run_job(job.pk)
+            resumed += 1
+            self.stdout.write(
+                f"Import #{job.pk} {job.state}: {job.rows_processed} rows, {job.created_count} created, "
+                f"{job.updated_count} updated, {job.skipped_count} skipped"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Resumed {resumed} import jobs"))
@@ -1,62 +1,79 @@
 from django.http import Http404
-from django.core.cache import cache
+from . import cache_tags
 from .models import ModelVisibilitySettings
+from .principal import Principal
 import re
 
+DEFAULT_ACCESS_LEVEL = 'staff'  # Used for models without a ModelVisibilitySettings row
+
 class ModelVisibilityMiddleware:
+    # URL prefix of each model's views
+    model_prefixes = {
+        'person': '/experiences/person/',
+        'public_person': '/public/person/',
+        'group': '/experiences/group/',
+        'participation': '/experiences/participation/',
+        'role': '/experiences/role/',
+        'pathways': '/experiences/pathways/',
+        'badges': '/experiences/badges/',
+    }
+
     def __init__(self, get_response):
         self.get_response = get_response
-        # Compile regex patterns for each model URL pattern
-        self.model_patterns = {
-            'person': r'^/experiences/person/',
-            'public_person': r'^/public/person/',
-            'group': r'^/experiences/group/',
-            'participation': r'^/experiences/participation/',
-            'role': r'^/experiences/role/',
-            'pathways': r'^/experiences/pathways/',
-            'badges': r'^/experiences/badges/',
-        }
-        self.patterns = {model: re.compile(pattern) 
-                        for model, pattern in self.model_patterns.items()}
+        # One alternation of named groups resolves the model in a single match
+        self.pattern = re.compile('|'.join(
+            f'(?P<{model}>{re.escape(prefix)})' for model, prefix in self.model_prefixes.items()
+        ))
+        # Snapshot of every model's access level, keyed by the tag generation it was loaded under
+        self.snapshot_key = None
+        self.snapshot = {}
 
     def __call__(self, request):
         # Skip admin URLs
         if request.path.startswith('/admin/'):
             return self.get_response(request)
 
-        # Check if URL matches any of our model patterns
-        for model_name, pattern in self.patterns.items():
-            if pattern.match(request.path):
-                # Public person URLs don't require authentication
-                if model_name == 'public_person':
-                    return self.get_response(request)
-                    
-                access_level = self.get_access_level(model_name)
-                
-                if access_level == 'disabled':
-                    raise Http404("This section is currently disabled")
-                
-                if access_level == 'staff' and not request.user.is_staff:
-                    raise Http404("Staff access required")
-                
-                if access_level == 'authenticated' and not request.user.is_authenticated:
-                    raise Http404("Login required")
-                
-                break
+        match = self.pattern.match(request.path)
+        # Public person URLs don't require authentication
+        if match and match.lastgroup != 'public_person':
+            access_level = self.get_access_level(match.lastgroup)
+
+            if access_level == 'disabled':
+                raise Http404("This section is currently disabled")
+
+            if access_level == 'staff' and not request.user.is_staff:
+                raise Http404("Staff access required")
+
+            if access_level == 'authenticated' and not request.user.is_authenticated:
+                raise Http404("Login required")
 
         return self.get_response(request)
 
     def get_access_level(self, model_name):
-        """Get the access level for a model, using cache if possible."""
-        cache_key = f'model_visibility_{model_name}'
-        access_level = cache.get(cache_key)
-        
-        if access_level is None:
-            try:
-                setting = ModelVisibilitySettings.objects.get(model_name=model_name)
-                access_level = setting.access_level
-                cache.set(cache_key, access_level, timeout=3600)  # 1 hour cache
-            except ModelVisibilitySettings.DoesNotExist:
-                access_level = 'staff'  # Default to staff-only if not configured
-                
-        return access_level 
\ No newline at end of file
+        """Get the access level for a model from the in-process snapshot."""
+        return self.get_snapshot().get(model_name, DEFAULT_ACCESS_LEVEL)
+
+    def get_snapshot(self):
+        """
+        Return {model_name: access_level} for every model, defaults included.
+
+        The snapshot is reloaded with one query only when the model visibility
+        tag has been bumped by the admin; otherwise the only lookup is the tag
+        generation, which the tiered cache serves from process memory.
+        """
+        key = cache_tags.make_key('model_visibility', (cache_tags.MODEL_VISIBILITY,))
+        if key != self.snapshot_key:
+            snapshot = {model: DEFAULT_ACCESS_LEVEL for model in self.model_prefixes}
+            snapshot.update(ModelVisibilitySettings.objects.values_list('model_name', 'access_level'))
+            self.snapshot, self.snapshot_key = snapshot, key
+        return self.snapshot
+
+
+class PrincipalMiddleware:
+    """Attach a lazily evaluated Principal (see principal.py) to every request as request.principal."""
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.principal = Principal(request.user)
+        return self.get_response(request)
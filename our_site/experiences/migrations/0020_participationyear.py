@@ -0,0 +1,57 @@
+# Generated by Django 4.2.30 on 2026-10-17 15:35
+
+import json
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def normalize_years(years):
+    """Copy of experiences.models.normalize_years as of this migration."""
+    if isinstance(years, str):
+        try:
+            years = json.loads(years)
+        except json.JSONDecodeError:
+            return []
+    normalized = set()
+    for year in years or []:
+        try:
+            normalized.add(int(year))
+        except (TypeError, ValueError):
+            continue
+    return sorted(normalized)
+
+
+def backfill_participation_years(apps, schema_editor):
+    Participation = apps.get_model('experiences', 'Participation')
+    ParticipationYear = apps.get_model('experiences', 'ParticipationYear')
+    rows = [
+        ParticipationYear(participation_id=pk, year=year)
+        for pk, years in Participation.objects.values_list('pk', 'years').iterator()
+        for year in normalize_years(years)
+    ]
+    ParticipationYear.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('experiences', '0019_person_email_verified'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParticipationYear',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('participation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='year_rows', to='experiences.participation')),
+            ],
+            options={
+                'verbose_name': 'Participation Year',
+                'indexes': [models.Index(fields=['year', 'participation'], name='experiences_year_41e447_idx')],
+                'unique_together': {('participation', 'year')},
+            },
+        ),
+        migrations.RunPython(backfill_participation_years, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 17:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('experiences', '0021_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='unchanged_count',
+            field=models.IntegerField(default=0),
+        ),
+    ]
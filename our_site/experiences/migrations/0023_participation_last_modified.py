@@ -0,0 +1,20 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:05
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('experiences', '0022_importjob_unchanged_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='participation',
+            name='last_modified',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
@@ -1,10 +1,13 @@
-from django.db import models
+import json
+
+from django.db import DEFAULT_DB_ALIAS, models, transaction
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.contrib import admin
 from django.utils.html import format_html
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from . import cache_tags
 
 
 
@@ -26,6 +29,43 @@ class Role(BaseVisibilityModel):
     def __str__(self):
         return self.title
 
+class PersonQuerySet(models.QuerySet):
+    def rebuild_cached_str(self, batch_size=500):
+        """
+        Recompute cached_str for every person in the queryset.
+
+        Reads people with their user and role in one query per chunk and writes
+        only the changed strings back with bulk_update(). Returns the number of
+        people whose string changed.
+        """
+        people = self.select_related('user', 'role').only(
+            'pk', 'graduating_year', 'cached_str',
+            'user__username', 'user__first_name', 'user__last_name', 'role__title',
+        ).order_by('pk')
+
+        # Write to the queryset's database (e.g. the one being restored), not the router's
+        manager = self.model._base_manager.db_manager(self.db)
+        updated = 0
+        changed = []
+        for person in people.iterator(chunk_size=batch_size):
+            cached_str = person.build_cached_str()
+            if cached_str != person.cached_str:
+                person.cached_str = cached_str
+                changed.append(person)
+            if len(changed) >= batch_size:
+                updated += manager.bulk_update(changed, ['cached_str'])
+                changed = []
+        if changed:
+            updated += manager.bulk_update(changed, ['cached_str'])
+
+        if updated:
+            # bulk_update() sends no signals
+            cache_tags.invalidate(
+                cache_tags.PERSON_LIST, cache_tags.PARTICIPATION_LIST, cache_tags.PARTICIPATION_INLINES,
+            )
+        return updated
+
+
 class Person(BaseVisibilityModel):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     profile_picture = models.ImageField(upload_to='media/profile_pictures/', null=True, blank=True)
@@ -41,16 +81,21 @@ class Person(BaseVisibilityModel):
     cached_str = models.CharField(max_length=255, blank=True, editable=False, 
                                 help_text="Cached string representation of this person")
 
+    objects = PersonQuerySet.as_manager()
+
     def __str__(self):
         if not self.cached_str:
             self.update_cached_str()
         return self.cached_str
 
-    def update_cached_str(self):
+    def build_cached_str(self):
         name = self.user.get_full_name() or self.user.username
         role_str = self.role.title if self.role else 'No Role'
         grad_year_str = f", Graduating: {self.graduating_year}" if self.graduating_year else ""
-        self.cached_str = f"{name} ({role_str}{grad_year_str})"
+        return f"{name} ({role_str}{grad_year_str})"
+
+    def update_cached_str(self):
+        self.cached_str = self.build_cached_str()
         # Save without triggering save signals to avoid recursion
         Person.objects.filter(pk=self.pk).update(cached_str=self.cached_str)
 
@@ -61,7 +106,7 @@ class Person(BaseVisibilityModel):
     @admin.display(description="Participation Details")
     def get_participations(self):
         """Returns a string representation of all participations."""
-        participations = Participation.objects.filter(person=self)
+        participations = Participation.objects.filter(person=self).select_related('group').prefetch_related('year_rows')
         return ", ".join([f"{p.group.name} ({p.format_school_years()})" for p in participations])
 
     class Meta:
@@ -101,6 +146,87 @@ class Group(BaseVisibilityModel):
         return self.name
 
 
+def normalize_years(years):
+    """Return the years stored in Participation.years as a sorted list of distinct ints."""
+    if isinstance(years, str):
+        try:
+            years = json.loads(years)
+        except json.JSONDecodeError:
+            return []
+    normalized = set()
+    for year in years or []:
+        try:
+            normalized.add(int(year))
+        except (TypeError, ValueError):
+            continue
+    return sorted(normalized)
+
+
+def format_years(years):
+    """Format years as school years (YYYY-YYYY+1) in chronological order."""
+    return ", ".join([f"{year}-{year+1}" for year in sorted(years)])
+
+
+def get_years_by_participation(participation_ids):
+    """{participation id: [years]} for ``participation_ids``, from ParticipationYear in one query."""
+    years = {pk: [] for pk in participation_ids}
+    rows = ParticipationYear.objects.filter(participation__in=years).values_list('participation_id', 'year')
+    for participation_id, year in rows.order_by('year'):
+        years[participation_id].append(year)
+    return years
+
+
+class ParticipationQuerySet(models.QuerySet):
+    def in_school_year(self, year):
+        """Participations whose years include ``year`` (the school year starting that September)."""
+        return self.filter(year_rows__year=year)
+
+    def sync_years(self, batch_size=1000):
+        """
+        Sync the ParticipationYear rows of every participation in the queryset,
+        ``batch_size`` participations per transaction.  Returns (participations, rows written).
+        """
+        participations = 0
+        rows = 0
+        batch = []
+        for participation in self.only('pk', 'years').order_by('pk').iterator(chunk_size=batch_size):
+            batch.append(participation)
+            if len(batch) >= batch_size:
+                with transaction.atomic(using=self.db):
+                    rows += sync_participation_years(batch, using=self.db)
+                participations += len(batch)
+                batch = []
+        if batch:
+            with transaction.atomic(using=self.db):
+                rows += sync_participation_years(batch, using=self.db)
+            participations += len(batch)
+        return participations, rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        sync_participation_years([obj for obj in objs if obj.pk is not None])
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        # Neither bulk_update() nor update() applies auto_now; incremental backups rely on it
+        now = timezone.now()
+        for obj in objs:
+            obj.last_modified = now
+        updated = super().bulk_update(objs, [*fields, 'last_modified'], *args, **kwargs)
+        if 'years' in fields:
+            sync_participation_years(objs)
+        return updated
+
+    def update(self, **kwargs):
+        kwargs.setdefault('last_modified', timezone.now())
+        if 'years' not in kwargs:
+            return super().update(**kwargs)
+        ids = list(self.values_list('pk', flat=True))
+        updated = super().update(**kwargs)
+        sync_participation_years(Participation.objects.filter(pk__in=ids).only('pk', 'years'))
+        return updated
+
+
 class Participation(models.Model):
     person = models.ForeignKey(Person, on_delete=models.CASCADE)
     group = models.ForeignKey(Group, on_delete=models.CASCADE)
@@ -112,19 +238,78 @@ class Participation(models.Model):
     is_public = models.BooleanField(default=False, help_text="Whether this participation is visible on public profiles")
     badges = models.ForeignKey('Badges' , on_delete=models.SET_NULL, null=True, blank=True, related_name='participations',
                                   help_text="Badge awarded for this specific participation")
+    # Lets incremental backups pick changed participations (see our_site/backup_chain.py)
+    last_modified = models.DateTimeField(auto_now=True)
+
+    objects = ParticipationQuerySet.as_manager()
 
     class Meta:
         verbose_name_plural = "All Activity Participation"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Saving without changing the years leaves ParticipationYear alone
+        if 'years' in field_names:
+            instance._loaded_years = normalize_years(instance.years)
+        return instance
+
+    def get_years(self):
+        """The participation's years, from prefetched ``year_rows`` when there are any."""
+        if 'year_rows' in getattr(self, '_prefetched_objects_cache', {}):
+            return sorted(row.year for row in self.year_rows.all())
+        return normalize_years(self.years)
+
     def format_school_years(self):
         """Format years as school years (YYYY-YYYY+1) in chronological order."""
-        sorted_years = sorted(self.years)
-        return ", ".join([f"{year}-{year+1}" for year in sorted_years])
+        return format_years(self.get_years())
 
     def __str__(self):
         return f"{self.person} in {self.group} ({self.format_school_years()})"
 
 
+class ParticipationYear(models.Model):
+    """One row per year in Participation.years, so year lookups can be done in SQL."""
+    participation = models.ForeignKey(Participation, on_delete=models.CASCADE, related_name='year_rows')
+    year = models.PositiveSmallIntegerField()
+
+    class Meta:
+        verbose_name = "Participation Year"
+        unique_together = ('participation', 'year')
+        indexes = [models.Index(fields=['year', 'participation'])]
+
+    def __str__(self):
+        return f"{self.participation_id}: {self.year}-{self.year + 1}"
+
+
+def sync_participation_years(participations, batch_size=1000, using=DEFAULT_DB_ALIAS):
+    """
+    Bring the ParticipationYear rows of ``participations`` in line with their
+    years field.  Only the years added or removed are written, so the rows of
+    unchanged years keep their ids.  Returns the number of rows written.
+    """
+    participations = list(participations)
+    if not participations:
+        return 0
+    wanted = {(p.pk, year) for p in participations for year in normalize_years(p.years)}
+    manager = ParticipationYear.objects.using(using)
+    existing = {
+        (participation_id, year): pk
+        for pk, participation_id, year in manager.filter(
+            participation__in=[p.pk for p in participations],
+        ).values_list('pk', 'participation_id', 'year')
+    }
+    stale = [pk for key, pk in existing.items() if key not in wanted]
+    if stale:
+        manager.filter(pk__in=stale).delete()
+    rows = [
+        ParticipationYear(participation_id=participation_id, year=year)
+        for participation_id, year in sorted(wanted - existing.keys())
+    ]
+    manager.bulk_create(rows, batch_size=batch_size)
+    return len(stale) + len(rows)
+
+
 class CoreCompetency(models.Model):
     title = models.CharField(max_length=100, unique=True)  # Unique title for the competency
     description = models.TextField(blank=True)  # Optional description
@@ -222,22 +407,84 @@ class ModelVisibilitySettings(models.Model):
     def __str__(self):
         return f"{self.get_model_name_display()} - {self.get_access_level_display()}"
 
+class ImportJob(models.Model):
+    """A CSV import run by the background job runner (see import_jobs.py)."""
+    KIND_CHOICES = [
+        ('people', 'People'),
+        ('guardians', 'Guardian-student relationships'),
+    ]
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATE_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    state = models.CharField(max_length=20, choices=STATE_CHOICES, default=QUEUED, db_index=True)
+    options = models.JSONField(default=dict, blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    rows_total = models.IntegerField(null=True, blank=True)
+    rows_processed = models.IntegerField(default=0, help_text="Rows committed so far; a resumed job skips them")
+    created_count = models.IntegerField(default=0)
+    updated_count = models.IntegerField(default=0)
+    unchanged_count = models.IntegerField(default=0)
+    skipped_count = models.IntegerField(default=0)
+    users_created = models.IntegerField(default=0)
+    checkpoint = models.JSONField(default=dict, blank=True, help_text="Size of each report file at the last commit")
+    checkpoint_at = models.DateTimeField(null=True, blank=True)
+    errors = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['-created_at', '-pk']
+
+    def __str__(self):
+        return f"{self.get_kind_display()} import #{self.pk} ({self.state})"
+
+    @property
+    def is_active(self):
+        return self.state in (self.QUEUED, self.RUNNING)
+
+    def as_dict(self):
+        return {
+            'id': self.pk,
+            'kind': self.kind,
+            'kind_display': self.get_kind_display(),
+            'state': self.state,
+            'state_display': self.get_state_display(),
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'rows_total': self.rows_total,
+            'rows_processed': self.rows_processed,
+            'created': self.created_count,
+            'updated': self.updated_count,
+            'unchanged': self.unchanged_count,
+            'skipped': self.skipped_count,
+            'users_created': self.users_created,
+            'errors': self.errors,
+        }
+
 # Signal handlers for Person model caching
 @receiver(post_save, sender=User)
-def update_person_cache_on_user_change(sender, instance, **kwargs):
+def update_person_cache_on_user_change(sender, instance, update_fields=None, **kwargs):
     """Update the cached string representation when the User object changes"""
-    try:
-        if hasattr(instance, 'person'):
-            instance.person.update_cached_str()
-    except Exception:
-        # Handle case where Person might not exist yet
-        pass
+    if update_fields == frozenset({'last_login'}):
+        return
+    # Matches nothing when the Person doesn't exist yet
+    Person.objects.filter(user=instance).rebuild_cached_str()
 
 @receiver(post_save, sender=Role)
 def update_persons_cache_on_role_change(sender, instance, **kwargs):
     """Update the cached string for all persons with this role when the Role changes"""
-    for person in instance.people.all():
-        person.update_cached_str()
+    instance.people.rebuild_cached_str()
 
 @receiver(post_save, sender=Person)
 def update_person_cache(sender, instance, created, **kwargs):
@@ -245,3 +492,58 @@ def update_person_cache(sender, instance, created, **kwargs):
     if created or not instance.cached_str:
         instance.update_cached_str()
 
+
+# Signal handlers for the cached admin lists and participation inlines
+@receiver([post_save, post_delete], sender=User)
+def invalidate_lists_on_user_change(sender, instance, **kwargs):
+    """Names are shown in the person list and in every person's string"""
+    if kwargs.get('update_fields') == frozenset({'last_login'}):
+        return
+    cache_tags.invalidate(
+        cache_tags.PERSON_LIST, cache_tags.PARTICIPATION_LIST,
+        cache_tags.PARTICIPATION_INLINES, cache_tags.FACILITATORS,
+    )
+
+@receiver([post_save, post_delete], sender=Role)
+@receiver([post_save, post_delete], sender=Person)
+def invalidate_lists_on_person_change(sender, instance, **kwargs):
+    """Role titles and person strings are shown in the person and participation lists"""
+    cache_tags.invalidate(
+        cache_tags.PERSON_LIST, cache_tags.PARTICIPATION_LIST,
+        cache_tags.PARTICIPATION_INLINES, cache_tags.FACILITATORS,
+    )
+
+@receiver([post_save, post_delete], sender=CoreCompetency)
+@receiver([post_save, post_delete], sender=Group)
+def invalidate_lists_on_group_change(sender, instance, **kwargs):
+    """Group names are shown in the person and participation lists, competencies in the group list"""
+    cache_tags.invalidate(
+        cache_tags.GROUP_LIST, cache_tags.PERSON_LIST,
+        cache_tags.PARTICIPATION_LIST, cache_tags.PARTICIPATION_INLINES,
+    )
+
+@receiver([post_save, post_delete], sender=Participation)
+def invalidate_lists_on_participation_change(sender, instance, **kwargs):
+    cache_tags.invalidate(
+        cache_tags.group_tag(instance.group_id),
+        cache_tags.person_tag(instance.person_id),
+        cache_tags.PERSON_LIST,
+        cache_tags.PARTICIPATION_LIST,
+        cache_tags.FACILITATORS,
+    )
+
+@receiver(post_save, sender=Participation)
+def sync_years_on_participation_save(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    """Keep ParticipationYear in step with Participation.years, when the years changed"""
+    if raw or (update_fields is not None and 'years' not in update_fields):
+        return
+    years = normalize_years(instance.years)
+    if not created and getattr(instance, '_loaded_years', None) == years:
+        return
+    sync_participation_years([instance])
+    instance._loaded_years = years
+
+@receiver([post_save, post_delete], sender=GuardianStudent)
+def invalidate_lists_on_relationship_change(sender, instance, **kwargs):
+    """Guardians and students are shown in the person list and drive the guardianship index"""
+    cache_tags.invalidate(cache_tags.PERSON_LIST, cache_tags.GUARDIANSHIP)
@@ -0,0 +1,68 @@
+"""
+Hashing many passwords at once, for imports that create users in bulk.
+
+``create_user`` hashes each password in the request thread, and with the
+default PBKDF2 hasher a hash costs a large fraction of a second of CPU, so a
+roster of a few thousand new users spent most of its import time hashing.
+``ParallelHasher`` spreads the passwords over a pool of processes, one batch
+per worker, so all cores hash at once.
+
+The workers encode with the hasher instance the parent resolved from
+PASSWORD_HASHERS, so the hashes are the ones ``make_password`` would give
+(same algorithm, iterations and salt length) even when the settings were
+overridden at runtime.  The pool is started on the first call that has more
+than one password and shut down by ``close()``; with PASSWORD_HASH_WORKERS = 1
+everything is hashed in the calling thread.
+
+This module must not import models: the workers are started with ``spawn``
+(the parent has threads and open database connections that a fork would
+copy) and import it without setting up Django.
+"""
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from django.conf import settings
+from django.contrib.auth.hashers import get_hasher
+
+
+def get_worker_count():
+    workers = getattr(settings, 'PASSWORD_HASH_WORKERS', None)
+    return max(int(workers), 1) if workers is not None else os.cpu_count() or 1
+
+
+def encode(hasher, passwords):
+    """What ``make_password`` returns for each of ``passwords``, with ``hasher``."""
+    return [hasher.encode(password, hasher.salt()) for password in passwords]
+
+
+class ParallelHasher:
+    """Hashes lists of passwords with the default hasher, across ``workers`` processes."""
+    def __init__(self, workers=None):
+        self.workers = get_worker_count() if workers is None else max(workers, 1)
+        self.hasher = get_hasher('default')
+        self.executor = None
+
+    def hash(self, passwords):
+        """The hashes of ``passwords``, in order."""
+        passwords = list(passwords)
+        if self.workers == 1 or len(passwords) < 2:
+            return encode(self.hasher, passwords)
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        size = math.ceil(len(passwords) / self.workers)
+        batches = [passwords[i:i + size] for i in range(0, len(passwords), size)]
+        return [hashed for batch in self.executor.map(encode, repeat(self.hasher), batches) for hashed in batch]
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,343 @@
+"""
+Bulk import of people from a roster CSV (PersonAdmin "Import People", run
+as a background job by import_jobs.py).
+
+The admin view used to look up the role, the user and a free username, then
+create the user and get_or_create the person, one CSV row at a time; every
+save fired the cached_str and cache invalidation signals.  ``import_people``
+instead:
+
+* reads the roles and the usernames in use once, and the users (with their
+  people) of each chunk's emails with one query,
+* allocates new usernames against the in-memory set of usernames,
+* hashes the generated passwords of each chunk across a process pool
+  (``password_hashing.ParallelHasher``, PASSWORD_HASH_WORKERS processes),
+* writes each chunk of ``chunk_size`` rows in its own transaction with
+  bulk_create/bulk_update, ``cached_str`` included (it is built from the user
+  and role already in memory),
+* invalidates the cached person and participation lists once at the end, as
+  bulk writes send no signals.
+
+A row behaves as before: an unknown role or a missing email/role skips it,
+an existing user only gets empty names filled in, a new user is created (with
+a generated password) only when ``create_users`` is set, and the person gets
+the row's role and graduating year.  A row that changes nothing is
+"unchanged" and not written.
+"""
+import random
+import string
+import time
+
+from django.contrib.auth.models import User, UserManager
+from django.db import transaction
+from django.utils import timezone
+
+from . import cache_tags, password_hashing
+from .models import Person, Role
+
+REQUIRED_COLUMNS = ('email', 'role')
+DEFAULT_CHUNK_SIZE = 500
+# Values per email__in lookup, below the SQLite limit on query parameters
+LOOKUP_BATCH_SIZE = 500
+
+
+class ImportResult:
+    """
+    Counters and messages of an import, or of one chunk of it.
+
+    ``outcomes`` holds ``(line, row, outcome, message)`` for each row of a
+    chunk (not kept by ``add()``), ``created_users`` the credentials of the
+    users created.
+    """
+    CREATED = 'created'
+    UPDATED = 'updated'
+    UNCHANGED = 'unchanged'
+    SKIPPED = 'skipped'
+
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.skipped = 0
+        self.created_users = []
+        self.errors = []
+        self.outcomes = []
+        self.elapsed = 0.0
+
+    @classmethod
+    def failed(cls, rows, error):
+        """The result of ``rows`` (``(line, row)`` pairs) when writing them raised ``error``."""
+        result = cls()
+        for line, row in rows:
+            result.skip(line, row, f"Not imported: {error}")
+        return result
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else float(self.rows)
+
+    def record(self, line, row, outcome, message=''):
+        self.rows += 1
+        if outcome == self.CREATED:
+            self.created += 1
+        elif outcome == self.UPDATED:
+            self.updated += 1
+        elif outcome == self.UNCHANGED:
+            self.unchanged += 1
+        else:
+            self.skipped += 1
+            self.errors.append(f"Row {line}: {message}")
+        self.outcomes.append((line, row, outcome, message))
+
+    def skip(self, line, row, message):
+        self.record(line, row, self.SKIPPED, message)
+
+    def add(self, other):
+        """Add the counters and messages of ``other`` (a chunk's result) to these."""
+        self.rows += other.rows
+        self.created += other.created
+        self.updated += other.updated
+        self.unchanged += other.unchanged
+        self.skipped += other.skipped
+        self.created_users.extend(other.created_users)
+        self.errors.extend(other.errors)
+
+
+def generate_password(length=10):
+    """Generate a random pronounceable password"""
+    vowels = 'aeiou'
+    consonants = 'bcdfghjklmnpqrstvwxyz'
+    first_part = ''.join(random.choice(consonants) + random.choice(vowels) for _ in range(length//2))
+    number_part = ''.join(random.choice(string.digits) for _ in range(2))
+    special_char = random.choice('!@#$%^&*')
+    return first_part.capitalize() + number_part + special_char
+
+
+def missing_columns(fieldnames):
+    return [column for column in REQUIRED_COLUMNS if column not in (fieldnames or ())]
+
+
+class PeopleImporter:
+    """
+    Imports rows chunk by chunk.  Roles and usernames are read once, when the
+    importer is created.  ``finish()`` shuts the password hashing pool down.
+
+    ``parse``, ``load_users`` and ``plan`` only read; import_preview.py runs
+    them over a whole file without writing.
+    """
+    def __init__(self, create_users=False, password_generator=None, hash_workers=None):
+        self.create_users = create_users
+        self.generate_password = password_generator or generate_password
+        self.hasher = password_hashing.ParallelHasher(hash_workers)
+        self.roles = {}
+        self.role_titles = {}
+        for role in Role.objects.order_by('pk'):
+            # Like the former title__iexact(...).first(): the oldest role wins
+            self.roles.setdefault(role.title.lower(), role)
+            self.role_titles[role.pk] = role.title
+        self.usernames = set(User.objects.values_list('username', flat=True))
+        self.result = ImportResult()
+
+    def allocate_username(self, email):
+        base = User.normalize_username(email.split('@')[0])
+        username, counter = base, 1
+        while username in self.usernames:
+            username = f"{base}{counter}"
+            counter += 1
+        self.usernames.add(username)
+        return username
+
+    def parse(self, rows, result):
+        """
+        The fields of the valid rows of ``rows``, a list of ``(line number,
+        CSV row dict)``; the others are recorded as skipped in ``result``.
+        """
+        parsed = []
+        for line, row in rows:
+            email = (row.get('email') or '').strip()
+            role_title = (row.get('role') or '').strip().lower()
+            if not email or not role_title:
+                result.skip(line, row, "Missing required fields")
+                continue
+            role = self.roles.get(role_title)
+            if role is None:
+                result.skip(line, row, f"Role '{role_title}' does not exist")
+                continue
+            graduating_year = (row.get('graduating_year') or '').strip()
+            try:
+                graduating_year = int(graduating_year) if graduating_year else None
+            except ValueError:
+                result.skip(line, row, f"Graduating year '{graduating_year}' is not a number")
+                continue
+            first_name = (row.get('first_name') or '').strip()
+            last_name = (row.get('last_name') or '').strip()
+            parsed.append((line, row, email, role, graduating_year, first_name, last_name))
+        return parsed
+
+    def load_users(self, emails):
+        """The users, with their person, of each of ``emails``."""
+        users_by_email = {}
+        for batch in chunked(sorted(emails), LOOKUP_BATCH_SIZE):
+            for user in User.objects.filter(email__in=batch).select_related('person'):
+                users_by_email.setdefault(user.email, []).append(user)
+        return users_by_email
+
+    def plan(self, parsed, users_by_email, result):
+        """
+        Work out in memory what the ``parsed`` rows change and record each
+        row's outcome in ``result``.  Returns the users and people to create
+        and to update, for ``write()``.
+        """
+        new_users = []
+        changed_users = {}
+        people = {}  # id(user) -> its person, new or existing
+        new_people = []
+        updated_people = {}
+        for line, row, email, role, graduating_year, first_name, last_name in parsed:
+            users = users_by_email.get(email)
+            if users and len(users) > 1:
+                result.skip(line, row, f"{len(users)} users have the email '{email}'")
+                continue
+            changes = []
+            if users:
+                user = users[0]
+                for field, value in (('first_name', first_name), ('last_name', last_name)):
+                    if value and not getattr(user, field):
+                        changes.append(f"{field}: '' -> '{value}'")
+                        setattr(user, field, value)
+                if changes and user.pk is not None:
+                    changed_users[user.pk] = user
+            elif self.create_users:
+                password = self.generate_password()
+                user = User(
+                    username=self.allocate_username(email),
+                    email=UserManager.normalize_email(email),
+                    first_name=first_name,
+                    last_name=last_name,
+                )
+                users_by_email[email] = [user]
+                new_users.append(user)
+                result.created_users.append({
+                    'email': email,
+                    'username': user.username,
+                    'password': password,
+                    'name': f"{first_name} {last_name}".strip(),
+                })
+            else:
+                result.skip(line, row, f"User with email '{email}' does not exist and create_users is not checked")
+                continue
+
+            person = people.get(id(user))
+            if person is None and user.pk is not None:
+                try:
+                    person = user.person
+                except Person.DoesNotExist:
+                    pass
+            if person is None:
+                person = Person(user=user, role=role, graduating_year=graduating_year)
+                new_people.append(person)
+                result.record(line, row, ImportResult.CREATED)
+            else:
+                if person.role_id != role.pk:
+                    changes.append(f"role: '{self.role_titles.get(person.role_id, '')}' -> '{role.title}'")
+                    person.role = role
+                if graduating_year is not None and person.graduating_year != graduating_year:
+                    changes.append(f"graduating_year: {person.graduating_year} -> {graduating_year}")
+                    person.graduating_year = graduating_year
+                if not changes:
+                    result.record(line, row, ImportResult.UNCHANGED)
+                else:
+                    if person.pk is not None:
+                        updated_people[person.pk] = person
+                    result.record(line, row, ImportResult.UPDATED, '; '.join(changes))
+            people[id(user)] = person
+        return new_users, list(changed_users.values()), new_people, list(updated_people.values())
+
+    def import_chunk(self, rows):
+        """
+        Import ``rows``, a list of ``(line number, CSV row dict)``, in one
+        transaction and return their ImportResult.
+        """
+        chunk = ImportResult()
+        parsed = self.parse(rows, chunk)
+        new_users, changed_users, new_people, updated_people = self.plan(
+            parsed, self.load_users({fields[2] for fields in parsed}), chunk,
+        )
+        passwords = self.hasher.hash(entry['password'] for entry in chunk.created_users)
+        for user, password in zip(new_users, passwords):
+            user.password = password
+        self.write(new_users, changed_users, new_people, updated_people)
+        # Rows skipped while parsing were recorded first
+        chunk.outcomes.sort(key=lambda outcome: outcome[0])
+        return chunk
+
+    def write(self, new_users, changed_users, new_people, updated_people):
+        with transaction.atomic():
+            User.objects.bulk_create(new_users)
+            if any(user.pk is None for user in new_users):
+                # Backends that do not return ids from a bulk INSERT (MySQL/MariaDB)
+                ids = dict(User.objects.filter(
+                    username__in=[user.username for user in new_users],
+                ).values_list('username', 'pk'))
+                for user in new_users:
+                    user.pk = ids[user.username]
+            if changed_users:
+                User.objects.bulk_update(changed_users, ['first_name', 'last_name'])
+
+            for person in new_people:
+                person.cached_str = person.build_cached_str()
+            # bulk_create() copies the new users' ids to user_id
+            Person.objects.bulk_create(new_people)
+            now = timezone.now()
+            for person in updated_people:
+                person.cached_str = person.build_cached_str()
+                # bulk_update() does not apply auto_now; incremental backups rely on it
+                person.last_modified = now
+            if updated_people:
+                Person.objects.bulk_update(
+                    updated_people, ['role', 'graduating_year', 'cached_str', 'last_modified'],
+                )
+
+    def finish(self):
+        self.hasher.close()
+        # The bulk writes sent no post_save signals
+        cache_tags.invalidate(
+            cache_tags.PERSON_LIST, cache_tags.PARTICIPATION_LIST,
+            cache_tags.PARTICIPATION_INLINES, cache_tags.FACILITATORS,
+        )
+        return self.result
+
+
+def chunked(rows, chunk_size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def import_people(reader, create_users=False, chunk_size=DEFAULT_CHUNK_SIZE, hash_workers=None):
+    """
+    Import the rows of the ``csv.DictReader`` ``reader``.  Returns an ImportResult.
+
+    ``hash_workers`` overrides PASSWORD_HASH_WORKERS.
+
+    The rows of a chunk that fails to write are all skipped and reported in the errors.
+    """
+    start_time = time.time()
+    importer = PeopleImporter(create_users, hash_workers=hash_workers)
+    rows = ((reader.line_num, row) for row in reader)
+    try:
+        for chunk in chunked(rows, chunk_size):
+            try:
+                importer.result.add(importer.import_chunk(chunk))
+            except Exception as e:
+                importer.result.add(ImportResult.failed(chunk, e))
+    finally:
+        result = importer.finish()
+    result.elapsed = time.time() - start_time
+    return result
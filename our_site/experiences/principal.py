@@ -0,0 +1,82 @@
+"""
+Request-scoped view of the current user for the experiences views.
+
+``PrincipalMiddleware`` attaches a ``Principal`` to every request as
+``request.principal``.  Each fact about the viewer (administrator status,
+their Person) is computed on first use and then reused for the rest of the
+request, so permission checks in get_object, get_context_data, dispatch and
+form_valid share one query each.  Guardian/student reachability is answered
+from the shared index in guardianship.py without a query.
+"""
+from django.utils.functional import cached_property
+
+from . import guardianship
+from .models import Person
+
+
+class Principal:
+    def __init__(self, user):
+        self.user = user
+
+    @cached_property
+    def is_authenticated(self):
+        return self.user.is_authenticated
+
+    @cached_property
+    def is_admin(self):
+        """Superusers and members of the Administrators group."""
+        if not self.is_authenticated:
+            return False
+        return self.user.is_superuser or self.user.groups.filter(name='Administrators').exists()
+
+    @cached_property
+    def person(self):
+        """The viewer's Person, or None for anonymous users and users without a profile."""
+        if not self.is_authenticated:
+            return None
+        return Person.objects.filter(user=self.user).select_related('user', 'role').first()
+
+    @cached_property
+    def person_id(self):
+        return self.person.pk if self.person is not None else None
+
+    @cached_property
+    def student_ids(self):
+        """Ids of the people the viewer is an active guardian of."""
+        if self.person_id is None:
+            return frozenset()
+        return guardianship.students_of(self.person_id)
+
+    @cached_property
+    def guardian_ids(self):
+        """Ids of the viewer's active guardians."""
+        if self.person_id is None:
+            return frozenset()
+        return guardianship.guardians_of(self.person_id)
+
+    def is_self(self, person_or_id):
+        person_id = getattr(person_or_id, 'pk', person_or_id)
+        return self.person is not None and self.person.pk == person_id
+
+    def is_guardian_of(self, person_or_id):
+        return getattr(person_or_id, 'pk', person_or_id) in self.student_ids
+
+    def is_student_of(self, person_or_id):
+        return getattr(person_or_id, 'pk', person_or_id) in self.guardian_ids
+
+    def can_view(self, person_or_id):
+        """The viewer themselves, their students and their guardians."""
+        return guardianship.can_view(self.person_id, getattr(person_or_id, 'pk', person_or_id))
+
+    @cached_property
+    def listed_ids(self):
+        """Ids of the people the person and participation lists show the viewer."""
+        return guardianship.listed_ids(self.person_id)
+
+
+def get_principal(request):
+    """Return the request's Principal, creating it when the middleware did not run."""
+    principal = getattr(request, 'principal', None)
+    if principal is None:
+        principal = request.principal = Principal(request.user)
+    return principal
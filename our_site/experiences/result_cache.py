@@ -0,0 +1,97 @@
+"""
+Result cache for admin list and inline rows.
+
+Pickling a QuerySet caches the query, not its rows, so every cache hit used to
+run the SQL again. Here a queryset is evaluated once into compact row tuples
+(the primary key, the pk of every related object and the displayed columns)
+and lightweight model instances are rebuilt from those tuples on a hit,
+without touching the database.
+"""
+from django.db.models.constants import LOOKUP_SEP
+
+from . import cache_tags
+
+# Bump whenever the payload layout changes so old entries are ignored
+ROW_FORMAT_VERSION = 1
+
+
+def _relation_paths(fields):
+    """Return every relation prefix used by ``fields`` ('person__user__first_name' -> person, person__user)."""
+    paths = []
+    for field in fields:
+        parts = field.split(LOOKUP_SEP)[:-1]
+        for depth in range(1, len(parts) + 1):
+            path = LOOKUP_SEP.join(parts[:depth])
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+
+def get_columns(fields):
+    """The values_list() columns stored for ``fields``: pk, related pks, then the fields themselves."""
+    columns = ['pk'] + [f'{path}{LOOKUP_SEP}pk' for path in _relation_paths(fields)]
+    columns.extend(field for field in fields if field not in columns)
+    return tuple(columns)
+
+
+def dump(queryset, fields):
+    """Evaluate ``queryset`` into a cacheable row payload."""
+    columns = get_columns(fields)
+    return (ROW_FORMAT_VERSION, columns, list(queryset.values_list(*columns)))
+
+
+def is_valid(payload, fields):
+    return (
+        isinstance(payload, tuple) and len(payload) == 3
+        and payload[0] == ROW_FORMAT_VERSION and payload[1] == get_columns(fields)
+    )
+
+
+def _build(model, values, using):
+    """Build an instance of ``model`` from a {lookup: value} dict relative to that model."""
+    pk = values.get('pk')
+    if pk is None:
+        return None
+
+    opts = model._meta
+    attvalues = {opts.pk.attname: pk}
+    related = {}
+    for lookup, value in values.items():
+        name, _, rest = lookup.partition(LOOKUP_SEP)
+        if name == 'pk':
+            continue
+        field = opts.get_field(name)
+        if rest:
+            related.setdefault(field, {})[rest] = value
+        else:
+            attvalues[field.attname] = value
+
+    for field, related_values in related.items():
+        attvalues[field.attname] = related_values.get('pk')
+
+    field_names = [f.attname for f in opts.concrete_fields if f.attname in attvalues]
+    instance = model.from_db(using, field_names, [attvalues[name] for name in field_names])
+
+    for field, related_values in related.items():
+        field.set_cached_value(instance, _build(field.related_model, related_values, using))
+    return instance
+
+
+def load(model, payload, using='default'):
+    """Rebuild model instances from a payload produced by :func:`dump`."""
+    _, columns, rows = payload
+    return [_build(model, dict(zip(columns, row)), using) for row in rows]
+
+
+def get_rows(key, queryset, fields, tags=(), timeout=300, refresh=False):
+    """
+    Return the rows of ``queryset`` as lightweight instances with ``fields`` loaded.
+
+    A cache hit performs no database queries. Related objects referenced by
+    ``fields`` are attached to each instance, other fields are deferred.
+    """
+    payload = None if refresh else cache_tags.get(key, tags)
+    if not is_valid(payload, fields):
+        payload = dump(queryset, fields)
+        cache_tags.set(key, payload, tags, timeout)
+    return load(queryset.model, payload, queryset.db)
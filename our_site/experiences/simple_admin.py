@@ -14,7 +14,7 @@ from django.contrib.auth.models import User
 from django.db.models import Case, When, Value, IntegerField
 from .admin_widgets import YearSelectorWidget
 from .forms import PersonForm
-import json
+from . import facilitators
 import random
 import string
 import zipfile
@@ -32,44 +32,11 @@ class GroupAdmin(admin.ModelAdmin):
     
     @admin.display(description='Facilitators')
     def get_facilitators(self, obj):
-        # Get the current school year (runs from Sept to Aug, so if it's 2025 now, the school year is 2024-2025)
-        from django.utils import timezone
-        current_date = timezone.now()
-        current_year = current_date.year
-        # If we're before September, we're in the previous school year
-        if current_date.month < 9:
-            school_year = current_year - 1
-        else:
-            school_year = current_year
-            
-        # Find all facilitators for this group - no caching, just direct query
-        # Use prefetch_related to optimize the query
-        facilitators = Person.objects.filter(
-            groups=obj,
-            role__title__iexact='facilitator'  # Case-insensitive match
-        ).select_related('user').distinct()
-        
-        # Filter for the current school year
-        filtered_facilitators = []
-        for facilitator in facilitators:
-            # Get participations for this facilitator in this group
-            participations = Participation.objects.filter(person=facilitator, group=obj)
-            
-            # Check each participation for the current school year
-            for participation in participations:
-                years = []
-                if participation.years:
-                    try:
-                        years = json.loads(participation.years)
-                    except (json.JSONDecodeError, TypeError):
-                        continue
-                        
-                if school_year in years:
-                    filtered_facilitators.append(facilitator)
-                    break
-        
-        # Return the formatted list of facilitators
-        if filtered_facilitators:
-            return ", ".join([f.user.get_full_name() or f.user.username for f in filtered_facilitators])
+        # Facilitators who participated in the current school year (Sept to Aug),
+        # read from the shared facilitator index instead of querying per group
+        school_year = facilitators.current_school_year()
+        facilitator_names = facilitators.get_facilitators([obj.pk], year=school_year)[obj.pk]
+        if facilitator_names:
+            return ", ".join(facilitator_names)
         else:
             return "-"
@@ -0,0 +1,956 @@
+import csv
+import datetime
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.test import RequestFactory, TestCase, override_settings
+from django.contrib.admin import site
+from django.contrib.auth.hashers import check_password
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.exceptions import PermissionDenied
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.http import Http404, QueryDict
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from . import cache_tags, facilitators, guardian_import, guardianship, import_jobs, import_preview, password_hashing, people_import
+from .admin import ModelVisibilitySettingsAdmin, get_participation_inline_rows
+from .middleware import ModelVisibilityMiddleware, PrincipalMiddleware
+from .models import (
+    Group, GuardianStudent, ImportJob, ModelVisibilitySettings, Participation, ParticipationYear, Person, Role,
+)
+from .forms import ParticipationForm
+from .principal import Principal
+from .views.participation_views import ParticipationDetailView, ParticipationListView
+from .views.person_views import PersonListView
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CacheTagsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_get_returns_value_set_under_same_tags(self):
+        cache_tags.set('group_admin_list_1', ['a', 'b'], (cache_tags.GROUP_LIST,), 60)
+        self.assertEqual(cache_tags.get('group_admin_list_1', (cache_tags.GROUP_LIST,)), ['a', 'b'])
+
+    def test_invalidate_drops_every_entry_under_tag(self):
+        tags = (cache_tags.group_tag(42), cache_tags.PARTICIPATION_INLINES)
+        for page in range(1, 4):
+            cache_tags.set(f'participation_inline_group_42_page{page}', page, tags, 60)
+        cache_tags.set('participation_inline_group_7_page1', 'other', (cache_tags.group_tag(7),), 60)
+
+        cache_tags.invalidate(cache_tags.group_tag(42))
+
+        for page in range(1, 4):
+            self.assertIsNone(cache_tags.get(f'participation_inline_group_42_page{page}', tags))
+        self.assertEqual(cache_tags.get('participation_inline_group_7_page1', (cache_tags.group_tag(7),)), 'other')
+
+    def test_invalidate_unknown_tag(self):
+        cache_tags.invalidate('group:999')
+        cache_tags.set('key', 1, ('group:999',), 60)
+        self.assertEqual(cache_tags.get('key', ('group:999',)), 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ResultCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        facilitator = Role.objects.create(title='Facilitator')
+        student = Role.objects.create(title='Student')
+        self.group = Group.objects.create(name='Robotics')
+        self.alice = Person.objects.create(
+            user=User.objects.create(username='alice', first_name='Alice', last_name='Smith'), role=student)
+        self.bob = Person.objects.create(
+            user=User.objects.create(username='bob', first_name='Bob', last_name='Jones'), role=facilitator)
+        Participation.objects.create(person=self.alice, group=self.group, hours=10, years=[2023, 2024])
+        Participation.objects.create(person=self.bob, group=self.group, hours=4, years=[2024])
+        self.admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def test_inline_rows_hit_runs_no_queries(self):
+        get_participation_inline_rows('group', self.group.pk)
+
+        with self.assertNumQueries(0):
+            rows = get_participation_inline_rows('group', self.group.pk)
+            # Facilitators first, and everything the inline renders is loaded
+            self.assertEqual([p.person_id for p in rows], [self.bob.pk, self.alice.pk])
+            self.assertEqual(rows[1].hours, 10)
+            self.assertEqual(str(rows[1]), f'{self.alice.cached_str} in Robotics (2023-2024, 2024-2025)')
+
+    def test_inline_rows_follow_participation_changes(self):
+        get_participation_inline_rows('group', self.group.pk)
+        Participation.objects.filter(person=self.alice).get().delete()
+
+        rows = get_participation_inline_rows('group', self.group.pk)
+        self.assertEqual([p.person_id for p in rows], [self.bob.pk])
+
+    def test_changelist_hit_runs_no_queries(self):
+        request = RequestFactory().get('/admin/experiences/person/')
+        request.user = self.admin_user
+        person_admin = site._registry[Person]
+        person_admin.get_changelist_instance(request)
+
+        changelist = person_admin.get_changelist_instance(request)
+        with self.assertNumQueries(0):
+            changelist.get_results(request)
+            names = [person.user.get_full_name() for person in changelist.result_list]
+            roles = [str(person.role) for person in changelist.result_list]
+        self.assertEqual(changelist.result_count, 2)
+        self.assertCountEqual(names, ['Alice Smith', 'Bob Jones'])
+        self.assertCountEqual(roles, ['Student', 'Facilitator'])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PersonChangelistTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.role = Role.objects.create(title='Student')
+        self.groups = [Group.objects.create(name=f'Group {i}') for i in range(3)]
+        self.admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.person_admin = site._registry[Person]
+
+    def add_family(self, index):
+        guardian = Person.objects.create(user=User.objects.create(username=f'guardian{index}'), role=self.role)
+        student = Person.objects.create(user=User.objects.create(username=f'student{index}'), role=self.role)
+        GuardianStudent.objects.create(guardian=guardian, student=student, relationship='Parent')
+        for group in self.groups:
+            Participation.objects.create(person=student, group=group, years=[2024])
+        return guardian, student
+
+    def cold_results(self):
+        request = RequestFactory().get('/admin/experiences/person/')
+        request.user = self.admin_user
+        changelist = self.person_admin.get_changelist_instance(request)
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            changelist.get_results(request)
+        return changelist, len(queries)
+
+    def test_page_costs_fixed_number_of_queries(self):
+        self.add_family(0)
+        _, small_page = self.cold_results()
+        for index in range(1, 10):
+            self.add_family(index)
+        changelist, large_page = self.cold_results()
+
+        self.assertEqual(changelist.result_count, 20)
+        self.assertEqual(small_page, large_page)
+
+    def test_columns_read_from_page_data(self):
+        guardian, student = self.add_family(0)
+        changelist, _ = self.cold_results()
+        rows = {person.pk: person for person in changelist.result_list}
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.person_admin.get_participations(rows[student.pk]), 'Group 0, Group 1, Group 2')
+            self.assertEqual(self.person_admin.get_guardians(rows[student.pk]), str(guardian))
+            self.assertEqual(self.person_admin.get_students(rows[guardian.pk]), str(student))
+            self.assertEqual(self.person_admin.get_guardians(rows[guardian.pk]), '-')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class FacilitatorIndexTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        facilitators._index.clear()
+        self.facilitator = Role.objects.create(title='Facilitator')
+        self.student = Role.objects.create(title='Student')
+        self.chess, self.robotics = Group.objects.create(name='Chess'), Group.objects.create(name='Robotics')
+        self.ann = Person.objects.create(
+            user=User.objects.create(username='ann', first_name='Ann', last_name='Lee'), role=self.facilitator)
+        self.ben = Person.objects.create(user=User.objects.create(username='ben'), role=self.facilitator)
+        Participation.objects.create(person=self.ann, group=self.chess, years=[2023, 2024])
+        Participation.objects.create(person=self.ben, group=self.chess, years=[2022])
+        Participation.objects.create(person=self.ben, group=self.robotics, years=[2024])
+
+    def test_whole_page_answered_from_one_query(self):
+        with self.assertNumQueries(1):
+            facilitators.get_facilitators([self.chess.pk])
+        with self.assertNumQueries(0):
+            by_group = facilitators.get_facilitators([self.chess.pk, self.robotics.pk])
+            in_2024 = facilitators.get_facilitators([self.chess.pk, self.robotics.pk], year=2024)
+        self.assertEqual(by_group, {self.chess.pk: ['Ann Lee', 'ben'], self.robotics.pk: ['ben']})
+        self.assertEqual(in_2024, {self.chess.pk: ['Ann Lee'], self.robotics.pk: ['ben']})
+
+    def test_index_follows_participation_and_role_changes(self):
+        facilitators.get_facilitators([self.chess.pk])
+        carl = Person.objects.create(user=User.objects.create(username='carl'), role=self.facilitator)
+        Participation.objects.create(person=carl, group=self.robotics, years=[2024])
+        self.assertEqual(facilitators.get_facilitators([self.robotics.pk])[self.robotics.pk], ['ben', 'carl'])
+
+        self.ben.role = self.student
+        self.ben.save()
+        self.assertEqual(facilitators.get_facilitators([self.robotics.pk])[self.robotics.pk], ['carl'])
+
+    def test_current_school_year(self):
+        self.assertEqual(facilitators.current_school_year(datetime.datetime(2025, 3, 1)), 2024)
+        self.assertEqual(facilitators.current_school_year(datetime.datetime(2025, 9, 1)), 2025)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ParticipationYearTests(TestCase):
+    def setUp(self):
+        self.group = Group.objects.create(name='Choir')
+        self.people = [
+            Person.objects.create(user=User.objects.create(username=f'singer{i}')) for i in range(3)
+        ]
+
+    def in_2024(self):
+        return set(Participation.objects.in_school_year(2024).values_list('person_id', flat=True))
+
+    def test_in_school_year_follows_save(self):
+        participation = Participation.objects.create(person=self.people[0], group=self.group, years=[2023, 2024])
+        Participation.objects.create(person=self.people[1], group=self.group, years=[2022])
+        self.assertEqual(self.in_2024(), {self.people[0].pk})
+
+        participation.years = [2023]
+        participation.save()
+        self.assertEqual(self.in_2024(), set())
+
+    def test_in_school_year_follows_bulk_operations(self):
+        created = Participation.objects.bulk_create([
+            Participation(person=person, group=self.group, years=[2024]) for person in self.people
+        ])
+        self.assertEqual(self.in_2024(), {person.pk for person in self.people})
+
+        Participation.objects.filter(person=self.people[0]).update(years=[2021])
+        created[1].years = []
+        Participation.objects.bulk_update(created[1:2], ['years'])
+        self.assertEqual(self.in_2024(), {self.people[2].pk})
+
+    def test_saves_only_sync_changed_years(self):
+        Participation.objects.create(person=self.people[0], group=self.group, years=[2023, 2024])
+        rows = dict(ParticipationYear.objects.values_list('year', 'pk'))
+
+        participation = Participation.objects.get()
+        participation.hours = 5
+        with CaptureQueriesContext(connection) as queries:
+            participation.save()
+            participation.save(update_fields=['hours'])
+        self.assertFalse([q for q in queries if 'experiences_participationyear' in q['sql']])
+
+        participation.years = [2024, 2025]
+        participation.save()
+        self.assertEqual(dict(ParticipationYear.objects.values_list('year', 'pk'))[2024], rows[2024])
+        self.assertEqual(sorted(ParticipationYear.objects.values_list('year', flat=True)), [2024, 2025])
+
+    def test_admin_lists_years_from_the_table(self):
+        Participation.objects.create(person=self.people[0], group=self.group, years=[2024, 2023])
+        Participation.objects.create(person=self.people[1], group=self.group, years=[2022])
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+        response = self.client.get(reverse('admin:experiences_participation_changelist'), {'school_year': 2024})
+        result_list = response.context['cl'].result_list
+        self.assertEqual([p.person_id for p in result_list], [self.people[0].pk])
+        self.assertEqual(site._registry[Participation].years_display(result_list[0]), '2023-2024, 2024-2025')
+
+    def test_backfill_command(self):
+        Participation.objects.create(person=self.people[0], group=self.group, years=['2024', 2025])
+        ParticipationYear.objects.all().delete()
+
+        call_command('backfill_participation_years', batch_size=1, stdout=StringIO())
+        self.assertEqual(sorted(ParticipationYear.objects.values_list('year', flat=True)), [2024, 2025])
+        self.assertEqual(self.in_2024(), {self.people[0].pk})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PersonStringTests(TestCase):
+    def setUp(self):
+        self.role = Role.objects.create(title='Student')
+        self.people = [
+            Person.objects.create(
+                user=User.objects.create(username=f'kid{i}', first_name='Kid', last_name=str(i)),
+                role=self.role, graduating_year=2030,
+            )
+            for i in range(12)
+        ]
+
+    def test_role_rename_rebuilds_in_bulk(self):
+        self.role.title = 'Learner'
+        # Role UPDATE, one read of the people and one bulk UPDATE per batch
+        with self.assertNumQueries(3):
+            self.role.save()
+        self.assertEqual(
+            set(Person.objects.values_list('cached_str', flat=True)),
+            {f'Kid {i} (Learner, Graduating: 2030)' for i in range(12)},
+        )
+
+    def test_user_rename_updates_string(self):
+        user = self.people[0].user
+        user.first_name = 'Renamed'
+        user.save()
+        self.assertEqual(Person.objects.get(pk=self.people[0].pk).cached_str,
+                         'Renamed 0 (Student, Graduating: 2030)')
+
+    def test_rebuild_writes_to_the_querysets_database(self):
+        Person.objects.update(cached_str='stale')
+        # A router sending writes elsewhere must not redirect a rebuild of "default"
+        with mock.patch('django.db.router.db_for_write', return_value='elsewhere'):
+            self.assertEqual(Person.objects.using('default').rebuild_cached_str(), len(self.people))
+        self.assertFalse(Person.objects.filter(cached_str='stale').exists())
+
+    def test_rebuild_person_strings_command(self):
+        other = Role.objects.create(title='Guardian')
+        guardian = Person.objects.create(user=User.objects.create(username='parent'), role=other)
+        Person.objects.update(cached_str='stale')
+
+        out = StringIO()
+        call_command('rebuild_person_strings', role='student', batch_size=5, stdout=out)
+        self.assertIn('updated 12 cached strings', out.getvalue())
+        self.assertEqual(Person.objects.get(pk=guardian.pk).cached_str, 'stale')
+
+        call_command('rebuild_person_strings', since='2000-01-01', stdout=StringIO())
+        self.assertEqual(Person.objects.get(pk=guardian.pk).cached_str, 'parent (Guardian)')
+
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHES, PASSWORD_HASH_WORKERS=1,
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+)
+class PeopleImportTests(TestCase):
+    def setUp(self):
+        self.student = Role.objects.create(title='Student')
+        self.guardian = Role.objects.create(title='Guardian')
+
+    def reader(self, rows):
+        out = StringIO()
+        writer = csv.DictWriter(out, ['email', 'role', 'first_name', 'last_name', 'graduating_year'])
+        writer.writeheader()
+        writer.writerows(rows)
+        out.seek(0)
+        return csv.DictReader(out)
+
+    def roster(self, count, start=0):
+        return [
+            {'email': f'kid{i}@example.com', 'role': 'student', 'first_name': 'Kid',
+             'last_name': str(i), 'graduating_year': '2030'}
+            for i in range(start, start + count)
+        ]
+
+    def test_creates_users_and_people(self):
+        User.objects.create(username='kid0')
+        result = people_import.import_people(self.reader(self.roster(3)), create_users=True)
+
+        self.assertEqual((result.rows, result.created, result.skipped), (3, 3, 0))
+        self.assertEqual([user['username'] for user in result.created_users], ['kid01', 'kid1', 'kid2'])
+        user = User.objects.get(username='kid1')
+        self.assertTrue(user.check_password(result.created_users[1]['password']))
+        self.assertEqual(user.person.cached_str, 'Kid 1 (Student, Graduating: 2030)')
+        self.assertEqual(user.person.role, self.student)
+
+    def test_updates_existing_people(self):
+        user = User.objects.create(username='parent', email='parent@example.com', last_name='Keep')
+        person = Person.objects.create(user=user, role=self.student)
+        before = Person.objects.get(pk=person.pk).last_modified
+        result = people_import.import_people(self.reader([
+            {'email': 'parent@example.com', 'role': 'GUARDIAN', 'first_name': 'Pat', 'last_name': 'Other'},
+        ]))
+
+        self.assertEqual((result.updated, result.created_users), (1, []))
+        person = Person.objects.select_related('user').get(pk=person.pk)
+        self.assertEqual((person.user.first_name, person.user.last_name), ('Pat', 'Keep'))
+        self.assertEqual(person.role, self.guardian)
+        self.assertEqual(person.cached_str, 'Pat Keep (Guardian)')
+        self.assertGreater(person.last_modified, before)
+
+    def test_unchanged_rows_are_not_written(self):
+        people_import.import_people(self.reader(self.roster(2)), create_users=True)
+        before = dict(Person.objects.values_list('pk', 'last_modified'))
+        rows = self.roster(2)
+        rows[1]['graduating_year'] = '2031'
+        result = people_import.import_people(self.reader(rows))
+
+        self.assertEqual((result.unchanged, result.updated), (1, 1))
+        self.assertEqual(result.outcomes, [])
+        after = dict(Person.objects.values_list('pk', 'last_modified'))
+        self.assertEqual(sum(after[pk] == before[pk] for pk in before), 1)
+
+    def test_skips_invalid_rows(self):
+        result = people_import.import_people(self.reader([
+            {'email': 'kid@example.com', 'role': 'wizard'},
+            {'email': '', 'role': 'student'},
+            {'email': 'kid@example.com', 'role': 'student', 'graduating_year': 'soon'},
+            {'email': 'nobody@example.com', 'role': 'student'},
+        ]))
+
+        self.assertEqual((result.rows, result.skipped), (4, 4))
+        self.assertEqual(result.errors[0], "Row 2: Role 'wizard' does not exist")
+        self.assertIn('create_users is not checked', result.errors[3])
+        self.assertFalse(Person.objects.exists())
+
+    def test_queries_do_not_grow_with_rows(self):
+        def count_queries(rows, start):
+            with CaptureQueriesContext(connection) as queries:
+                people_import.import_people(self.reader(self.roster(rows, start)), create_users=True)
+            return len(queries)
+
+        self.assertEqual(count_queries(5, 0), count_queries(50, 100))
+        self.assertEqual(Person.objects.count(), 55)
+
+    def test_parallel_password_hashing(self):
+        with password_hashing.ParallelHasher(workers=2) as hasher:
+            hashes = hasher.hash(['one', 'two', 'three'])
+            self.assertIsNotNone(hasher.executor)
+        # The workers use the hasher of the overridden settings
+        self.assertTrue(all(hashed.startswith('md5$') for hashed in hashes))
+        self.assertEqual(
+            [check_password(password, hashed) for password, hashed in zip(['one', 'two', 'three'], hashes)],
+            [True, True, True],
+        )
+
+        result = people_import.import_people(self.reader(self.roster(4)), create_users=True, hash_workers=2)
+        for credentials in result.created_users:
+            self.assertTrue(User.objects.get(username=credentials['username']).check_password(credentials['password']))
+
+    def test_benchmark_command_rolls_back(self):
+        out = StringIO()
+        call_command('benchmark_people_import', rows=20, chunk_size=8, fast_hashing=True, stdout=out)
+        self.assertIn('Imported 20 rows (20 users, 20 people)', out.getvalue())
+        self.assertFalse(User.objects.exists())
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHES, PASSWORD_HASH_WORKERS=1, IMPORT_CHUNK_SIZE=2,
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+)
+class ImportJobTests(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.base_dir = override_settings(BASE_DIR=self.temp_dir.name)
+        self.base_dir.enable()
+        self.student = Role.objects.create(title='Student')
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.org', 'secret'))
+
+    def tearDown(self):
+        self.base_dir.disable()
+        self.temp_dir.cleanup()
+
+    def upload(self, view, content, **data):
+        return self.client.post(reverse(view), {'csv_file': SimpleUploadedFile('import.csv', content), **data})
+
+    def read(self, job, name):
+        with open(import_jobs.get_path(job.pk, name), newline='', encoding='utf-8') as f:
+            return list(csv.reader(f))
+
+    def test_people_import_runs_as_a_job(self):
+        response = self.upload(
+            'admin:experiences_person_import-people-csv',
+            b'email,role,first_name,last_name\n'
+            b'new@example.com,Student,New,Kid\nbad@example.com,Wizard,,\nnew2@example.com,student,,\n',
+            create_users='on',
+        )
+        job = ImportJob.objects.get()
+        self.assertRedirects(response, reverse('admin:import_job', args=[job.pk]), fetch_redirect_response=False)
+        self.assertEqual(job.state, ImportJob.QUEUED)
+
+        job = import_jobs.run_job(job.pk)
+        self.assertEqual(
+            (job.state, job.rows_total, job.rows_processed, job.created_count, job.skipped_count, job.users_created),
+            (ImportJob.SUCCEEDED, 3, 3, 2, 1, 2),
+        )
+        self.assertEqual(self.read(job, import_jobs.REPORT_FILE), [
+            ['line', 'email', 'role', 'first_name', 'last_name', 'result', 'message'],
+            ['2', 'new@example.com', 'Student', 'New', 'Kid', 'created', ''],
+            ['3', 'bad@example.com', 'Wizard', '', '', 'skipped', "Role 'wizard' does not exist"],
+            ['4', 'new2@example.com', 'student', '', '', 'created', ''],
+        ])
+        self.assertFalse(os.path.exists(import_jobs.get_path(job.pk, import_jobs.UPLOAD_FILE)))
+
+        page = self.client.get(reverse('admin:import_job', args=[job.pk]))
+        self.assertContains(page, "Row 3: Role &#x27;wizard&#x27; does not exist")
+        self.assertContains(page, 'Download user credentials CSV')
+        report = self.client.get(reverse('admin:import_job_report', args=[job.pk]))
+        self.assertEqual(report['Content-Disposition'], f'attachment; filename="import_{job.pk}_report.csv"')
+        report.close()
+
+        response = self.client.get(reverse('admin:import_job_credentials', args=[job.pk]))
+        credentials = b''.join(response.streaming_content).decode()
+        self.assertTrue(credentials.startswith('Username,Email,Password,Name\r\nnew,new@example.com,'))
+        # Served once
+        self.assertFalse(os.path.exists(import_jobs.get_path(job.pk, import_jobs.CREDENTIALS_FILE)))
+
+    def test_credentials_per_job_and_creator(self):
+        jobs = []
+        for i in range(2):
+            self.upload(
+                'admin:experiences_person_import-people-csv', f'email,role\nkid{i}@example.com,Student\n'.encode(),
+                create_users='on',
+            )
+            jobs.append(import_jobs.run_job(ImportJob.objects.latest('pk').pk))
+
+        # Another admin sees neither credentials
+        other = User.objects.create_superuser('other', 'other@example.org', 'secret')
+        self.client.force_login(other)
+        self.assertNotContains(self.client.get(reverse('admin:import_job', args=[jobs[0].pk])), 'credentials CSV')
+        response = self.client.get(reverse('admin:import_job_credentials', args=[jobs[0].pk]))
+        self.assertRedirects(response, reverse('admin:import_job', args=[jobs[0].pk]))
+        self.assertTrue(os.path.exists(import_jobs.get_path(jobs[0].pk, import_jobs.CREDENTIALS_FILE)))
+
+        # The second import does not hide the credentials of the first
+        self.client.force_login(jobs[0].created_by)
+        for job, email in zip(jobs, ['kid0@example.com', 'kid1@example.com']):
+            self.assertContains(self.client.get(reverse('admin:import_job', args=[job.pk])), 'credentials CSV')
+            response = self.client.get(reverse('admin:import_job_credentials', args=[job.pk]))
+            self.assertIn(email, b''.join(response.streaming_content).decode())
+
+    def test_jobs_of_other_admins_are_hidden(self):
+        self.upload(
+            'admin:experiences_person_import-people-csv', b'email,role\nkid@example.com,Student\n', create_users='on',
+        )
+        job = ImportJob.objects.get()
+        import_jobs.run_job(job.pk)
+        ImportJob.objects.filter(pk=job.pk).update(state=ImportJob.FAILED)
+
+        self.client.force_login(User.objects.create_user('staff', 'staff@example.org', 'secret', is_staff=True))
+        for view in ('import_job', 'import_job_status', 'import_job_report', 'import_job_credentials'):
+            self.assertEqual(self.client.get(reverse(f'admin:{view}', args=[job.pk])).status_code, 404, view)
+        self.assertEqual(self.client.post(reverse('admin:import_job_resume', args=[job.pk])).status_code, 404)
+        self.assertEqual(ImportJob.objects.get().state, ImportJob.FAILED)
+
+    def test_clean_up(self):
+        self.upload(
+            'admin:experiences_person_import-people-csv', b'email,role\nkid@example.com,Student\n', create_users='on',
+        )
+        job = import_jobs.run_job(ImportJob.objects.get().pk)
+        credentials = import_jobs.get_path(job.pk, import_jobs.CREDENTIALS_FILE)
+        os.makedirs(os.path.dirname(import_jobs.get_path(job.pk + 1, import_jobs.UPLOAD_FILE)))
+        self.assertEqual(import_jobs.clean_up(), (0, 0))
+
+        # Expired credentials cannot be downloaded, and are deleted
+        later = job.finished_at + datetime.timedelta(days=2)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            self.assertIsNone(import_jobs.get_credentials_path(job, job.created_by))
+        self.assertEqual(import_jobs.clean_up(later), (1, 0))
+        self.assertFalse(os.path.exists(credentials))
+        self.assertTrue(os.path.exists(import_jobs.get_path(job.pk, import_jobs.REPORT_FILE)))
+
+        # Then the files of the job, and the directories without a job
+        out = StringIO()
+        with mock.patch('django.utils.timezone.now', return_value=job.finished_at + datetime.timedelta(days=31)):
+            call_command('clean_import_jobs', stdout=out)
+        self.assertIn('Deleted 0 expired credentials files and 2 import job directories', out.getvalue())
+        self.assertEqual(os.listdir(import_jobs.get_root()), [])
+
+    def test_missing_columns_are_not_queued(self):
+        response = self.upload('admin:experiences_person_import-people-csv', b'email\nkid@example.com\n')
+        self.assertRedirects(response, reverse('admin:experiences_person_import-people-csv'))
+        self.assertFalse(ImportJob.objects.exists())
+
+    def test_resume_after_crash(self):
+        self.upload(
+            'admin:experiences_person_import-people-csv',
+            b'email,role\n' + ''.join(f'kid{i}@example.com,Student\n' for i in range(5)).encode(),
+            create_users='on',
+        )
+        job = ImportJob.objects.get()
+        save_checkpoint = import_jobs.save_checkpoint
+
+        def crash_in_second_chunk(job, result, sizes):
+            # The report lines of the chunk are on disk, its rows are not committed
+            if job.rows_processed:
+                raise KeyboardInterrupt
+            save_checkpoint(job, result, sizes)
+
+        with mock.patch.object(import_jobs, 'save_checkpoint', crash_in_second_chunk):
+            with self.assertRaises(KeyboardInterrupt):
+                import_jobs.run_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.rows_processed), (ImportJob.RUNNING, 2))
+        self.assertEqual(User.objects.filter(email__startswith='kid').count(), 2)
+        self.assertFalse(import_jobs.is_resumable(job))
+
+        ImportJob.objects.filter(pk=job.pk).update(checkpoint_at=timezone.now() - datetime.timedelta(hours=1))
+        self.assertContains(self.client.get(reverse('admin:import_job', args=[job.pk])), 'Resume import')
+        out = StringIO()
+        call_command('resume_import_jobs', stdout=out)
+        self.assertIn('Resuming import #%d after row 2' % job.pk, out.getvalue())
+
+        job.refresh_from_db()
+        self.assertEqual(
+            (job.state, job.rows_processed, job.created_count, job.users_created),
+            (ImportJob.SUCCEEDED, 5, 5, 5),
+        )
+        self.assertEqual(User.objects.filter(email__startswith='kid').count(), 5)
+        self.assertEqual([row[0] for row in self.read(job, import_jobs.REPORT_FILE)], ['line', '2', '3', '4', '5', '6'])
+        self.assertEqual(
+            [row[1] for row in self.read(job, import_jobs.CREDENTIALS_FILE)],
+            ['Email'] + [f'kid{i}@example.com' for i in range(5)],
+        )
+
+    def test_guardian_import_job(self):
+        parent = Person.objects.create(user=User.objects.create(username='parent', email='parent@example.com'))
+        child = Person.objects.create(user=User.objects.create(username='child', email='child@example.com'))
+        self.upload(
+            'admin:experiences_person_import-guardians-csv',
+            b'guardian_email,student_email,relationship\n'
+            b'parent@example.com,child@example.com,Parent\nparent@example.com,nobody@example.com,Parent\n',
+        )
+        job = import_jobs.run_job(ImportJob.objects.get().pk)
+
+        self.assertEqual((job.created_count, job.skipped_count), (1, 1))
+        self.assertTrue(GuardianStudent.objects.filter(guardian=parent, student=child, relationship='Parent').exists())
+        self.assertEqual(
+            self.read(job, import_jobs.REPORT_FILE)[2][-2:],
+            ['skipped', "Student with email 'nobody@example.com' not found"],
+        )
+        self.assertFalse(os.path.exists(import_jobs.get_path(job.pk, import_jobs.CREDENTIALS_FILE)))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class GuardianImportTests(TestCase):
+    def setUp(self):
+        self.people = {
+            name: Person.objects.create(user=User.objects.create(username=name, email=f'{name}@example.com'))
+            for name in ('mum', 'dad', 'kid', 'other')
+        }
+        User.objects.create(username='nobody', email='nobody@example.com')
+        GuardianStudent.objects.create(
+            guardian=self.people['mum'], student=self.people['kid'], relationship='Parent', is_active=False,
+        )
+        GuardianStudent.objects.create(guardian=self.people['dad'], student=self.people['kid'], relationship='Parent')
+        GuardianStudent.objects.create(guardian=self.people['dad'], student=self.people['other'], relationship='Parent')
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'guardians.csv')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write_csv(self, lines):
+        with open(self.path, 'w') as f:
+            f.write('guardian_email,student_email,relationship,notes\n' + ''.join(f'{line}\n' for line in lines))
+
+    def import_guardians(self, **options):
+        out, err = StringIO(), StringIO()
+        call_command('import_guardians', self.path, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_command_upserts_in_bulk(self):
+        self.write_csv([
+            'mum@example.com,kid@example.com,Mother,',
+            'dad@example.com,kid@example.com,Parent,',
+            'dad@example.com,other@example.com,Guardian,',
+            'mum@example.com,other@example.com,Parent,Weekends',
+            'mum@example.com,other@example.com,Parent,',
+            'mum@example.com,missing@example.com,Parent,',
+            'nobody@example.com,kid@example.com,Parent,',
+            ',kid@example.com,Parent,',
+        ])
+        out, err = self.import_guardians(batch_size=3, verbosity=2)
+
+        self.assertIn('8 rows: 1 created, 2 updated, 2 unchanged, 3 skipped', out)
+        self.assertIn('Updated: mum@example.com -> kid@example.com (Mother)', out)
+        self.assertIn('Already exists: dad@example.com -> kid@example.com (Parent)', out)
+        self.assertIn("Skipping row 7 - Student with email 'missing@example.com' not found", err)
+        self.assertIn("Skipping row 8 - Guardian person record for 'nobody@example.com' not found", err)
+        self.assertIn('Skipping row 9 - Missing required fields', err)
+        relations = {
+            (relation.guardian.user.username, relation.student.user.username): relation
+            for relation in GuardianStudent.objects.select_related('guardian__user', 'student__user')
+        }
+        self.assertEqual(len(relations), 4)
+        self.assertEqual((relations['mum', 'kid'].relationship, relations['mum', 'kid'].is_active), ('Mother', True))
+        self.assertEqual(relations['dad', 'other'].relationship, 'Guardian')
+        self.assertEqual(relations['mum', 'other'].notes, 'Weekends')
+
+    def test_command_commits_per_batch(self):
+        self.write_csv(['mum@example.com,other@example.com,Parent,', 'kid@example.com,other@example.com,Sibling,'])
+        write = guardian_import.GuardianImporter.write
+        calls = []
+
+        def fail_second_batch(importer, new_relations, changed):
+            calls.append(new_relations)
+            if len(calls) == 2:
+                raise DatabaseError('database is locked')
+            write(importer, new_relations, changed)
+
+        with mock.patch.object(guardian_import.GuardianImporter, 'write', fail_second_batch):
+            out, err = self.import_guardians(batch_size=1)
+
+        self.assertIn('2 rows: 1 created, 0 updated, 0 unchanged, 1 skipped', out)
+        self.assertIn('Skipping row 3 - Not imported: database is locked', err)
+        # The first batch stays committed
+        self.assertTrue(GuardianStudent.objects.filter(guardian=self.people['mum'], student=self.people['other']).exists())
+        self.assertFalse(GuardianStudent.objects.filter(guardian=self.people['kid']).exists())
+
+    def test_dry_run_makes_no_changes(self):
+        self.write_csv(['mum@example.com,other@example.com,Parent,', 'mum@example.com,kid@example.com,Parent,'])
+        out, err = self.import_guardians(dry_run=True)
+        self.assertIn('2 rows: 1 created, 1 updated', out)
+        self.assertEqual(GuardianStudent.objects.count(), 3)
+        self.assertFalse(GuardianStudent.objects.get(guardian=self.people['mum']).is_active)
+
+    def test_queries_do_not_grow_with_rows(self):
+        for i in range(20):
+            Person.objects.create(user=User.objects.create(username=f'kid{i}', email=f'kid{i}@example.com'))
+
+        def count_queries(rows):
+            importer = guardian_import.GuardianImporter()
+            with CaptureQueriesContext(connection) as queries:
+                importer.import_chunk(rows)
+            return len(queries)
+
+        def rows(students, relationship):
+            return [
+                (i + 2, {'guardian_email': 'dad@example.com', 'student_email': f'kid{i}@example.com',
+                         'relationship': relationship})
+                for i in students
+            ]
+
+        self.assertEqual(count_queries(rows(range(2), 'Parent')), count_queries(rows(range(2, 20), 'Parent')))
+        self.assertEqual(count_queries(rows(range(2), 'Guardian')), count_queries(rows(range(20), 'Guardian')))
+        self.assertEqual(GuardianStudent.objects.filter(relationship='Guardian').count(), 20)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ImportPreviewTests(TestCase):
+    def setUp(self):
+        self.student = Role.objects.create(title='Student')
+        self.guardian = Role.objects.create(title='Guardian')
+        self.kid = Person.objects.create(
+            user=User.objects.create(username='kid', email='kid@example.com', first_name='Kid'),
+            role=self.student, graduating_year=2030,
+        )
+        self.mum = Person.objects.create(
+            user=User.objects.create(username='mum', email='mum@example.com'), role=self.student,
+        )
+        GuardianStudent.objects.create(guardian=self.mum, student=self.kid, relationship='Parent', is_active=False)
+
+    def reader(self, text):
+        return csv.DictReader(StringIO(text))
+
+    def test_people_preview(self):
+        reader = self.reader(
+            'email,role,first_name,graduating_year\n'
+            'kid@example.com,student,,2030\n'
+            'mum@example.com,Guardian,Mum,\n'
+            'new@example.com,student,New,2031\n'
+            'new@example.com,student,,2031\n'
+            'odd@example.com,wizard,,\n'
+        )
+        # Roles, usernames and the users of the file's emails; nothing is written
+        with self.assertNumQueries(3):
+            result = import_preview.preview('people', reader, create_users=True)
+
+        self.assertEqual([(line, outcome, message) for line, row, outcome, message in result.outcomes], [
+            (2, 'unchanged', ''),
+            (3, 'updated', "first_name: '' -> 'Mum'; role: 'Student' -> 'Guardian'"),
+            (4, 'created', ''),
+            (5, 'unchanged', ''),
+            (6, 'skipped', "Role 'wizard' does not exist"),
+        ])
+        self.assertEqual([user['password'] for user in result.created_users], [''])
+        self.assertFalse(User.objects.filter(email='new@example.com').exists())
+        self.assertEqual(Person.objects.get(pk=self.mum.pk).role, self.student)
+
+    def test_guardian_preview(self):
+        reader = self.reader(
+            'guardian_email,student_email,relationship\n'
+            'mum@example.com,kid@example.com,Mother\n'
+            'kid@example.com,mum@example.com,Ward\n'
+            'kid@example.com,mum@example.com,Ward\n'
+            'mum@example.com,nobody@example.com,Parent\n'
+        )
+        # The people of the file's emails, and the guardians' relationships
+        with self.assertNumQueries(2):
+            result = import_preview.preview('guardians', reader)
+
+        self.assertEqual([(outcome, message) for line, row, outcome, message in result.outcomes], [
+            ('updated', "relationship: 'Parent' -> 'Mother'; reactivated"),
+            ('created', ''),
+            ('unchanged', ''),
+            ('skipped', "Student with email 'nobody@example.com' not found"),
+        ])
+        self.assertEqual(GuardianStudent.objects.count(), 1)
+        self.assertFalse(GuardianStudent.objects.get().is_active)
+
+    def test_admin_preview(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.org', 'secret'))
+        upload = SimpleUploadedFile('people.csv', b'email,role\nkid@example.com,Guardian\nnew@example.com,Student\n')
+        response = self.client.post(
+            reverse('admin:experiences_person_import-people-csv'),
+            {'csv_file': upload, 'create_users': 'on', 'preview': 'on'},
+        )
+
+        self.assertContains(response, 'Importing this file would')
+        self.assertContains(response, "role: &#x27;Student&#x27; -&gt; &#x27;Guardian&#x27;")
+        self.assertFalse(ImportJob.objects.exists())
+        self.assertFalse(User.objects.filter(email='new@example.com').exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PrincipalTests(TestCase):
+    def setUp(self):
+        guardianship._index.clear()
+        self.group = Group.objects.create(name='Debate')
+        self.parent = Person.objects.create(user=User.objects.create(username='parent'))
+        self.child = Person.objects.create(user=User.objects.create(username='child'))
+        self.stranger = Person.objects.create(user=User.objects.create(username='stranger'))
+        GuardianStudent.objects.create(guardian=self.parent, student=self.child, relationship='Parent')
+        self.participations = {
+            person.pk: Participation.objects.create(person=person, group=self.group, years=[2024])
+            for person in (self.parent, self.child, self.stranger)
+        }
+
+    def request_for(self, user):
+        request = RequestFactory().get('/')
+        request.user = user
+        request.principal = Principal(user)
+        return request
+
+    def test_facts_are_computed_once(self):
+        principal = Principal(self.parent.user)
+        # Administrators lookup, Person lookup, guardianship index
+        with self.assertNumQueries(3):
+            for _ in range(3):
+                self.assertFalse(principal.is_admin)
+                self.assertTrue(principal.is_self(self.parent))
+                self.assertTrue(principal.is_guardian_of(self.child.pk))
+                self.assertFalse(principal.is_guardian_of(self.stranger))
+
+    def test_participation_form_uses_the_principal(self):
+        principal = Principal(self.child.user)
+        self.assertFalse(principal.is_admin)
+        self.assertEqual(principal.person, self.child)
+
+        with self.assertNumQueries(0):
+            form = ParticipationForm(user=self.child.user, principal=principal)
+        form = ParticipationForm(
+            QueryDict(f'group={self.group.pk}&years_year=2025'), user=self.child.user, principal=principal,
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+        # Only the Participation insert and its side tables
+        with CaptureQueriesContext(connection) as queries:
+            participation = form.save()
+        self.assertFalse([q for q in queries if 'auth_group' in q['sql'] or 'experiences_person"' in q['sql']])
+        self.assertEqual(participation.person, self.child)
+
+    def test_views_share_the_request_principal(self):
+        request = self.request_for(self.parent.user)
+        list_view = ParticipationListView()
+        list_view.setup(request)
+        self.assertEqual(
+            set(list_view.get_queryset().values_list('person_id', flat=True)),
+            {self.parent.pk, self.child.pk},
+        )
+
+        person_list_view = PersonListView()
+        person_list_view.setup(request)
+        # Only the people themselves: the visible ids come from the guardianship index
+        with self.assertNumQueries(1):
+            self.assertEqual({person.pk for person in person_list_view.get_queryset()}, {self.parent.pk, self.child.pk})
+
+        detail_view = ParticipationDetailView()
+        detail_view.setup(request, pk=self.participations[self.child.pk].pk)
+        # Only the participation itself is fetched, the principal is already resolved
+        with self.assertNumQueries(1):
+            detail_view.get_object()
+
+        detail_view.setup(request, pk=self.participations[self.stranger.pk].pk)
+        with self.assertRaises(PermissionDenied):
+            detail_view.get_object()
+
+    def test_middleware_attaches_principal(self):
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        PrincipalMiddleware(lambda request: None)(request)
+        self.assertFalse(request.principal.is_admin)
+        self.assertIsNone(request.principal.person)
+        self.assertEqual(request.principal.student_ids, frozenset())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class GuardianshipIndexTests(TestCase):
+    def setUp(self):
+        guardianship._index.clear()
+        self.parent, self.child, self.sibling, self.stranger = [
+            Person.objects.create(user=User.objects.create(username=name))
+            for name in ('parent', 'child', 'sibling', 'stranger')
+        ]
+        GuardianStudent.objects.create(guardian=self.parent, student=self.child, relationship='Parent')
+        self.inactive = GuardianStudent.objects.create(
+            guardian=self.parent, student=self.sibling, relationship='Parent', is_active=False
+        )
+
+    def test_checks_are_answered_without_queries(self):
+        guardianship.get_index()
+        with self.assertNumQueries(0):
+            self.assertTrue(guardianship.can_view(self.parent.pk, self.child.pk))
+            self.assertTrue(guardianship.can_view(self.child.pk, self.parent.pk))
+            self.assertTrue(guardianship.can_view(self.stranger.pk, self.stranger.pk))
+            self.assertFalse(guardianship.can_view(self.parent.pk, self.stranger.pk))
+            self.assertFalse(guardianship.can_view(None, self.child.pk))
+            self.assertEqual(guardianship.listed_ids(self.parent.pk), {self.parent.pk, self.child.pk})
+            self.assertEqual(guardianship.listed_ids(self.child.pk), {self.child.pk})
+
+    def test_inactive_edges_are_ignored(self):
+        self.assertEqual(guardianship.students_of(self.parent.pk), {self.child.pk})
+        self.assertEqual(guardianship.guardians_of(self.sibling.pk), frozenset())
+
+    def test_relationship_changes_invalidate_the_index(self):
+        self.assertFalse(guardianship.can_view(self.parent.pk, self.sibling.pk))
+        self.inactive.is_active = True
+        self.inactive.save()
+        self.assertTrue(guardianship.can_view(self.parent.pk, self.sibling.pk))
+
+        GuardianStudent.objects.filter(student=self.child).delete()
+        self.assertFalse(guardianship.can_view(self.parent.pk, self.child.pk))
+
+        # Deleting a person cascades to their relationships
+        self.sibling.delete()
+        self.assertEqual(guardianship.students_of(self.parent.pk), frozenset())
+
+    def test_index_is_shared_through_the_cache(self):
+        guardianship.get_index()
+        guardianship._index.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(guardianship.students_of(self.parent.pk), {self.child.pk})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ModelVisibilityMiddlewareTests(TestCase):
+    def setUp(self):
+        self.middleware = ModelVisibilityMiddleware(lambda request: 'ok')
+        self.admin_user = User.objects.create(username='admin', is_staff=True, is_superuser=True)
+        ModelVisibilitySettings.objects.create(model_name='group', access_level='public')
+
+    def get(self, path, user=None):
+        request = RequestFactory().get(path)
+        request.user = user or AnonymousUser()
+        return self.middleware(request)
+
+    def test_steady_state_requests_do_not_query(self):
+        self.get('/experiences/group/1/')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get('/experiences/group/1/'), 'ok')
+            self.assertEqual(self.get('/public/person/1/'), 'ok')
+            self.assertEqual(self.get('/experiences/unrelated/'), 'ok')
+            # Models without a settings row fall back to staff-only, also from the snapshot
+            with self.assertRaises(Http404):
+                self.get('/experiences/person/1/')
+            self.assertEqual(self.get('/experiences/badges/', self.admin_user), 'ok')
+
+    def test_admin_save_refreshes_the_snapshot(self):
+        self.get('/experiences/group/1/')
+        model_admin = ModelVisibilitySettingsAdmin(ModelVisibilitySettings, site)
+        request = RequestFactory().post('/admin/')
+        request.user = self.admin_user
+        setting = ModelVisibilitySettings.objects.get(model_name='group')
+        setting.access_level = 'disabled'
+        model_admin.save_model(request, setting, None, True)
+
+        with self.assertRaises(Http404):
+            self.get('/experiences/group/1/', self.admin_user)
+        self.assertEqual(ModelVisibilitySettings.objects.get(model_name='group').modified_by, self.admin_user)
+
+        model_admin.delete_model(request, setting)
+        with self.assertRaises(Http404):
+            self.get('/experiences/group/1/')
+        self.assertEqual(self.get('/experiences/group/1/', self.admin_user), 'ok')
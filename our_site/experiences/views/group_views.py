@@ -3,6 +3,7 @@ from django.views.generic.edit import CreateView, UpdateView, DeleteView
 from django.views.generic.list import ListView
 from ..models import Group
 from ..forms import GroupForm
+from ..principal import get_principal
 from django.urls import reverse_lazy
 from django.urls import reverse
 from django.http import Http404
@@ -85,29 +86,23 @@ class GroupDetailView(DetailView):
 
     def get_context_data(self, **kwargs):
         context = super(GroupDetailView, self).get_context_data(**kwargs)
-        user = self.request.user
+        principal = get_principal(self.request)
         group = self.object
         
         # Filter members based on user permissions
-        if user.is_superuser or user.groups.filter(name='Administrators').exists() or user.is_staff:
+        if principal.user.is_staff or principal.is_admin:
             # Staff, superusers, and administrators can see all members
             context['visible_members'] = group.members.all()
+        elif principal.person is not None:
+            # Only show members who are the user themselves or their children
+            context['visible_members'] = group.members.filter(id__in=principal.listed_ids)
+            
+            # Add a flag to indicate filtering is in place
+            context['members_filtered'] = True
         else:
-            try:
-                person = user.person
-                # Get IDs of the user and their children/students
-                visible_person_ids = [person.id]
-                visible_person_ids.extend(person.students.values_list('id', flat=True))
-                
-                # Only show members who are the user themselves or their children
-                context['visible_members'] = group.members.filter(id__in=visible_person_ids)
-                
-                # Add a flag to indicate filtering is in place
-                context['members_filtered'] = True
-            except:
-                # If user doesn't have a person profile, show no members
-                context['visible_members'] = group.members.none()
-                context['members_filtered'] = True
+            # If user doesn't have a person profile, show no members
+            context['visible_members'] = group.members.none()
+            context['members_filtered'] = True
         
         return context
 
@@ -199,18 +194,15 @@ class GroupUpdateView(UpdateView):
         return super().dispatch(request, *args, **kwargs)
 
     def has_change_permission(self, request):
-        # Superusers can edit anything
-        if request.user.is_superuser:
-            return True
-        # Administrators can edit any group
-        if request.user.groups.filter(name='Administrators').exists():
+        principal = get_principal(request)
+        # Superusers and administrators can edit any group
+        if principal.is_admin:
             return True
         # Check if the user is a facilitator and a member of this group
-        try:
-            person = request.user.person
-            return person.role.title == 'Facilitator' and person in self.object.members.all()
-        except:
+        person = principal.person
+        if person is None or person.role is None or person.role.title != 'Facilitator':
             return False
+        return self.object.members.filter(pk=person.pk).exists()
 
     def get(self, request, *args, **kwargs):
         return super(GroupUpdateView, self).get(request, *args, **kwargs)
@@ -280,7 +272,7 @@ class GroupDeleteView(DeleteView):
         self.object = self.get_object()
         
         # Only superusers and administrators can delete
-        if not (request.user.is_superuser or request.user.groups.filter(name='Administrators').exists()):
+        if not get_principal(request).is_admin:
             raise PermissionDenied
             
         return super().dispatch(request, *args, **kwargs)
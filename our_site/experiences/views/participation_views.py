@@ -1,13 +1,13 @@
 from django.views.generic.detail import DetailView
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
 from django.views.generic.list import ListView
-from ..models import Participation, Person
+from ..models import Participation
 from ..forms import ParticipationForm
+from ..principal import get_principal
 from django.urls import reverse_lazy
 from django.urls import reverse
 from django.http import Http404
 from django.core.exceptions import PermissionDenied
-from django.db.models import Q
 
 
 class ParticipationListView(ListView):
@@ -30,31 +30,22 @@ class ParticipationListView(ListView):
 
     def get_queryset(self):
         queryset = super(ParticipationListView, self).get_queryset()
-        user = self.request.user
+        principal = get_principal(self.request)
         
         # If not authenticated, return empty queryset
-        if not user.is_authenticated:
+        if not principal.is_authenticated:
             return Participation.objects.none()
             
         # Superusers and administrators can see all participations
-        if user.is_superuser or user.groups.filter(name='Administrators').exists():
+        if principal.is_admin:
             return queryset
             
-        try:
-            # Get the person object for the current user
-            person = Person.objects.get(user=user)
-            
-            # Get IDs of all students of the current user (if they're a guardian)
-            student_ids = person.students.values_list('id', flat=True)
-            
-            # Filter participations by the user's own participations and their students' participations
-            return queryset.filter(
-                Q(person=person) |  # User's own participations
-                Q(person__id__in=student_ids)  # Participations of user's students
-            )
-        except Person.DoesNotExist:
-            # If the user doesn't have a person record, return empty queryset
+        # If the user doesn't have a person record, return empty queryset
+        if principal.person is None:
             return Participation.objects.none()
+            
+        # The user's own participations and their students' participations
+        return queryset.filter(person__id__in=principal.listed_ids)
 
     def get_allow_empty(self):
         return super(ParticipationListView, self).get_allow_empty()
@@ -63,8 +54,7 @@ class ParticipationListView(ListView):
         ret = super(ParticipationListView, self).get_context_data(*args, **kwargs)
         
         # Add context variable to indicate if user can create new participations
-        user = self.request.user
-        ret['can_create'] = user.is_superuser or user.groups.filter(name='Administrators').exists()
+        ret['can_create'] = get_principal(self.request).is_admin
         
         return ret
 
@@ -106,34 +96,30 @@ class ParticipationDetailView(DetailView):
 
     def get_object(self, queryset=None):
         obj = super(ParticipationDetailView, self).get_object(queryset)
-        user = self.request.user
+        principal = get_principal(self.request)
         
         # Check if user is authenticated
-        if not user.is_authenticated:
+        if not principal.is_authenticated:
             raise PermissionDenied("Please log in to view participation details.")
             
         # Superusers and administrators can view all participations
-        if user.is_superuser or user.groups.filter(name='Administrators').exists():
+        if principal.is_admin:
             return obj
             
-        try:
-            # Get the person object for the current user
-            person = Person.objects.get(user=user)
+        # If the user doesn't have a person record, deny access
+        if principal.person is None:
+            raise PermissionDenied("User profile not found.")
             
-            # Check if the participation belongs to the user
-            if obj.person == person:
-                return obj
-                
-            # Check if the participation belongs to one of the user's students
-            if obj.person.guardians.filter(id=person.id).exists():
-                return obj
-                
-            # If none of the above, deny access
-            raise PermissionDenied("You don't have permission to view this participation.")
+        # Check if the participation belongs to the user
+        if principal.is_self(obj.person_id):
+            return obj
             
-        except Person.DoesNotExist:
-            # If the user doesn't have a person record, deny access
-            raise PermissionDenied("User profile not found.")
+        # Check if the participation belongs to one of the user's students
+        if principal.is_guardian_of(obj.person_id):
+            return obj
+            
+        # If none of the above, deny access
+        raise PermissionDenied("You don't have permission to view this participation.")
 
     def get_queryset(self):
         return super(ParticipationDetailView, self).get_queryset()
@@ -143,16 +129,11 @@ class ParticipationDetailView(DetailView):
 
     def get_context_data(self, **kwargs):
         context = super(ParticipationDetailView, self).get_context_data(**kwargs)
-        user = self.request.user
+        principal = get_principal(self.request)
         participation = self.object
         
         # Add edit permission context
-        can_edit = (
-            user.is_superuser or 
-            user.groups.filter(name='Administrators').exists() or
-            (hasattr(user, 'person') and participation.person == user.person)
-        )
-        context['can_edit'] = can_edit
+        context['can_edit'] = principal.is_admin or principal.is_self(participation.person_id)
         
         return context
 
@@ -178,18 +159,18 @@ class ParticipationCreateView(CreateView):
 
     def dispatch(self, request, *args, **kwargs):
         # Check permissions
-        if not self.has_permission(request.user):
+        if not self.has_permission(get_principal(request)):
             raise PermissionDenied("You don't have permission to create participation records.")
         return super(ParticipationCreateView, self).dispatch(request, *args, **kwargs)
         
-    def has_permission(self, user):
+    def has_permission(self, principal):
         # Superusers and administrators can create any participation
-        if user.is_superuser or user.groups.filter(name='Administrators').exists():
+        if principal.is_admin:
             return True
         
         # Regular users can create their own participation records
         # but this will be enforced in form_valid
-        return user.is_authenticated
+        return principal.is_authenticated
 
     def get(self, request, *args, **kwargs):
         return super(ParticipationCreateView, self).get(request, *args, **kwargs)
@@ -203,7 +184,7 @@ class ParticipationCreateView(CreateView):
     def get_form(self, form_class=None):
         form_class = self.get_form_class()
         # Pass user to form
-        return form_class(user=self.request.user, **self.get_form_kwargs())
+        return form_class(user=self.request.user, principal=get_principal(self.request), **self.get_form_kwargs())
 
     def get_form_kwargs(self, **kwargs):
         return super(ParticipationCreateView, self).get_form_kwargs(**kwargs)
@@ -216,17 +197,15 @@ class ParticipationCreateView(CreateView):
 
     def form_valid(self, form):
         obj = form.save(commit=False)
-        user = self.request.user
+        principal = get_principal(self.request)
         
         # If not an admin/superuser, ensure the user can only create for themselves
-        if not (user.is_superuser or user.groups.filter(name='Administrators').exists()):
-            try:
-                person = Person.objects.get(user=user)
-                if obj.person != person:
-                    # Attempt to create for someone else
-                    raise PermissionDenied("You can only create participation records for yourself.")
-            except Person.DoesNotExist:
+        if not principal.is_admin:
+            if principal.person is None:
                 raise PermissionDenied("User profile not found.")
+            if not principal.is_self(obj.person_id):
+                # Attempt to create for someone else
+                raise PermissionDenied("You can only create participation records for yourself.")
                 
         obj.save()
         return super(ParticipationCreateView, self).form_valid(form)
@@ -265,28 +244,24 @@ class ParticipationUpdateView(UpdateView):
     def get(self, request, *args, **kwargs):
         self.object = self.get_object()
         # Additional permission check
-        if not self.has_permission(request.user, self.object):
+        if not self.has_permission(get_principal(request), self.object):
             raise PermissionDenied("You don't have permission to update this participation.")
         return super(ParticipationUpdateView, self).get(request, *args, **kwargs)
 
     def post(self, request, *args, **kwargs):
         self.object = self.get_object()
         # Additional permission check
-        if not self.has_permission(request.user, self.object):
+        if not self.has_permission(get_principal(request), self.object):
             raise PermissionDenied("You don't have permission to update this participation.")
         return super(ParticipationUpdateView, self).post(request, *args, **kwargs)
 
-    def has_permission(self, user, obj):
+    def has_permission(self, principal, obj):
         # Superusers and administrators can edit any participation
-        if user.is_superuser or user.groups.filter(name='Administrators').exists():
+        if principal.is_admin:
             return True
             
-        try:
-            # Only the person who owns the participation can edit it
-            person = Person.objects.get(user=user)
-            return obj.person == person
-        except Person.DoesNotExist:
-            return False
+        # Only the person who owns the participation can edit it
+        return principal.is_self(obj.person_id)
 
     def get_object(self, queryset=None):
         return super(ParticipationUpdateView, self).get_object(queryset)
@@ -303,7 +278,7 @@ class ParticipationUpdateView(UpdateView):
     def get_form(self, form_class=None):
         form_class = self.get_form_class()
         # Pass user to form
-        return form_class(user=self.request.user, **self.get_form_kwargs())
+        return form_class(user=self.request.user, principal=get_principal(self.request), **self.get_form_kwargs())
 
     def get_form_kwargs(self, **kwargs):
         return super(ParticipationUpdateView, self).get_form_kwargs(**kwargs)
@@ -356,21 +331,17 @@ class ParticipationDeleteView(DeleteView):
     def post(self, request, *args, **kwargs):
         self.object = self.get_object()
         # Additional permission check
-        if not self.has_permission(request.user, self.object):
+        if not self.has_permission(get_principal(request), self.object):
             raise PermissionDenied("You don't have permission to delete this participation.")
         return super(ParticipationDeleteView, self).post(request, *args, **kwargs)
 
-    def has_permission(self, user, obj):
+    def has_permission(self, principal, obj):
         # Superusers and administrators can delete any participation
-        if user.is_superuser or user.groups.filter(name='Administrators').exists():
+        if principal.is_admin:
             return True
             
-        try:
-            # Only the person who owns the participation can delete it
-            person = Person.objects.get(user=user)
-            return obj.person == person
-        except Person.DoesNotExist:
-            return False
+        # Only the person who owns the participation can delete it
+        return principal.is_self(obj.person_id)
 
     def delete(self, request, *args, **kwargs):
         return super(ParticipationDeleteView, self).delete(request, *args, **kwargs)
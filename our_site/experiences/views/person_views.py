@@ -3,6 +3,7 @@ from django.views.generic.edit import CreateView, UpdateView, DeleteView
 from django.views.generic.list import ListView
 from ..models import Person, Participation
 from ..forms import PersonForm
+from ..principal import get_principal
 from django.urls import reverse_lazy
 from django.urls import reverse
 from django.http import Http404
@@ -31,26 +32,21 @@ class PersonListView(ListView):
     def get_queryset(self):
         queryset = super(PersonListView, self).get_queryset().order_by('graduating_year', 'user__first_name', 'user__last_name')
         
+        principal = get_principal(self.request)
+
         # If user is not authenticated, don't show any people
-        if not self.request.user.is_authenticated:
+        if not principal.is_authenticated:
             return queryset.none()
             
         # Superusers and administrators can see all people
-        if self.request.user.is_superuser or self.request.user.groups.filter(name='Administrators').exists():
+        if principal.is_admin:
             return queryset
             
-        user_person = None
-        try:
-            user_person = self.request.user.person
-        except Person.DoesNotExist:
+        if principal.person is None:
             return queryset
             
-        # Get IDs of the user's own profile and their students
-        person_ids = [user_person.id]
-        person_ids.extend(user_person.students.values_list('id', flat=True))
-        
         # Return only the user's own profile and their students
-        return queryset.filter(id__in=person_ids)
+        return queryset.filter(id__in=principal.listed_ids)
 
     def get_allow_empty(self):
         return super(PersonListView, self).get_allow_empty()
@@ -59,13 +55,9 @@ class PersonListView(ListView):
         ret = super(PersonListView, self).get_context_data(*args, **kwargs)
         
         # Add information about which people are the user's students
-        if self.request.user.is_authenticated:
-            try:
-                user_person = self.request.user.person
-                students_ids = list(user_person.students.values_list('id', flat=True))
-                ret['students_ids'] = students_ids
-            except Person.DoesNotExist:
-                ret['students_ids'] = []
+        principal = get_principal(self.request)
+        if principal.is_authenticated:
+            ret['students_ids'] = list(principal.student_ids)
                 
         return ret
 
@@ -107,33 +99,26 @@ class PersonDetailView(DetailView):
 
     def get_object(self, queryset=None):
         obj = super().get_object(queryset)
-        user = self.request.user
+        principal = get_principal(self.request)
 
         # Allow access if the profile is public
         if obj.is_public:
             return obj
 
         # If not public, check if user is authenticated
-        if not user.is_authenticated:
+        if not principal.is_authenticated:
             # Instead of raising PermissionDenied immediately, 
             # Let's raise PermissionDenied for now, assuming login is required for non-public.
             raise PermissionDenied("Please log in to view this private profile.")
         
         # If authenticated, check specific permissions for private profiles
         # Superusers and administrators can view all profiles
-        if user.is_superuser or user.groups.filter(name='Administrators').exists():
-            return obj
-
-        # Users can view their own profile
-        if hasattr(user, 'person') and obj == user.person:
-             return obj
-
-        # Guardians can view their students' profiles
-        if hasattr(user, 'person') and user.person.students.filter(id=obj.id).exists():
+        if principal.is_admin:
             return obj
 
-        # Students can view their guardians' profiles
-        if hasattr(user, 'person') and user.person.guardians.filter(id=obj.id).exists():
+        # Users can view their own profile, guardians their students' profiles
+        # and students their guardians' profiles
+        if principal.can_view(obj):
             return obj
 
         # If none of the conditions are met, deny access
@@ -147,23 +132,15 @@ class PersonDetailView(DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        user = self.request.user
+        principal = get_principal(self.request)
         person = self.object # person whose profile is being viewed
-        viewer_person = getattr(user, 'person', None) # person viewing the profile, if they have one
-
-        # Determine if the current user can edit this profile
-        can_edit = (
-            user.is_authenticated and (
-                user.is_superuser or
-                user.groups.filter(name='Administrators').exists() or
-                person == viewer_person
-            )
-        )
-        context['can_edit'] = can_edit
 
         # Simplified visibility: owner/admin sees all, otherwise respect public flags
-        is_owner = person == viewer_person
-        is_admin = user.is_authenticated and (user.is_superuser or user.groups.filter(name='Administrators').exists())
+        is_owner = principal.is_self(person)
+        is_admin = principal.is_admin
+
+        # Determine if the current user can edit this profile
+        context['can_edit'] = is_admin or is_owner
 
         # Guardians visibility
         if is_admin or is_owner:
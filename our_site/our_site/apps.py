@@ -26,6 +26,9 @@ class OurSiteConfig(AppConfig):
         Called when the application is ready.
         Performs initial setup if the database does not exist.
         """
+        from .models import connect_tombstone_signals
+        connect_tombstone_signals()
+
         # Skip database initialization during certain management commands
         # where database access might cause issues
         if 'migrate' in sys.argv or 'collectstatic' in sys.argv or 'makemigrations' in sys.argv:
@@ -0,0 +1,168 @@
+"""
+Catalog of the backup files in ``backups/``.
+
+The backup pages used to list the directory and stat every file two or three
+times per view.  Now each backup adds an entry to ``backups/backup_catalog.json``
+when it completes: name, type, size, SHA-256, per-model rows, duration and
+creation time.  The file is written to ``.part`` and renamed.  The pages read
+the catalog, which each process keeps parsed until the file is replaced,
+so a page view costs one stat whatever the number of backups.
+
+When there is no catalog yet (or with ``manage.py rebuild_backup_catalog``)
+it is built from the files on disk, their type guessed from the file name.
+Entries are updated under a per-process lock; backups written by several
+processes at the same instant can lose an entry until the next rebuild.
+"""
+import datetime
+import json
+import os
+import threading
+
+from django.utils.dateparse import parse_datetime
+
+from . import backup_engine, media_store
+
+CATALOG_FILE = 'backup_catalog.json'
+TYPES = [
+    ('database', 'Database (JSON)'),
+    ('full', 'Database + media'),
+    ('incremental', 'Incremental'),
+    ('differential', 'Differential'),
+    ('csv', 'CSV (zip)'),
+    ('other', 'Other'),
+]
+# File name prefixes of each type, for files written before the catalog existed
+PREFIXES = [
+    ('db_csv_backup_', 'csv'),
+    ('db_backup_', 'database'),
+    ('full_backup_', 'full'),
+    ('incremental_backup_', 'incremental'),
+    ('differential_backup_', 'differential'),
+]
+# Files of backups/ that are not backups
+IGNORED_FILES = ('README.md', 'backup_chain.json', CATALOG_FILE)
+
+_lock = threading.Lock()
+_cached = (None, [])
+
+
+def get_catalog_path():
+    return os.path.join(backup_engine.get_backup_dir(), CATALOG_FILE)
+
+
+def guess_type(name):
+    for prefix, kind in PREFIXES:
+        if name.startswith(prefix):
+            return kind
+    return 'other'
+
+
+def describe(path, kind=None, models=None, elapsed=None, checksum=True):
+    """The catalog entry of backup file ``path``."""
+    stat = os.stat(path)
+    name = os.path.basename(path)
+    return {
+        'name': name,
+        'type': kind or guess_type(name),
+        'size': stat.st_size,
+        'sha256': media_store.hash_file(path) if checksum else None,
+        'rows': sum(models.values()) if models is not None else None,
+        'models': models,
+        'elapsed': elapsed,
+        'created': datetime.datetime.fromtimestamp(stat.st_mtime).isoformat(),
+    }
+
+
+def scan(checksums=False):
+    """Entries for the backup files on disk, oldest first (no rows or durations)."""
+    backup_dir = backup_engine.get_backup_dir()
+    entries = []
+    for name in os.listdir(backup_dir):
+        path = os.path.join(backup_dir, name)
+        if name in IGNORED_FILES or name.endswith('.part') or not os.path.isfile(path):
+            continue
+        entries.append(describe(path, checksum=checksums))
+    return sorted(entries, key=lambda entry: (entry['created'], entry['name']))
+
+
+def read():
+    """The catalog entries, oldest first, scanned from disk when there is no catalog yet."""
+    try:
+        with open(get_catalog_path(), encoding='utf-8') as f:
+            return json.load(f)['entries']
+    except FileNotFoundError:
+        return scan()
+
+
+def save(entries):
+    path = get_catalog_path()
+    with open(f'{path}.part', 'w', encoding='utf-8') as f:
+        json.dump({'entries': entries}, f, indent=2)
+    os.replace(f'{path}.part', path)
+
+
+def record(path, kind, models=None, elapsed=None):
+    """
+    Add (or replace) the entry of the backup just written to ``path``.
+
+    ``models`` are the per-model row counts.  Files outside ``backups/`` are
+    not cataloged.  Returns the entry, or None.
+    """
+    backup_dir = os.path.realpath(backup_engine.get_backup_dir())
+    if os.path.dirname(os.path.realpath(path)) != backup_dir:
+        return None
+    entry = describe(path, kind, models, elapsed)
+    with _lock:
+        entries = [existing for existing in read() if existing['name'] != entry['name']]
+        entries.append(entry)
+        save(entries)
+    return entry
+
+
+def rebuild(checksums=True):
+    """Replace the catalog with the files on disk, keeping the details of entries whose file is unchanged."""
+    with _lock:
+        known = {entry['name']: entry for entry in read()}
+        entries = []
+        for entry in scan(checksums=False):
+            previous = known.get(entry['name'])
+            if previous and previous['size'] == entry['size'] and previous['created'] == entry['created']:
+                entry = previous
+            if checksums and not entry['sha256']:
+                entry = {**entry, 'sha256': media_store.hash_file(os.path.join(backup_engine.get_backup_dir(), entry['name']))}
+            entries.append(entry)
+        save(entries)
+    return entries
+
+
+def get_entries():
+    """
+    The catalog entries, newest first, with ``created`` as a datetime.
+
+    Parsed once per process and reused until the catalog file is replaced.
+    """
+    global _cached
+    path = get_catalog_path()
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        with _lock:
+            save(scan())
+        stat = os.stat(path)
+    # save() renames a new file into place, so the inode changes with every write
+    version = (path, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    if _cached[0] != version:
+        with open(path, encoding='utf-8') as f:
+            entries = json.load(f)['entries']
+        _cached = (version, [{**entry, 'created': parse_datetime(entry['created'])} for entry in reversed(entries)])
+    return _cached[1]
+
+
+def filter_entries(entries, kind=None, query=None):
+    """``entries`` of type ``kind`` whose name contains ``query`` (case-insensitive)."""
+    if kind:
+        entries = [entry for entry in entries if entry['type'] == kind]
+    if query:
+        query = query.lower()
+        entries = [entry for entry in entries if query in entry['name'].lower()]
+    return entries
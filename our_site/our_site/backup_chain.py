@@ -0,0 +1,270 @@
+"""
+Backup chains: full snapshots followed by incremental or differential archives.
+
+A full archive holds every row and every media file.  An incremental archive
+holds what changed since the previous archive of the chain, a differential one
+what changed since the chain's full snapshot:
+
+* rows of models with a ``last_modified`` field changed since then
+  (Participation, the largest table, included),
+* every row of the other models (they have no change timestamp; all of
+  them are small),
+* the deletions logged in ``Tombstone`` since then,
+* media files whose mtime is newer.
+
+The chain is recorded in ``backups/backup_chain.json``.  After
+``BACKUP_CHAIN_LENGTH`` incremental/differential archives the next backup is a
+full one.  ``restore`` replays the full snapshot, the latest differential and
+the incrementals after it.
+"""
+import json
+import os
+import shutil
+import tarfile
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import backup_catalog, backup_engine, restore_engine
+
+CHAIN_FILE = 'backup_chain.json'
+FULL = 'full'
+INCREMENTAL = 'incremental'
+DIFFERENTIAL = 'differential'
+DEFAULT_CHAIN_LENGTH = 7
+
+
+def get_chain_length():
+    return getattr(settings, 'BACKUP_CHAIN_LENGTH', DEFAULT_CHAIN_LENGTH)
+
+
+def get_incremental_models():
+    """Models whose changed rows are selected by last_modified."""
+    return [model for model in backup_engine.get_backup_models() if backup_engine.has_last_modified(model)]
+
+
+def get_chain():
+    path = os.path.join(backup_engine.get_backup_dir(), CHAIN_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)['entries']
+
+
+def save_chain(entries):
+    path = os.path.join(backup_engine.get_backup_dir(), CHAIN_FILE)
+    with open(f'{path}.part', 'w', encoding='utf-8') as f:
+        json.dump({'entries': entries}, f, indent=2)
+    os.replace(f'{path}.part', path)
+
+
+def get_path(entry):
+    return os.path.join(backup_engine.get_backup_dir(), entry['name'])
+
+
+def get_archive_name(kind):
+    backup_dir = backup_engine.get_backup_dir()
+    stem = f'{kind}_backup_{backup_engine.get_timestamp()}'
+    name, suffix = stem, 1
+    while os.path.exists(os.path.join(backup_dir, f'{name}.tar.gz')):
+        suffix += 1
+        name = f'{stem}_{suffix}'
+    return name
+
+
+def backup(kind=INCREMENTAL, chunk_size=backup_engine.DEFAULT_CHUNK_SIZE, using=DEFAULT_DB_ALIAS, progress=None,
+           media_progress=None):
+    """
+    Add an archive of type ``kind`` to the chain and return its chain entry.
+
+    Incremental and differential backups fall back to a full one when the chain
+    has no full snapshot yet or has reached BACKUP_CHAIN_LENGTH.
+    """
+    from .models import Tombstone
+
+    entries = get_chain()
+    fulls = [i for i, entry in enumerate(entries) if entry['type'] == FULL]
+    if kind != FULL and (not fulls or len(entries) - fulls[-1] - 1 >= get_chain_length()):
+        kind = FULL
+
+    # Taken before reading anything: rows changed during the backup are picked up again next time
+    until = timezone.now()
+    if kind == FULL:
+        since = None
+    elif kind == DIFFERENTIAL:
+        since = parse_datetime(entries[fulls[-1]]['until'])
+    else:
+        since = parse_datetime(entries[-1]['until'])
+
+    name = get_archive_name(kind)
+    # Full archives keep the layout of the former "Backup all" archives
+    root = f'temp_backup_{name[len("full_backup_"):]}' if kind == FULL else name
+    tombstones = []
+    if since is not None:
+        tombstones = list(
+            Tombstone.objects.using(using)
+            .filter(deleted_at__gte=since, deleted_at__lt=until)
+            .values('model', 'object_pk', 'natural_key')
+        )
+    labels = [model._meta.label for model in backup_engine.get_backup_models(using)]
+    incremental_labels = {model._meta.label for model in get_incremental_models()}
+
+    def extra_files(result):
+        manifest = {
+            'type': kind,
+            'since': since.isoformat() if since else None,
+            'until': until.isoformat(),
+            'models': labels,
+            'incremental_models': sorted(incremental_labels),
+            'rows': result['models'],
+            'tombstones': len(tombstones),
+            'media_files': result['media_files'],
+        }
+        lines = ''.join(json.dumps(tombstone) + '\n' for tombstone in tombstones)
+        return [
+            ('manifest.json', json.dumps(manifest, indent=2).encode()),
+            ('tombstones.jsonl', lines.encode()),
+        ]
+
+    path = os.path.join(backup_engine.get_backup_dir(), f'{name}.tar.gz')
+    result = backup_engine.write_archive(
+        path,
+        root,
+        since=since,
+        media_since=since.timestamp() if since else None,
+        extra_files=extra_files,
+        chunk_size=chunk_size,
+        using=using,
+        progress=progress,
+        media_progress=media_progress,
+    )
+    entry = {
+        'name': f'{name}.tar.gz',
+        'root': root,
+        'type': kind,
+        'since': since.isoformat() if since else None,
+        'until': until.isoformat(),
+        'rows': result['rows'],
+        'tombstones': len(tombstones),
+        'media_files': result['media_files'],
+        'size': result['size'],
+        'elapsed': result['elapsed'],
+    }
+    entries.append(entry)
+    save_chain(entries)
+    backup_catalog.record(path, kind, result['models'], result['elapsed'])
+
+    if kind == FULL:
+        # Older deletions are already part of this snapshot
+        Tombstone.objects.using(using).filter(deleted_at__lt=until).delete()
+    return entry
+
+
+def get_restore_sequence(name=None, entries=None):
+    """
+    The chain entries to replay to restore archive ``name`` (default: the latest).
+
+    That is its full snapshot, the latest differential up to ``name`` and the
+    incrementals after that differential.
+    """
+    entries = get_chain() if entries is None else entries
+    names = [entry['name'] for entry in entries]
+    if not entries or (name is not None and name not in names):
+        raise ValueError(f"No backup named '{name}' in the backup chain" if name else "The backup chain is empty")
+    target = names.index(name) if name is not None else len(entries) - 1
+
+    base = max(i for i in range(target + 1) if entries[i]['type'] == FULL)
+    sequence = [entries[base]]
+    rest = entries[base + 1:target + 1]
+    differentials = [i for i, entry in enumerate(rest) if entry['type'] == DIFFERENTIAL]
+    if differentials:
+        sequence.append(rest[differentials[-1]])
+        rest = rest[differentials[-1] + 1:]
+    return sequence + rest
+
+
+def annotate_chain(entries):
+    """Chain entries, newest first, with the number of archives each restore replays."""
+    annotated = []
+    for entry in entries:
+        annotated.append({
+            **entry,
+            'until': parse_datetime(entry['until']),
+            'restore_steps': len(get_restore_sequence(entry['name'], entries)),
+        })
+    return annotated[::-1]
+
+
+def restore(name=None, using=DEFAULT_DB_ALIAS, progress=None):
+    """
+    Replay the chain up to archive ``name`` (default: the latest).
+
+    The archives are bulk loaded (see restore_engine.py) in one transaction,
+    together with the rebuild of the derived data, so an archive that fails
+    to load leaves the database as it was.  Full snapshots and the models
+    without ``last_modified`` replace the existing tables, incremental rows are
+    upserted and tombstones are deleted.  Once that has committed, the media
+    files of each archive are written to MEDIA_ROOT.  Returns the replayed
+    entries.
+    """
+    sequence = get_restore_sequence(name)
+    stats = []
+    with transaction.atomic(using=using):
+        for entry in sequence:
+            with tarfile.open(get_path(entry), 'r:gz') as archive:
+                manifest = json.load(archive.extractfile(f"{entry['root']}/manifest.json"))
+                if manifest['type'] == FULL:
+                    replace_models = manifest['models']
+                else:
+                    replace_models = [
+                        label for label in manifest['models'] if label not in manifest['incremental_models']
+                    ]
+
+                dump = archive.extractfile(f"{entry['root']}/db_backup.jsonl.gz")
+                with backup_engine.open_dump(dump) as stream:
+                    stats.append(restore_engine.load(stream, using=using, replace_models=replace_models))
+                tombstones = archive.extractfile(f"{entry['root']}/tombstones.jsonl")
+                apply_tombstones((json.loads(line) for line in tombstones), using)
+        restore_engine.finish_restore(using)
+
+    for entry, entry_stats in zip(sequence, stats):
+        with tarfile.open(get_path(entry), 'r:gz') as archive:
+            media_files = extract_media(archive, f"{entry['root']}/media/")
+        if progress:
+            progress(entry, {label: model_stats['rows'] for label, model_stats in entry_stats.items()}, media_files)
+    return sequence
+
+
+
+def apply_tombstones(tombstones, using=DEFAULT_DB_ALIAS):
+    for tombstone in tombstones:
+        model = apps.get_model(tombstone['model'])
+        manager = model._default_manager.db_manager(using)
+        if tombstone['natural_key'] is not None and hasattr(manager, 'get_by_natural_key'):
+            try:
+                manager.get_by_natural_key(*tombstone['natural_key']).delete()
+            except model.DoesNotExist:
+                pass
+        else:
+            manager.filter(pk=tombstone['object_pk']).delete()
+
+
+def extract_media(archive, prefix):
+    """Write the archive's files under ``prefix`` to MEDIA_ROOT, refusing paths outside it."""
+    media_root = os.path.realpath(settings.MEDIA_ROOT)
+    extracted = 0
+    for member in archive:
+        if not member.isfile() or not member.name.startswith(prefix):
+            continue
+        target = os.path.realpath(os.path.join(media_root, member.name[len(prefix):]))
+        if os.path.commonpath([media_root, target]) != media_root:
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with archive.extractfile(member) as source, open(target, 'wb') as destination:
+            shutil.copyfileobj(source, destination)
+        os.utime(target, (member.mtime, member.mtime))
+        extracted += 1
+    return extracted
@@ -0,0 +1,153 @@
+"""
+Serving backup files for download.
+
+Backups can be several gigabytes, so ``serve``:
+
+* answers ``Range: bytes=...`` requests with 206 and only that part of the
+  file, so an interrupted download resumes where it stopped.  With
+  ``If-Range`` the whole file is sent instead when it changed since (compared
+  by ETag or Last-Modified).  Requests for several ranges get the whole file.
+* with ``BACKUP_DOWNLOAD_ACCEL`` set, returns the headers only and lets the
+  front-end server send the file: ``'x-accel-redirect'`` (nginx, through the
+  ``internal`` location ``BACKUP_DOWNLOAD_INTERNAL_LOCATION`` mapped to
+  backups/) or ``'x-sendfile'`` (Apache mod_xsendfile, lighttpd).  Both
+  handle ranges themselves.
+* otherwise streams the file in DOWNLOAD_BLOCK_SIZE blocks.  Whole files are
+  handed over as the open file, which WSGI servers with a
+  ``wsgi.file_wrapper`` (gunicorn, uWSGI) send with ``sendfile()`` instead of
+  reading them through Python.
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+
+X_ACCEL_REDIRECT = 'x-accel-redirect'
+X_SENDFILE = 'x-sendfile'
+DEFAULT_INTERNAL_LOCATION = '/internal/backups/'
+DOWNLOAD_BLOCK_SIZE = 1024 * 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+class FileRange:
+    """
+    Reads at most ``length`` bytes of ``fileobj`` from its current position.
+
+    It has no ``fileno()``, so servers stream it with ``read()`` rather than
+    sending the rest of the file with ``sendfile()``.
+    """
+    def __init__(self, fileobj, length):
+        self.fileobj = fileobj
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fileobj.read(size) if size else b''
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.fileobj.close()
+
+
+def get_etag(stat):
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def get_content_type(filename):
+    content_type, encoding = mimetypes.guess_type(filename)
+    # As FileResponse does: a .tar.gz is sent as gzip, not as a tar the browser would decompress
+    return {
+        'bzip2': 'application/x-bzip',
+        'gzip': 'application/gzip',
+        'xz': 'application/x-xz',
+    }.get(encoding, content_type or 'application/octet-stream')
+
+
+def parse_range(header, size):
+    """
+    The ``(first, last)`` byte positions of the single range in the ``Range``
+    ``header``.  None when the header is absent, malformed or asks for
+    several ranges (the whole file is sent then).  Raises RangeNotSatisfiable
+    when the range starts past the end of the file.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if size == 0:
+        raise RangeNotSatisfiable
+    if not first:
+        # bytes=-N: the last N bytes
+        if int(last) == 0:
+            raise RangeNotSatisfiable
+        return max(size - int(last), 0), size - 1
+    first = int(first)
+    if last and int(last) < first:
+        return None
+    if first >= size:
+        raise RangeNotSatisfiable
+    return first, min(int(last), size - 1) if last else size - 1
+
+
+def if_range_matches(header, etag, mtime):
+    """Whether the ``If-Range`` ``header`` (an ETag or an HTTP date) still describes the file."""
+    if not header:
+        return True
+    if header.startswith('"'):
+        return header == etag
+    return parse_http_date_safe(header) == int(mtime)
+
+
+def serve(request, path):
+    """The download response for the file at ``path``."""
+    stat = os.stat(path)
+    filename = os.path.basename(path)
+    etag = get_etag(stat)
+    accel = getattr(settings, 'BACKUP_DOWNLOAD_ACCEL', None)
+
+    if accel in (X_ACCEL_REDIRECT, X_SENDFILE):
+        response = HttpResponse(content_type=get_content_type(filename))
+        if accel == X_ACCEL_REDIRECT:
+            location = getattr(settings, 'BACKUP_DOWNLOAD_INTERNAL_LOCATION', DEFAULT_INTERNAL_LOCATION)
+            response['X-Accel-Redirect'] = f"{location.rstrip('/')}/{quote(filename)}"
+        else:
+            response['X-Sendfile'] = path
+    else:
+        size = stat.st_size
+        try:
+            byte_range = parse_range(request.headers.get('Range'), size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        if byte_range and not if_range_matches(request.headers.get('If-Range'), etag, stat.st_mtime):
+            byte_range = None
+
+        fileobj = open(path, 'rb')
+        if byte_range:
+            first, last = byte_range
+            fileobj.seek(first)
+            response = FileResponse(
+                FileRange(fileobj, last - first + 1), status=206, content_type=get_content_type(filename),
+            )
+            response['Content-Range'] = f'bytes {first}-{last}/{size}'
+            response['Content-Length'] = last - first + 1
+        else:
+            response = FileResponse(fileobj, content_type=get_content_type(filename))
+        response.block_size = DOWNLOAD_BLOCK_SIZE
+
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    return response
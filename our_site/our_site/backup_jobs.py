@@ -0,0 +1,172 @@
+"""
+Background runner for the backup actions of the backup management page.
+
+``submit`` records a ``BackupJob`` and hands it to a process-wide thread pool
+once the surrounding transaction commits, so the request returns immediately.
+At most ``BACKUP_JOB_WORKERS`` jobs run at once in each process; the rest wait
+in the queue.  Workers store progress (rows, bytes) on the job at most once
+per PROGRESS_INTERVAL seconds and the page polls ``backup_job_status`` for it.
+The engines report every chunk of rows and every media file, so a healthy job
+keeps reporting however large a model or the media directory is.
+
+A job whose process died or restarted stays running.  ``fail_stale_jobs``
+marks running jobs that have reported no progress for BACKUP_JOB_STALE_AFTER
+seconds as failed, so the page stops polling them.  Queued jobs are left
+alone: they may be waiting behind long jobs for a worker.  If a job failed as
+stale does finish after all, it stays failed and its errors say how it ended.
+"""
+import datetime
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from . import backup_chain, backup_engine, csv_backup, media_store
+from .models import BackupJob
+
+DEFAULT_WORKERS = 2
+PROGRESS_INTERVAL = 1.0  # seconds between progress writes
+DEFAULT_STALE_AFTER = 600  # seconds without progress before an active job counts as dead
+STALE_ERROR = "The job reported no progress for {seconds} seconds; its process probably stopped."
+LATE_FINISH = "\n\nThe job finished after all: {state}{result}."
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'BACKUP_JOB_WORKERS', DEFAULT_WORKERS),
+                thread_name_prefix='backup-job',
+            )
+        return _executor
+
+
+class Progress:
+    """Accumulates a job's counters and writes them out at most every PROGRESS_INTERVAL seconds."""
+    def __init__(self, job):
+        self.job = job
+        self.rows = 0
+        self.bytes = 0
+        self.saved_at = 0
+
+    def add(self, rows=0, size=0):
+        self.rows += rows
+        self.bytes += size
+        if time.monotonic() - self.saved_at >= PROGRESS_INTERVAL:
+            self.save()
+
+    def save(self):
+        BackupJob.objects.filter(pk=self.job.pk).update(
+            rows_processed=self.rows, bytes_processed=self.bytes, progress_at=timezone.now(),
+        )
+        self.saved_at = time.monotonic()
+
+
+def run_database(progress):
+    result = backup_engine.backup_database(progress=lambda model, rows: progress.add(rows=rows))
+    return result['path'], result['rows'], result['size']
+
+
+def add_size(progress):
+    return lambda path, size: progress.add(size=size)
+
+
+def run_media(progress):
+    result = media_store.snapshot(progress=add_size(progress))
+    return result['manifest'], 0, result['new_bytes']
+
+
+def run_chain(kind):
+    def run(progress):
+        entry = backup_chain.backup(
+            kind, progress=lambda model, rows: progress.add(rows=rows), media_progress=add_size(progress),
+        )
+        return entry['name'], entry['rows'], entry['size']
+    return run
+
+
+def run_csv(progress):
+    result = csv_backup.backup(progress=lambda model, rows: progress.add(rows=rows))
+    return result['path'], result['rows'], result['size']
+
+
+RUNNERS = {
+    'database': run_database,
+    'media': run_media,
+    'all': run_chain(backup_chain.FULL),
+    'incremental': run_chain(backup_chain.INCREMENTAL),
+    'differential': run_chain(backup_chain.DIFFERENTIAL),
+    'flat_csv': run_csv,
+}
+
+
+def submit(kind, user=None):
+    """Queue a backup of ``kind`` (a BackupJob.KIND_CHOICES key) and return its job."""
+    if kind not in RUNNERS:
+        raise ValueError(f"Unknown backup kind '{kind}'")
+    job = BackupJob.objects.create(kind=kind, created_by=user)
+    transaction.on_commit(lambda: get_executor().submit(work, job.pk))
+    return job
+
+
+def fail_stale_jobs():
+    """Mark running jobs without progress for BACKUP_JOB_STALE_AFTER seconds as failed."""
+    stale_after = getattr(settings, 'BACKUP_JOB_STALE_AFTER', DEFAULT_STALE_AFTER)
+    now = timezone.now()
+    cutoff = now - datetime.timedelta(seconds=stale_after)
+    # run_job sets progress_at when it claims the job
+    return BackupJob.objects.filter(state=BackupJob.RUNNING, progress_at__lt=cutoff).update(state=BackupJob.FAILED, finished_at=now, errors=STALE_ERROR.format(seconds=stale_after))
+
+
+def run_job(job_id):
+    """Run a queued job, recording its outcome on the job."""
+    now = timezone.now()
+    # Claim the job, so that one failed as stale meanwhile is not run
+    claimed = BackupJob.objects.filter(pk=job_id, state=BackupJob.QUEUED).update(
+        state=BackupJob.RUNNING, started_at=now, progress_at=now,
+    )
+    job = BackupJob.objects.get(pk=job_id)
+    if not claimed:
+        return job
+
+    progress = Progress(job)
+    try:
+        result, rows, size = RUNNERS[job.kind](progress)
+    except Exception:
+        job.state = BackupJob.FAILED
+        job.errors = traceback.format_exc()
+        job.rows_processed, job.bytes_processed = progress.rows, progress.bytes
+    else:
+        job.state = BackupJob.SUCCEEDED
+        job.result = os.path.basename(result)
+        job.rows_processed, job.bytes_processed = rows, size
+    job.finished_at = timezone.now()
+    finished = BackupJob.objects.filter(pk=job.pk, state=BackupJob.RUNNING).update(
+        state=job.state, errors=job.errors, result=job.result, rows_processed=job.rows_processed,
+        bytes_processed=job.bytes_processed, finished_at=job.finished_at,
+    )
+    if not finished:
+        # fail_stale_jobs gave up on the job meanwhile: keep it failed, but say how it ended
+        outcome, result = job.get_state_display().lower(), job.result
+        job.refresh_from_db()
+        job.errors += LATE_FINISH.format(state=outcome, result=f' ({result})' if result else '')
+        job.save(update_fields=['errors'])
+    return job
+
+
+def work(job_id):
+    """Entry point of the pool threads."""
+    try:
+        run_job(job_id)
+    finally:
+        # Pool threads keep their own connections between jobs; do not leave them open
+        connections.close_all()
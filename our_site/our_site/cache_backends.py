@@ -0,0 +1,391 @@
+"""
+Cache backends for the project.
+
+``TieredCache`` puts a small in-process L1 (bounded, with a TTL and a
+selectable eviction policy) in front of a shared cache such as the
+FileBasedCache or ``SQLiteCache``.  Hot keys like ``facilitator_role_ids`` are
+then read from disk at most once per process per L1 TTL instead of on every
+lookup.  Writes go through to the shared cache, so other processes see them
+once their own L1 entry expires.
+
+Example::
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'our_site.cache_backends.TieredCache',
+            'OPTIONS': {
+                'SHARED_CACHE': 'shared',   # alias of the shared store
+                'L1_MAX_ENTRIES': 1000,
+                'L1_TIMEOUT': 30,           # seconds an entry may be served from memory
+                'L1_POLICY': 'lru',         # 'lru', 'lfu' or 'fifo'
+            },
+        },
+        'shared': {
+            'BACKEND': 'our_site.cache_backends.SQLiteCache',
+            'LOCATION': '/path/to/cache.sqlite3',
+        },
+    }
+"""
+import itertools
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+EVICTION_POLICIES = ('lru', 'lfu', 'fifo')
+
+# One L1 per cache alias, shared by every thread of the process
+_local_stores = {}
+_local_stores_lock = threading.Lock()
+
+_MISSING = object()
+
+
+class LocalStore:
+    """Bounded in-memory map of key -> (pickled value, expiry) with an eviction policy."""
+
+    def __init__(self, max_entries, policy='lru'):
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(f"Unknown L1_POLICY '{policy}', expected one of {', '.join(EVICTION_POLICIES)}")
+        self.max_entries = max_entries
+        self.policy = policy
+        self._data = OrderedDict()
+        self._hits = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return _MISSING
+            pickled, expires = entry
+            if expires <= time.monotonic():
+                self._remove(key)
+                return _MISSING
+            if self.policy == 'lru':
+                self._data.move_to_end(key)
+            elif self.policy == 'lfu':
+                self._hits[key] += 1
+        return pickle.loads(pickled)
+
+    def set(self, key, value, ttl):
+        if ttl <= 0 or self.max_entries <= 0:
+            self.delete(key)
+            return
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            if key not in self._data and len(self._data) >= self.max_entries:
+                self._evict()
+            self._data[key] = (pickled, time.monotonic() + ttl)
+            if self.policy == 'lru':
+                self._data.move_to_end(key)
+            self._hits.setdefault(key, 0)
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._hits.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def _remove(self, key):
+        self._data.pop(key, None)
+        self._hits.pop(key, None)
+
+    def _evict(self):
+        now = time.monotonic()
+        expired = [key for key, (_, expires) in self._data.items() if expires <= now]
+        if expired:
+            for key in expired:
+                self._remove(key)
+            return
+        if self.policy == 'lfu':
+            # Ties go to the oldest entry, as min() keeps the first minimum
+            victim = min(self._data, key=self._hits.__getitem__)
+        else:
+            victim = next(iter(self._data))
+        self._remove(victim)
+
+
+def get_local_store(name, max_entries, policy):
+    with _local_stores_lock:
+        store = _local_stores.get(name)
+        if store is None:
+            store = _local_stores[name] = LocalStore(max_entries, policy)
+        return store
+
+
+class TieredCache(BaseCache):
+    """In-process L1 in front of the cache configured under ``OPTIONS['SHARED_CACHE']``."""
+
+    def __init__(self, name, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._shared_alias = options.get('SHARED_CACHE', 'shared')
+        self._l1_timeout = options.get('L1_TIMEOUT', 30)
+        self._local = get_local_store(
+            name, options.get('L1_MAX_ENTRIES', 1000), options.get('L1_POLICY', 'lru'),
+        )
+
+    @property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    def _local_key(self, key, version):
+        return self.shared.make_and_validate_key(key, version=version)
+
+    def _local_ttl(self, timeout):
+        """Seconds an entry written with ``timeout`` may live in L1."""
+        expires_at = self.shared.get_backend_timeout(timeout)
+        if expires_at is None:
+            return self._l1_timeout
+        return min(self._l1_timeout, expires_at - time.time())
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self._local_key(key, version)
+        if self.shared.add(key, value, timeout, version=version):
+            self._local.set(local_key, value, self._local_ttl(timeout))
+            return True
+        self._local.delete(local_key)
+        return False
+
+    def get(self, key, default=None, version=None):
+        local_key = self._local_key(key, version)
+        value = self._local.get(local_key)
+        if value is not _MISSING:
+            return value
+        value = self.shared.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            return default
+        # The shared store does not report the remaining lifetime, so fall back to L1_TIMEOUT
+        self._local.set(local_key, value, self._l1_timeout)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version=version)
+        self._local.set(self._local_key(key, version), value, self._local_ttl(timeout))
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self._local.delete(self._local_key(key, version))
+        return self.shared.touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        self._local.delete(self._local_key(key, version))
+        return self.shared.delete(key, version=version)
+
+    def get_many(self, keys, version=None):
+        found = {}
+        missing = []
+        for key in keys:
+            value = self._local.get(self._local_key(key, version))
+            if value is _MISSING:
+                missing.append(key)
+            else:
+                found[key] = value
+        if missing:
+            fetched = self.shared.get_many(missing, version=version)
+            for key, value in fetched.items():
+                self._local.set(self._local_key(key, version), value, self._l1_timeout)
+            found.update(fetched)
+        return found
+
+    def has_key(self, key, version=None):
+        if self._local.get(self._local_key(key, version)) is not _MISSING:
+            return True
+        return self.shared.has_key(key, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        local_key = self._local_key(key, version)
+        try:
+            value = self.shared.incr(key, delta, version=version)
+        except ValueError:
+            self._local.delete(local_key)
+            raise
+        self._local.set(local_key, value, self._l1_timeout)
+        return value
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version=version)
+        ttl = self._local_ttl(timeout)
+        for key, value in data.items():
+            if key in failed:
+                self._local.delete(self._local_key(key, version))
+            else:
+                self._local.set(self._local_key(key, version), value, ttl)
+        return failed
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self._local.delete(self._local_key(key, version))
+        self.shared.delete_many(keys, version=version)
+
+    def clear(self):
+        # Only this process' L1 can be cleared; other processes catch up within L1_TIMEOUT
+        self._local.clear()
+        self.shared.clear()
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
+
+
+class SQLiteCache(BaseCache):
+    """
+    Shared cache stored in a single SQLite file (``LOCATION``).
+
+    Unlike the FileBasedCache there is one file for all entries, and culling
+    deletes with indexed DELETEs instead of a scan of the cache directory.
+    Counting the entries is a full scan, so it is only done every
+    ``OPTIONS['CULL_EVERY']`` writes of the process (default: 1% of
+    MAX_ENTRIES); the cache can exceed MAX_ENTRIES by that much per process.
+    """
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = os.path.abspath(location)
+        self._connections = threading.local()
+        self._cull_every = params.get('OPTIONS', {}).get('CULL_EVERY', max(1, self._max_entries // 100))
+        self._writes = itertools.count(1)
+
+    def _connection(self):
+        conn = getattr(self._connections, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            conn = sqlite3.connect(self._path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache '
+                '(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)')
+            self._connections.conn = conn
+        return conn
+
+    def _now(self):
+        return time.time()
+
+    def _live_value(self, conn, key):
+        row = conn.execute(
+            'SELECT value FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (key, self._now()),
+        ).fetchone()
+        return row
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            if self._live_value(conn, key) is not None:
+                return False
+            self._write(conn, key, value, timeout)
+        return True
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        row = self._live_value(self._connection(), key)
+        if row is None:
+            return default
+        return pickle.loads(row[0])
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            self._write(conn, key, value, timeout)
+
+    def _write(self, conn, key, value, timeout):
+        conn.execute(
+            'INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+            (key, pickle.dumps(value, self.pickle_protocol), self.get_backend_timeout(timeout)),
+        )
+        self._cull(conn)
+
+    def _cull(self, conn):
+        if next(self._writes) % self._cull_every:
+            return
+        count = conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        if count <= self._max_entries:
+            return
+        conn.execute('DELETE FROM cache WHERE expires IS NOT NULL AND expires <= ?', (self._now(),))
+        count = conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        if count > self._max_entries:
+            # Drop the entries closest to expiry first, like DatabaseCache
+            conn.execute(
+                'DELETE FROM cache WHERE key IN '
+                '(SELECT key FROM cache ORDER BY expires IS NULL, expires LIMIT ?)',
+                (count // self._cull_frequency if self._cull_frequency else count,),
+            )
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute(
+                'UPDATE cache SET expires = ? WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                (self.get_backend_timeout(timeout), key, self._now()),
+            )
+        return cursor.rowcount > 0
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+        return cursor.rowcount > 0
+
+    def get_many(self, keys, version=None):
+        key_map = {self.make_and_validate_key(key, version=version): key for key in keys}
+        if not key_map:
+            return {}
+        placeholders = ', '.join('?' * len(key_map))
+        rows = self._connection().execute(
+            f'SELECT key, value FROM cache WHERE key IN ({placeholders}) '
+            'AND (expires IS NULL OR expires > ?)',
+            (*key_map, self._now()),
+        ).fetchall()
+        return {key_map[key]: pickle.loads(value) for key, value in rows}
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self._live_value(self._connection(), key) is not None
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        conn = self._connection()
+        with conn:
+            # Read and write in one write transaction so concurrent incr() calls don't lose updates
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                'SELECT value, expires FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                (key, self._now()),
+            ).fetchone()
+            if row is None:
+                raise ValueError("Key '%s' not found" % key)
+            new_value = pickle.loads(row[0]) + delta
+            conn.execute(
+                'UPDATE cache SET value = ? WHERE key = ?',
+                (pickle.dumps(new_value, self.pickle_protocol), key),
+            )
+        return new_value
+
+    def clear(self):
+        conn = self._connection()
+        with conn:
+            conn.execute('DELETE FROM cache')
+
+    def close(self, **kwargs):
+        # Connections are kept per thread for the life of the process
+        pass
@@ -0,0 +1,300 @@
+"""
+Columnar CSV backups: one CSV file per model in a zip archive.
+
+Replaces the single flat CSV whose header was the union of every field of
+every model.  Each model's member only has that model's columns (foreign keys
+as their ``<field>_id`` value) and is read with one ``values_list`` query per
+chunk, so no related object is fetched per cell.  Auto-created M2M tables get
+a two-column member of their own, read from the through table with one query.
+``manifest.json`` lists the members in foreign key order with their columns.
+
+Cells hold the field value as text; NULL is written as ``\\N`` so it stays
+distinct from an empty string.
+
+``restore`` reads the members straight from the zip, one row at a time, and
+inserts them in foreign key order ``batch_size`` rows at a time with the raw
+INSERTs of ``restore_engine`` (no signals, ``auto_now`` values kept, rows with
+the same pk replaced).  M2M members are applied last with ``bulk_create``.
+Derived tables (backup_engine.DERIVED_MODELS) are not backed up, their
+members in older archives are skipped, and ``restore_engine.finish_restore``
+rebuilds them.
+"""
+import csv
+import datetime
+import io
+import json
+import os
+import time
+import zipfile
+
+from django.apps import apps
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.base import DeserializationError
+from django.db import DEFAULT_DB_ALIAS, connections, models, router, transaction
+
+from . import backup_catalog, backup_engine, restore_engine
+
+# Besides the models the JSON backups leave out (see backup_engine)
+EXCLUDED_APPS = ('admin', 'sessions')
+NULL = '\\N'
+MANIFEST = 'manifest.json'
+
+
+def get_models(using=DEFAULT_DB_ALIAS):
+    return restore_engine.get_restore_order([
+        model for model in backup_engine.get_backup_models(using)
+        if model._meta.app_label not in EXCLUDED_APPS
+    ])
+
+
+def get_formatter(field):
+    """Return the function turning a ``values_list`` value of ``field`` into a cell."""
+    if isinstance(field, models.JSONField):
+        return json.dumps
+    if isinstance(field, (models.DateField, models.TimeField)):
+        # DateTimeField is a DateField
+        return lambda value: value.isoformat()
+    return str
+
+
+def get_parser(field):
+    """Return the function turning a cell written with ``get_formatter(field)`` back into a value."""
+    if isinstance(field, models.JSONField):
+        return json.loads
+    return field.to_python
+
+
+def get_m2m_fields(model):
+    """M2M fields stored in tables of their own (explicit through models are backed up as models)."""
+    return [field for field in model._meta.local_many_to_many if field.remote_field.through._meta.auto_created]
+
+
+def write_member(archive, name, header, rows):
+    """Write ``rows`` (tuples of cells) as CSV member ``name``.  Returns the row count."""
+    count = 0
+    with archive.open(name, 'w', force_zip64=True) as member:
+        with io.TextIOWrapper(member, encoding='utf-8', newline='') as stream:
+            writer = csv.writer(stream)
+            writer.writerow(header)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+    return count
+
+
+def read_member(archive, name, columns):
+    """Yield the rows of CSV member ``name`` as they are decompressed, checking its header is ``columns``."""
+    with archive.open(name) as member:
+        with io.TextIOWrapper(member, encoding='utf-8', newline='') as stream:
+            reader = csv.reader(stream)
+            if next(reader, None) != columns:
+                raise DeserializationError(f"{name}: the header does not match the columns in {MANIFEST}")
+            for row in reader:
+                if len(row) != len(columns):
+                    raise DeserializationError(
+                        f"{name}, line {reader.line_num}: expected {len(columns)} cells, found {len(row)}"
+                    )
+                yield row
+
+
+def read_values(archive, name, columns, fields, null=NULL):
+    """Yield ``{column: value}`` for the rows of member ``name``; ``fields`` maps the columns to model fields."""
+    try:
+        parsers = [get_parser(fields[column]) for column in columns]
+    except KeyError as e:
+        raise DeserializationError(f"{name}: unknown column {e}")
+    rows = read_member(archive, name, columns)
+    try:
+        for row in rows:
+            yield {
+                column: None if cell == null else parse(cell)
+                for column, parse, cell in zip(columns, parsers, row)
+            }
+    except (ValidationError, ValueError) as e:
+        raise DeserializationError(f"{name}: {e}")
+
+
+def get_model(label):
+    try:
+        model = apps.get_model(label)
+    except (LookupError, ValueError):
+        raise DeserializationError(f"Invalid model identifier: '{label}'")
+    if model._meta.parents:
+        raise DeserializationError(f"{label} uses multi-table inheritance and cannot be restored from CSV")
+    return model
+
+
+def load_model(archive, model, entry, null=NULL, batch_size=restore_engine.DEFAULT_BATCH_SIZE, using=DEFAULT_DB_ALIAS):
+    """Insert the rows of ``model``'s member in chunks of ``batch_size``.  Returns (rows, pks)."""
+    fields = {field.attname: field for field in model._meta.local_concrete_fields}
+    rows = 0
+    pks = set()
+    objs = []
+    for values in read_values(archive, entry['member'], entry['columns'], fields, null):
+        objs.append(model(**values))
+        rows += 1
+        if len(objs) >= batch_size:
+            restore_engine.insert(model, objs, using)
+            pks.update(obj.pk for obj in objs)
+            objs = []
+    if objs:
+        restore_engine.insert(model, objs, using)
+        pks.update(obj.pk for obj in objs)
+    return rows, pks
+
+
+def load_m2m(archive, model, entry, pks, null=NULL, batch_size=restore_engine.DEFAULT_BATCH_SIZE, using=DEFAULT_DB_ALIAS):
+    """
+    Replace the rows of the restored objects (``pks``) in the through table of
+    M2M ``entry`` with the member's rows.  Returns (through model, rows).
+    """
+    try:
+        through = model._meta.get_field(entry['field']).remote_field.through
+    except (FieldDoesNotExist, AttributeError):
+        raise DeserializationError(f"{model._meta.label} has no M2M field '{entry['field']}'")
+    fields = {field.attname: field for field in through._meta.local_concrete_fields if not field.primary_key}
+    manager = through._base_manager.db_manager(using)
+    source = entry['columns'][0]
+    restore_engine.delete_in_chunks(manager, source, list(pks), using)
+
+    rows = 0
+    objs = []
+    for values in read_values(archive, entry['member'], entry['columns'], fields, null):
+        objs.append(through(**values))
+        rows += 1
+        if len(objs) >= batch_size:
+            manager.bulk_create(objs, batch_size=batch_size)
+            objs = []
+    if objs:
+        manager.bulk_create(objs, batch_size=batch_size)
+    return through, rows
+
+
+def restore(fileobj, using=DEFAULT_DB_ALIAS, batch_size=restore_engine.DEFAULT_BATCH_SIZE, progress=None):
+    """
+    Restore the CSV backup zip read from the binary, seekable ``fileobj`` in
+    one transaction.
+
+    ``progress`` is called with ``(model, rows, elapsed seconds)`` after each
+    model and each M2M table (its through model).  Returns a summary with
+    ``{label: {'rows', 'elapsed', 'rows_per_second'}}``, total rows and
+    elapsed seconds.
+    """
+    start_time = time.time()
+    connection = connections[using]
+    stats = {}
+
+    def record(model, rows, started):
+        elapsed = time.time() - started
+        stats[model._meta.label] = {
+            'rows': rows,
+            'elapsed': elapsed,
+            'rows_per_second': rows / elapsed if elapsed else float(rows),
+        }
+        if progress:
+            progress(model, rows, elapsed)
+
+    try:
+        archive = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile as e:
+        raise DeserializationError(f"Not a CSV backup: {e}")
+    with archive:
+        try:
+            manifest = json.loads(archive.read(MANIFEST))
+        except KeyError:
+            raise DeserializationError(f"Not a CSV backup: {MANIFEST} is missing")
+        null = manifest.get('null', NULL)
+        entries = {get_model(entry['model']): entry for entry in manifest['models']}
+        models_to_load = [
+            model for model in restore_engine.get_restore_order(entries)
+            if router.allow_migrate_model(using, model) and model._meta.label not in backup_engine.DERIVED_MODELS
+        ]
+
+        with transaction.atomic(using=using):
+            loaded_pks = {}
+            tables = [model._meta.db_table for model in models_to_load]
+            with connection.constraint_checks_disabled():
+                for model in models_to_load:
+                    started = time.time()
+                    rows, loaded_pks[model] = load_model(archive, model, entries[model], null, batch_size, using)
+                    record(model, rows, started)
+                # Both ends of every M2M row are in place by now
+                for model in models_to_load:
+                    for entry in entries[model]['m2m']:
+                        started = time.time()
+                        through, rows = load_m2m(archive, model, entry, loaded_pks[model], null, batch_size, using)
+                        record(through, rows, started)
+                        tables.append(through._meta.db_table)
+            connection.check_constraints(table_names=tables)
+            restore_engine.reset_sequences(models_to_load, using)
+            restore_engine.finish_restore(using)
+
+    return {
+        'models': stats,
+        'rows': sum(entry['rows'] for entry in stats.values()),
+        'elapsed': time.time() - start_time,
+    }
+
+
+def backup(path=None, chunk_size=backup_engine.DEFAULT_CHUNK_SIZE, using=DEFAULT_DB_ALIAS, progress=None):
+    """
+    Write every model to ``path`` (default: backups/db_csv_backup_<timestamp>.zip).
+
+    ``progress`` is called with ``(model, rows)`` every ``chunk_size`` rows
+    and after each model, ``rows`` being the rows since the previous call.
+    Returns a summary with the path, size, per-model rows and elapsed seconds.
+    """
+    start_time = time.time()
+    if path is None:
+        path = os.path.join(backup_engine.get_backup_dir(), f'db_csv_backup_{backup_engine.get_timestamp()}.zip')
+
+    manifest = {'created': datetime.datetime.now().isoformat(), 'null': NULL, 'models': []}
+    counts = {}
+    with zipfile.ZipFile(f'{path}.part', 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for model in get_models(using):
+            fields = model._meta.local_concrete_fields
+            columns = [field.attname for field in fields]
+            formatters = [get_formatter(field) for field in fields]
+
+            def cells(values_list, model=model, formatters=formatters):
+                for rows, values in enumerate(values_list, 1):
+                    if progress and not rows % chunk_size:
+                        progress(model, chunk_size)
+                    yield [NULL if value is None else format(value) for format, value in zip(formatters, values)]
+
+            queryset = model._base_manager.using(using).order_by(model._meta.pk.attname).values_list(*columns)
+            entry = {
+                'model': model._meta.label,
+                'member': f'{model._meta.label_lower}.csv',
+                'columns': columns,
+                'm2m': [],
+            }
+            entry['rows'] = write_member(archive, entry['member'], columns, cells(queryset.iterator(chunk_size=chunk_size)))
+
+            for field in get_m2m_fields(model):
+                through = field.remote_field.through
+                m2m_columns = [
+                    through._meta.get_field(field.m2m_field_name()).attname,
+                    through._meta.get_field(field.m2m_reverse_field_name()).attname,
+                ]
+                rows = through._base_manager.using(using).order_by(*m2m_columns).values_list(*m2m_columns)
+                m2m = {'field': field.name, 'member': f'{model._meta.label_lower}.{field.name}.csv', 'columns': m2m_columns}
+                m2m['rows'] = write_member(archive, m2m['member'], m2m_columns, rows.iterator(chunk_size=chunk_size))
+                entry['m2m'].append(m2m)
+
+            manifest['models'].append(entry)
+            counts[model._meta.label] = entry['rows']
+            if progress:
+                progress(model, entry['rows'] % chunk_size)
+        archive.writestr(MANIFEST, json.dumps(manifest, indent=2))
+    os.replace(f'{path}.part', path)
+    elapsed = time.time() - start_time
+    backup_catalog.record(path, 'csv', counts, elapsed)
+
+    return {
+        'path': path,
+        'size': os.path.getsize(path),
+        'models': counts,
+        'rows': sum(counts.values()),
+        'elapsed': elapsed,
+    }
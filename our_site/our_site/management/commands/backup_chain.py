@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from our_site import backup_chain, backup_engine
+
+class Command(BaseCommand):
+    help = 'Adds an incremental, differential or full archive to the backup chain'
+
+    def add_arguments(self, parser):
+        kind = parser.add_mutually_exclusive_group()
+        kind.add_argument(
+            '--full',
+            action='store_const',
+            const=backup_chain.FULL,
+            dest='kind',
+            help='Start a new chain with a full snapshot',
+        )
+        kind.add_argument(
+            '--differential',
+            action='store_const',
+            const=backup_chain.DIFFERENTIAL,
+            dest='kind',
+            help="Back up everything changed since the chain's full snapshot",
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=backup_engine.DEFAULT_CHUNK_SIZE,
+            help=f'Rows fetched per database round trip (default: {backup_engine.DEFAULT_CHUNK_SIZE})',
+        )
+
+    def handle(self, *args, **options):
+        entry = backup_chain.backup(options['kind'] or backup_chain.INCREMENTAL, chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {entry['type']} backup {entry['name']}: {entry['rows']} rows, "
+            f"{entry['tombstones']} deletions, {entry['media_files']} media files "
+            f"({entry['size']} bytes) in {entry['elapsed']:.2f} seconds"
+        ))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from our_site import backup_engine
+
+class Command(BaseCommand):
+    help = 'Writes a gzip-compressed JSON Lines backup of the database (loadable with loaddata)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            action='store',
+            help='Backup file path (default: backups/db_backup_<timestamp>.jsonl.gz)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=backup_engine.DEFAULT_CHUNK_SIZE,
+            help=f'Rows fetched per database round trip (default: {backup_engine.DEFAULT_CHUNK_SIZE})',
+        )
+
+    def handle(self, *args, **options):
+        def progress(model, rows):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"  {model._meta.label}: {rows} rows")
+
+        result = backup_engine.backup_database(
+            options['output'], chunk_size=options['chunk_size'], progress=progress
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Backed up {result['rows']} rows ({result['size']} bytes) to {result['path']} "
+            f"in {result['elapsed']:.2f} seconds"
+        ))
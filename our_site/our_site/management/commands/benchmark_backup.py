@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from our_site import backup_engine
+
+class Command(BaseCommand):
+    help = 'Compares wall time and peak RSS of the dumpdata subprocess backup with the streaming backup engine'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=backup_engine.DEFAULT_CHUNK_SIZE,
+            help=f'Chunk size passed to the streaming engine (default: {backup_engine.DEFAULT_CHUNK_SIZE})',
+        )
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            legacy_path = os.path.join(temp_dir, 'db_backup.json')
+            stream_path = os.path.join(temp_dir, 'db_backup.jsonl.gz')
+            runs = [
+                ('dumpdata subprocess', legacy_path, [
+                    'dumpdata', '--natural-foreign', '--natural-primary',
+                    '-e', 'contenttypes', '-e', 'auth.Permission', '--indent', '2', '-o', legacy_path,
+                ]),
+                ('streaming engine', stream_path, [
+                    'backup_database', '--output', stream_path, '--chunk-size', str(options['chunk_size']),
+                ]),
+            ]
+            for label, path, arguments in runs:
+                elapsed, max_rss = self.measure([sys.executable, 'manage.py', *arguments])
+                self.stdout.write(
+                    f"{label:<20} {elapsed:8.2f} s  peak RSS {max_rss / 1024:8.1f} MiB  "
+                    f"output {os.path.getsize(path) / 1024:10.1f} KiB"
+                )
+
+    def measure(self, command):
+        """Run ``command`` and return (wall seconds, peak RSS in KiB) of that child alone."""
+        with tempfile.TemporaryFile() as errors:
+            start_time = time.time()
+            process = subprocess.Popen(command, cwd=settings.BASE_DIR, stdout=subprocess.DEVNULL, stderr=errors)
+            # wait4 reports the resource usage of this child alone
+            _, status, usage = os.wait4(process.pid, 0)
+            elapsed = time.time() - start_time
+            returncode = os.waitstatus_to_exitcode(status)
+            if returncode:
+                errors.seek(0)
+                raise CommandError(f"{' '.join(command)} failed: {errors.read().decode()}")
+        return elapsed, usage.ru_maxrss
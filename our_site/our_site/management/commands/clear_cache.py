@@ -27,8 +27,13 @@ class Command(BaseCommand):
                 # For the filesystem cache, we could directly search for files, but this is more generic
                 
                 # For filesystem cache, we can use glob directly
-                if hasattr(settings, 'CACHES') and settings.CACHES.get('default', {}).get('BACKEND') == 'django.core.cache.backends.filebased.FileBasedCache':
-                    cache_dir = settings.CACHES['default']['LOCATION']
+                cache_settings = settings.CACHES.get('default', {})
+                if cache_settings.get('BACKEND') == 'our_site.cache_backends.TieredCache':
+                    # The files live in the shared store behind the in-process L1
+                    shared_alias = cache_settings.get('OPTIONS', {}).get('SHARED_CACHE', 'shared')
+                    cache_settings = settings.CACHES.get(shared_alias, {})
+                if cache_settings.get('BACKEND') == 'django.core.cache.backends.filebased.FileBasedCache':
+                    cache_dir = cache_settings['LOCATION']
                     pattern_files = glob.glob(os.path.join(cache_dir, f"*{pattern}*"))
                     for file_path in pattern_files:
                         try:
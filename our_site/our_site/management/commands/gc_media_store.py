@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from our_site import media_store
+
+class Command(BaseCommand):
+    help = 'Deletes old media snapshots and the blobs no retained snapshot refers to'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep',
+            type=int,
+            help='Number of newest snapshots to keep (default: BACKUP_MEDIA_SNAPSHOTS_KEEP)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report what would be deleted',
+        )
+
+    def handle(self, *args, **options):
+        manifests, blobs, freed = media_store.collect_garbage(options['keep'], dry_run=options['dry_run'])
+        action = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(
+            f"{action} {manifests} snapshots and {blobs} blobs ({freed} bytes)"
+        ))
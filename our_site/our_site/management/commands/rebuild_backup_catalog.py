@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from our_site import backup_catalog
+
+class Command(BaseCommand):
+    help = 'Rebuilds backups/backup_catalog.json from the backup files on disk'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--no-checksums',
+            action='store_false',
+            dest='checksums',
+            help='Do not compute the SHA-256 of files the catalog has no checksum for',
+        )
+
+    def handle(self, *args, **options):
+        entries = backup_catalog.rebuild(checksums=options['checksums'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Cataloged {len(entries)} backups ({sum(entry['size'] for entry in entries)} bytes)"
+        ))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+import time
+from our_site import backup_chain
+
+class Command(BaseCommand):
+    help = 'Restores the database and media by replaying the backup chain up to an archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'archive',
+            nargs='?',
+            help='Archive name from the chain (default: the latest)',
+        )
+        parser.add_argument(
+            '--list',
+            action='store_true',
+            help='Only print the archives that would be replayed',
+        )
+
+    def handle(self, *args, **options):
+        start_time = time.time()
+        try:
+            sequence = backup_chain.get_restore_sequence(options['archive'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if options['list']:
+            for entry in sequence:
+                self.stdout.write(f"{entry['type']:<13} {entry['name']}")
+            return
+
+        def progress(entry, counts, media_files):
+            self.stdout.write(
+                f"Replayed {entry['type']} {entry['name']}: {sum(counts.values())} rows, "
+                f"{entry['tombstones']} deletions, {media_files} media files"
+            )
+
+        backup_chain.restore(options['archive'], progress=progress)
+        elapsed_time = time.time() - start_time
+        self.stdout.write(self.style.SUCCESS(
+            f"Restored {len(sequence)} archives in {elapsed_time:.2f} seconds"
+        ))
@@ -0,0 +1,35 @@
+import zipfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.base import DeserializationError
+from our_site import csv_backup, restore_engine
+
+class Command(BaseCommand):
+    help = 'Bulk restores a database backup (.json or .jsonl, optionally gzip-compressed, or a CSV backup .zip) in one transaction'
+
+    def add_arguments(self, parser):
+        parser.add_argument('backup', help='Backup file to restore')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=restore_engine.DEFAULT_BATCH_SIZE,
+            help=f'Rows inserted per chunk (default: {restore_engine.DEFAULT_BATCH_SIZE})',
+        )
+
+    def handle(self, *args, **options):
+        def progress(model, rows, elapsed):
+            rate = rows / elapsed if elapsed else rows
+            self.stdout.write(f"  {model._meta.label}: {rows} rows in {elapsed:.2f} seconds ({rate:.0f} rows/s)")
+
+        try:
+            with open(options['backup'], 'rb') as f:
+                engine = csv_backup if zipfile.is_zipfile(f) else restore_engine
+                f.seek(0)
+                result = engine.restore(f, batch_size=options['batch_size'], progress=progress)
+        except (OSError, DeserializationError) as e:
+            raise CommandError(str(e))
+        rate = result['rows'] / result['elapsed'] if result['elapsed'] else result['rows']
+        self.stdout.write(self.style.SUCCESS(
+            f"Restored {result['rows']} rows of {len(result['models'])} models "
+            f"in {result['elapsed']:.2f} seconds ({rate:.0f} rows/s)"
+        ))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+from our_site import media_store
+
+class Command(BaseCommand):
+    help = 'Restores MEDIA_ROOT from a media store snapshot'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'snapshot',
+            nargs='?',
+            help='Manifest name, e.g. media_20250101_020000_000000.json (default: the latest)',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            restored = media_store.restore(options['snapshot'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f"Restored {restored} media files"))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from our_site import media_store
+
+class Command(BaseCommand):
+    help = 'Snapshots MEDIA_ROOT into the content-addressed media store, copying only new files'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Re-hash every file instead of trusting unchanged sizes and mtimes',
+        )
+
+    def handle(self, *args, **options):
+        result = media_store.snapshot(verify=options['verify'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote snapshot {result['manifest']}: {result['files']} files, {result['new_blobs']} new blobs, "
+            f"{result['new_bytes']} of {result['size']} bytes copied in {result['elapsed']:.2f} seconds"
+        ))
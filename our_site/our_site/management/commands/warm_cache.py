@@ -1,9 +1,10 @@
 from django.core.management.base import BaseCommand
 from django.core.cache import cache
-from django.db.models import Case, When, Value, IntegerField
 from django.utils import timezone
 import time
-from experiences.models import Group, Person, Participation
+from experiences.models import Group, Person
+from experiences import facilitators
+from experiences.admin import get_participation_inline_rows
 
 class Command(BaseCommand):
     help = 'Pre-warms the cache for improved admin performance'
@@ -55,61 +56,45 @@ class Command(BaseCommand):
             total_cached += 1
             self.stdout.write(self.style.SUCCESS(f"Cached year choices for selector widget"))
             
-        # Cache Person participation querysets
+        # Cache Person participation rows
         if do_all or options['persons_only']:
             self.stdout.write("Pre-warming person participation caches...")
-            persons = Person.objects.all()
+            person_ids = list(Person.objects.values_list('pk', flat=True))
             count = 0
             
-            for person in persons:
-                cache_key = f'participation_inline_person_{person.pk}'
-                
-                # Get participations with annotations
-                queryset = Participation.objects.filter(person=person).annotate(
-                    sort_order=Case(
-                        When(person__role__title='Facilitator', then=Value(1)),
-                        default=Value(2),
-                        output_field=IntegerField(),
-                    )
-                ).order_by('sort_order', 'person__user__first_name', 'person__user__last_name')
-                
-                cache.set(cache_key, queryset, 60 * 60 * 24 * 7)  # Cache for a week
+            for person_id in person_ids:
+                # Evaluated rows are cached, so the admin inline renders without querying
+                get_participation_inline_rows('person', person_id, refresh=True)
                 count += 1
                 
                 # Give feedback every 50 items
                 if count % 50 == 0:
-                    self.stdout.write(f"  - Cached {count}/{persons.count()} person participation lists...")
+                    self.stdout.write(f"  - Cached {count}/{len(person_ids)} person participation lists...")
             
             total_cached += count
-            self.stdout.write(self.style.SUCCESS(f"Cached {count} person participation querysets"))
+            self.stdout.write(self.style.SUCCESS(f"Cached {count} person participation lists"))
         
-        # Cache Group participation querysets
+        # Cache Group participation rows
         if do_all or options['groups_only']:
             self.stdout.write("Pre-warming group participation caches...")
-            groups = Group.objects.all()
+            group_ids = list(Group.objects.values_list('pk', flat=True))
             count = 0
             
-            for group in groups:
-                cache_key = f'participation_inline_group_{group.pk}'
-                
-                # Get participations with annotations
-                queryset = Participation.objects.filter(group=group).annotate(
-                    sort_order=Case(
-                        When(person__role__title='Facilitator', then=Value(1)),
-                        default=Value(2),
-                        output_field=IntegerField(),
-                    )
-                ).order_by('sort_order', 'person__user__first_name', 'person__user__last_name')
-                
-                cache.set(cache_key, queryset, 60 * 60 * 24 * 7)  # Cache for a week
+            for group_id in group_ids:
+                get_participation_inline_rows('group', group_id, refresh=True)
                 count += 1
                 
                 # Give feedback every 20 items
                 if count % 20 == 0:
-                    self.stdout.write(f"  - Cached {count}/{groups.count()} group participation lists...")
+                    self.stdout.write(f"  - Cached {count}/{len(group_ids)} group participation lists...")
             
             total_cached += count
-            self.stdout.write(self.style.SUCCESS(f"Cached {count} group participation querysets"))
+            self.stdout.write(self.style.SUCCESS(f"Cached {count} group participation lists"))
+            
+            # One index answers get_facilitators for every group
+            facilitators.rebuild()
+            total_cached += 1
+            self.stdout.write(self.style.SUCCESS("Rebuilt facilitator index"))
         
         elapsed_time = time.time() - start_time
         self.stdout.write(
@@ -0,0 +1,232 @@
+"""
+Content-addressed media backups.
+
+Every media file is stored once under ``backups/media_store/blobs/`` keyed by
+its SHA-256, and each snapshot is a small JSON manifest mapping paths under
+MEDIA_ROOT to blob hashes.  A snapshot only writes blobs the store has not seen
+before, and files whose size and mtime match the previous manifest are not
+even re-read.  ``collect_garbage`` drops old manifests and every blob no
+retained manifest refers to.
+
+A blob is named after the hash of the bytes actually copied into it, computed
+while copying, so a file rewritten during a snapshot never ends up stored under
+the hash of its earlier contents.
+
+Until a snapshot has written its manifest, the blobs it added or reuses are
+referenced by no manifest.  Snapshots and restores therefore hold the store's
+lock file shared and ``collect_garbage`` holds it exclusive, so garbage
+collection waits for running snapshots (and they for it) instead of deleting
+their blobs.
+"""
+import datetime
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from . import backup_engine
+
+STORE_DIR = 'media_store'
+HASH_CHUNK_SIZE = 1024 * 1024
+DEFAULT_KEEP = 14
+LOCK_FILE = 'lock'
+
+
+def get_store_dir(*parts):
+    path = os.path.join(backup_engine.get_backup_dir(), STORE_DIR, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def get_blob_path(digest):
+    return os.path.join(get_store_dir('blobs', digest[:2]), digest)
+
+
+@contextmanager
+def store_lock(exclusive=False):
+    """Hold the store's lock: shared for snapshots and restores, exclusive for garbage collection."""
+    with open(os.path.join(get_store_dir(), LOCK_FILE), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def store_blob(path):
+    """
+    Copy ``path`` into the store, hashing it while copying.
+
+    Returns the digest of the copied bytes and the number of bytes added to
+    the store (0 when a blob with that digest already existed).
+    """
+    digest = hashlib.sha256()
+    size = 0
+    # Copy under a temporary name so an interrupted copy never looks like a blob
+    with tempfile.NamedTemporaryFile(dir=get_store_dir('tmp'), delete=False) as temp:
+        try:
+            with open(path, 'rb') as source:
+                for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    temp.write(chunk)
+                    size += len(chunk)
+        except BaseException:
+            os.remove(temp.name)
+            raise
+    digest = digest.hexdigest()
+    blob_path = get_blob_path(digest)
+    if os.path.exists(blob_path):
+        os.remove(temp.name)
+        return digest, 0
+    os.replace(temp.name, blob_path)
+    return digest, size
+
+
+def list_manifests():
+    """Manifest names, newest first."""
+    return sorted(
+        (name for name in os.listdir(get_store_dir('manifests')) if name.endswith('.json')),
+        reverse=True,
+    )
+
+
+def read_manifest(name):
+    with open(os.path.join(get_store_dir('manifests'), name), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_json(path, data):
+    with open(f'{path}.part', 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(f'{path}.part', path)
+
+
+def snapshot(verify=False, progress=None):
+    """
+    Store the current MEDIA_ROOT and write a manifest for it.
+
+    Unless ``verify`` is set, the hash of a file whose size and mtime are
+    unchanged since the previous manifest is reused instead of re-reading it.
+    ``progress`` is called with ``(relative path, size)`` after each file.
+    Returns a summary with the manifest name, file count, new blobs and bytes.
+    """
+    with store_lock():
+        return _snapshot(verify, progress)
+
+
+def _snapshot(verify, progress):
+    start_time = time.time()
+    media_root = str(settings.MEDIA_ROOT)
+    manifests = list_manifests()
+    previous = read_manifest(manifests[0])['files'] if manifests else {}
+
+    files = {}
+    new_blobs = 0
+    new_bytes = 0
+    for directory, _, filenames in os.walk(media_root):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            relative_path = os.path.relpath(path, media_root).replace(os.sep, '/')
+            stat = os.stat(path)
+            known = previous.get(relative_path)
+            if not verify and known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+                digest = known['sha256']
+            else:
+                digest = hash_file(path)
+
+            if not os.path.exists(get_blob_path(digest)):
+                # The file may have changed since it was hashed: keep the hash of what was stored
+                digest, size = store_blob(path)
+                if size:
+                    new_blobs += 1
+                    new_bytes += size
+            files[relative_path] = {'sha256': digest, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+            if progress:
+                progress(relative_path, stat.st_size)
+
+    name = f"media_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.json"
+    write_json(os.path.join(get_store_dir('manifests'), name), {
+        'created': datetime.datetime.now().isoformat(),
+        'files': files,
+    })
+    return {
+        'manifest': name,
+        'files': len(files),
+        'size': sum(entry['size'] for entry in files.values()),
+        'new_blobs': new_blobs,
+        'new_bytes': new_bytes,
+        'elapsed': time.time() - start_time,
+    }
+
+
+def restore(name=None):
+    """Write the files of manifest ``name`` (default: the latest) back to MEDIA_ROOT."""
+    with store_lock():
+        manifests = list_manifests()
+        if not manifests or (name is not None and name not in manifests):
+            raise ValueError(f"No media snapshot named '{name}'" if name else "There are no media snapshots")
+        media_root = os.path.realpath(settings.MEDIA_ROOT)
+        files = read_manifest(name or manifests[0])['files']
+        for relative_path, entry in files.items():
+            target = os.path.realpath(os.path.join(media_root, relative_path))
+            if os.path.commonpath([media_root, target]) != media_root:
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(get_blob_path(entry['sha256']), target)
+            os.utime(target, ns=(entry['mtime_ns'], entry['mtime_ns']))
+    return len(files)
+
+
+def collect_garbage(keep=None, dry_run=False):
+    """
+    Keep the ``keep`` newest manifests (default: BACKUP_MEDIA_SNAPSHOTS_KEEP) and
+    delete the others and every blob no retained manifest refers to.
+    Returns (manifests removed, blobs removed, bytes freed).
+    """
+    if keep is None:
+        keep = getattr(settings, 'BACKUP_MEDIA_SNAPSHOTS_KEEP', DEFAULT_KEEP)
+    with store_lock(exclusive=True):
+        return _collect_garbage(keep, dry_run)
+
+
+def _collect_garbage(keep, dry_run):
+    manifests = list_manifests()
+    retained, expired = manifests[:keep], manifests[keep:]
+    referenced = set()
+    for name in retained:
+        referenced.update(entry['sha256'] for entry in read_manifest(name)['files'].values())
+
+    blobs_removed = 0
+    bytes_freed = 0
+    blobs_dir = get_store_dir('blobs')
+    for prefix in os.listdir(blobs_dir):
+        for digest in os.listdir(os.path.join(blobs_dir, prefix)):
+            if digest in referenced:
+                continue
+            path = os.path.join(blobs_dir, prefix, digest)
+            bytes_freed += os.path.getsize(path)
+            blobs_removed += 1
+            if not dry_run:
+                os.remove(path)
+    if not dry_run:
+        for name in expired:
+            os.remove(os.path.join(get_store_dir('manifests'), name))
+        # Left by interrupted copies; no snapshot runs while the lock is held exclusive
+        temp_dir = get_store_dir('tmp')
+        for name in os.listdir(temp_dir):
+            os.remove(os.path.join(temp_dir, name))
+    return len(expired), blobs_removed, bytes_freed
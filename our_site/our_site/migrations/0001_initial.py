@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-17 15:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(help_text='Model label, e.g. experiences.Person', max_length=100)),
+                ('object_pk', models.CharField(max_length=255)),
+                ('natural_key', models.JSONField(blank=True, null=True)),
+                ('deleted_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'ordering': ['deleted_at', 'pk'],
+            },
+        ),
+    ]
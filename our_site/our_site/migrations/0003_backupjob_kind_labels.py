@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 16:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('our_site', '0002_backupjob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='backupjob',
+            name='kind',
+            field=models.CharField(choices=[('database', 'Database'), ('media', 'Media files'), ('all', 'Database + media'), ('incremental', 'Incremental'), ('differential', 'Differential'), ('flat_csv', 'CSV (zip)')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 17:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('our_site', '0003_backupjob_kind_labels'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backupjob',
+            name='progress_at',
+            field=models.DateTimeField(blank=True, help_text='When the job last reported progress', null=True),
+        ),
+    ]
@@ -0,0 +1,98 @@
+from django.contrib.auth.models import User
+from django.db import models
+from django.db.models.signals import post_delete
+
+
+class Tombstone(models.Model):
+    """
+    A deleted row of a model backed up incrementally (see backup_chain.py).
+
+    Incremental backups select changed rows by ``last_modified``, which cannot
+    see deletions, so each deletion is logged here and replayed on restore.
+    """
+    model = models.CharField(max_length=100, help_text="Model label, e.g. experiences.Person")
+    object_pk = models.CharField(max_length=255)
+    natural_key = models.JSONField(null=True, blank=True)
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ['deleted_at', 'pk']
+
+    def __str__(self):
+        return f"{self.model} {self.object_pk} deleted at {self.deleted_at}"
+
+
+class BackupJob(models.Model):
+    """A backup run by the background job runner (see backup_jobs.py)."""
+    KIND_CHOICES = [
+        ('database', 'Database'),
+        ('media', 'Media files'),
+        ('all', 'Database + media'),
+        ('incremental', 'Incremental'),
+        ('differential', 'Differential'),
+        ('flat_csv', 'CSV (zip)'),
+    ]
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATE_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    state = models.CharField(max_length=20, choices=STATE_CHOICES, default=QUEUED, db_index=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    progress_at = models.DateTimeField(null=True, blank=True, help_text="When the job last reported progress")
+    rows_processed = models.BigIntegerField(default=0)
+    bytes_processed = models.BigIntegerField(default=0)
+    result = models.CharField(max_length=255, blank=True, help_text="Backup file or snapshot written")
+    errors = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['-created_at', '-pk']
+
+    def __str__(self):
+        return f"{self.get_kind_display()} backup #{self.pk} ({self.state})"
+
+    @property
+    def is_active(self):
+        return self.state in (self.QUEUED, self.RUNNING)
+
+    def as_dict(self):
+        return {
+            'id': self.pk,
+            'kind': self.kind,
+            'kind_display': self.get_kind_display(),
+            'state': self.state,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'rows_processed': self.rows_processed,
+            'bytes_processed': self.bytes_processed,
+            'result': self.result,
+            'errors': self.errors,
+        }
+
+
+def record_tombstone(sender, instance, **kwargs):
+    natural_key = instance.natural_key() if hasattr(instance, 'natural_key') else None
+    Tombstone.objects.create(
+        model=sender._meta.label,
+        object_pk=str(instance.pk),
+        natural_key=list(natural_key) if natural_key is not None else None,
+    )
+
+
+def connect_tombstone_signals():
+    """Log deletions of every model that incremental backups select by last_modified."""
+    from .backup_chain import get_incremental_models
+
+    for model in get_incremental_models():
+        post_delete.connect(record_tombstone, sender=model, dispatch_uid=f'tombstone_{model._meta.label}')
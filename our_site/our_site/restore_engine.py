@@ -0,0 +1,355 @@
+"""
+Bulk restore of database backups (the JSON Lines dumps of backup_engine, or
+``dumpdata`` JSON).
+
+``loaddata`` saves one object at a time with signals firing, so restoring a
+backup re-ran ``Person.update_cached_str`` and the cache invalidations once
+per row.  Here the dump is streamed once into one spooled file per model; the
+models are then loaded in foreign key order, ``batch_size`` rows at a time,
+with raw multi-row INSERTs:
+
+* no ``pre_save``/``post_save``/``m2m_changed`` signals are sent and
+  ``auto_now`` fields keep their backed-up values (as with ``loaddata``),
+* natural keys are resolved from one ``{natural key: pk}`` map per model,
+  read with a single query, instead of one ``get_by_natural_key`` per row,
+* rows that already exist (same pk or natural key) are replaced,
+* auto-created M2M tables are written with one INSERT per chunk.
+
+``restore`` wraps the load in one transaction, then rebuilds every
+``Person.cached_str`` and the ParticipationYear table in bulk and clears the
+cache once.  Rows of derived tables (backup_engine.DERIVED_MODELS) in older
+backups are skipped: restored over live data they would collide with the
+rows rebuilt since the backup.
+"""
+import io
+import json
+import re
+import tempfile
+import time
+
+from django.apps import apps
+from django.core.cache import cache
+from django.core.management.color import no_style
+from django.core.serializers.base import DeserializationError
+from django.db import DEFAULT_DB_ALIAS, connections, router, transaction
+
+from . import backup_engine
+
+DEFAULT_BATCH_SIZE = 1000
+# Rows of one model kept in memory before its spool file moves to disk
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+# The model label at the start of a dumped object, read without parsing the line
+MODEL_RE = re.compile(r'\s*\{\s*"model"\s*:\s*"([^"]+)"')
+
+
+def read_lines(stream):
+    """
+    Yield ``(model label, JSON line)`` for every object of the text ``stream``,
+    which holds either JSON Lines or a ``dumpdata`` JSON array.
+    """
+    first = stream.read(1)
+    while first.isspace():
+        first = stream.read(1)
+    if first == '[':
+        # A JSON array cannot be read one object at a time with the json module
+        for record in json.loads(first + stream.read()):
+            yield record['model'], json.dumps(record)
+        return
+
+    for line in (first + stream.readline(), *stream):
+        if not line.strip():
+            continue
+        match = MODEL_RE.match(line)
+        yield (match.group(1) if match else json.loads(line)['model']), line
+
+
+def get_restore_order(models):
+    """
+    ``models`` sorted so every model comes after the models its foreign keys
+    and M2M fields point to.  Models on a cycle keep their given order.
+    """
+    remaining = list(models)
+    present = set(remaining)
+    dependencies = {
+        model: {
+            field.related_model for field in (*model._meta.concrete_fields, *model._meta.many_to_many)
+            if field.is_relation and field.related_model in present and field.related_model is not model
+        }
+        for model in remaining
+    }
+    ordered = []
+    while remaining:
+        ready = [model for model in remaining if not dependencies[model] - set(ordered)]
+        if not ready:
+            ready = remaining[:1]
+        for model in ready:
+            ordered.append(model)
+            remaining.remove(model)
+    return ordered
+
+
+class NaturalKeys:
+    """
+    ``{natural key: value}`` maps of the rows in the database, each read with
+    one query the first time a model is looked up and kept up to date with the
+    rows the restore inserts.
+    """
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.using = using
+        self.maps = {}
+
+    def get_map(self, model, field_name=None):
+        field_name = field_name or model._meta.pk.attname
+        key = (model, field_name)
+        if key not in self.maps:
+            queryset = model._default_manager.db_manager(self.using).all()
+            # natural_key() of e.g. auth.Permission reads its content type
+            related = [
+                field.name for field in model._meta.concrete_fields
+                if field.is_relation and hasattr(field.related_model, 'natural_key')
+            ]
+            if related:
+                queryset = queryset.select_related(*related)
+            self.maps[key] = {
+                tuple(obj.natural_key()): getattr(obj, field_name) for obj in queryset.iterator()
+            }
+        return self.maps[key]
+
+    def resolve(self, model, value, field_name=None):
+        """The ``field_name`` (default: pk) of the ``model`` row a dumped reference points to."""
+        target = model._meta.get_field(field_name) if field_name else model._meta.pk
+        if isinstance(value, (list, tuple)) and hasattr(model, 'natural_key'):
+            try:
+                return self.get_map(model, target.attname)[tuple(value)]
+            except KeyError:
+                raise DeserializationError(f"{model._meta.label} matching natural key {value} does not exist")
+        return target.to_python(value)
+
+    def add(self, obj):
+        """Record an inserted object in the maps already read for its model."""
+        model = obj.__class__
+        for (mapped_model, field_name), values in self.maps.items():
+            if mapped_model is model:
+                values[tuple(obj.natural_key())] = getattr(obj, field_name)
+
+
+def build_object(model, record, keys):
+    """Return the unsaved object of ``record`` and its M2M values as ``{field: [pks]}``."""
+    data = {}
+    m2m = {}
+    if 'pk' in record:
+        data[model._meta.pk.attname] = model._meta.pk.to_python(record['pk'])
+    for name, value in record['fields'].items():
+        field = model._meta.get_field(name)
+        if field.many_to_many:
+            m2m[field] = [keys.resolve(field.related_model, item) for item in value]
+        elif field.is_relation:
+            data[field.attname] = None if value is None else keys.resolve(
+                field.related_model, value, field.remote_field.field_name,
+            )
+        else:
+            data[field.attname] = field.to_python(value)
+    obj = model(**data)
+    if obj.pk is None and hasattr(model, 'natural_key'):
+        # A natural primary key replaces the row with that key, as loaddata does
+        obj.pk = keys.get_map(model).get(tuple(obj.natural_key()))
+    return obj, m2m
+
+
+def delete_in_chunks(manager, field_name, values, using):
+    """DELETE the rows whose ``field_name`` is in ``values`` without collecting them (no signals)."""
+    step = max(connections[using].ops.bulk_batch_size([field_name], values), 1)
+    for start in range(0, len(values), step):
+        manager.filter(**{f'{field_name}__in': values[start:start + step]})._raw_delete(using)
+
+
+def insert(model, objs, using):
+    """
+    INSERT ``objs`` raw (no signals, ``auto_now`` values kept), replacing the
+    rows with the same pk.  Objects without a pk get the one the database
+    assigns.
+    """
+    connection = connections[using]
+    manager = model._base_manager.db_manager(using)
+    with_pk = [obj for obj in objs if obj.pk is not None]
+    without_pk = [obj for obj in objs if obj.pk is None]
+    pk = model._meta.pk
+    delete_in_chunks(manager, pk.name, [obj.pk for obj in with_pk], using)
+
+    for batch, fields in (
+        (with_pk, model._meta.local_concrete_fields),
+        (without_pk, [field for field in model._meta.local_concrete_fields if field is not pk]),
+    ):
+        if not batch:
+            continue
+        step = max(connection.ops.bulk_batch_size(fields, batch), 1)
+        can_return = connection.features.can_return_rows_from_bulk_insert
+        for start in range(0, len(batch), step):
+            chunk = batch[start:start + step]
+            returning = [pk] if batch is without_pk and (can_return or len(chunk) == 1) else None
+            rows = manager._insert(chunk, fields=fields, returning_fields=returning, raw=True, using=using)
+            for obj, row in zip(chunk, rows or ()):
+                obj.pk = row[0]
+    for obj in without_pk:
+        if obj.pk is None:
+            obj.pk = manager.get_by_natural_key(*obj.natural_key()).pk
+
+
+def insert_m2m(objs, m2m_values, using):
+    """Replace the auto-created M2M rows of ``objs`` with ``m2m_values`` (one dict per object)."""
+    fields = {field for values in m2m_values for field in values}
+    for field in fields:
+        through = field.remote_field.through
+        if not through._meta.auto_created:
+            # Rows of explicit through models are dumped as objects of their own
+            continue
+        source = through._meta.get_field(field.m2m_field_name()).attname
+        target = through._meta.get_field(field.m2m_reverse_field_name()).attname
+        with_field = [(obj, values[field]) for obj, values in zip(objs, m2m_values) if field in values]
+        delete_in_chunks(through._base_manager.db_manager(using), source, [obj.pk for obj, _ in with_field], using)
+        through._base_manager.db_manager(using).bulk_create([
+            through(**{source: obj.pk, target: pk}) for obj, pks in with_field for pk in pks
+        ])
+
+
+def load_model(model, lines, keys, batch_size=DEFAULT_BATCH_SIZE, using=DEFAULT_DB_ALIAS):
+    """Insert the dumped ``lines`` of ``model`` in chunks of ``batch_size``.  Returns (rows, pks)."""
+    rows = 0
+    pks = set()
+
+    def flush(objs, m2m_values):
+        insert(model, objs, using)
+        insert_m2m(objs, m2m_values, using)
+        if hasattr(model, 'natural_key'):
+            for obj in objs:
+                keys.add(obj)
+        pks.update(obj.pk for obj in objs)
+
+    objs, m2m_values = [], []
+    for line in lines:
+        obj, m2m = build_object(model, json.loads(line), keys)
+        objs.append(obj)
+        m2m_values.append(m2m)
+        rows += 1
+        if len(objs) >= batch_size:
+            flush(objs, m2m_values)
+            objs, m2m_values = [], []
+    if objs:
+        flush(objs, m2m_values)
+    return rows, pks
+
+
+def reset_sequences(models, using=DEFAULT_DB_ALIAS):
+    """Explicit pks were inserted, so sequences (e.g. PostgreSQL's) must catch up."""
+    connection = connections[using]
+    sequence_sql = connection.ops.sequence_reset_sql(no_style(), models)
+    if sequence_sql:
+        with connection.cursor() as cursor:
+            for sql in sequence_sql:
+                cursor.execute(sql)
+
+
+def load(stream, using=DEFAULT_DB_ALIAS, batch_size=DEFAULT_BATCH_SIZE, replace_models=(), progress=None):
+    """
+    Bulk load the dump read from the text ``stream``; call inside a transaction.
+
+    For the models in ``replace_models`` (labels) the dump is the whole table:
+    existing rows that are not in it are deleted afterwards.  ``progress`` is
+    called with ``(model, rows, elapsed seconds)`` after each model.
+    Returns ``{model label: {'rows', 'elapsed', 'rows_per_second'}}``.
+    """
+    connection = connections[using]
+    labels = {}
+    spools = {}
+    try:
+        for label, line in read_lines(stream):
+            if label not in labels:
+                try:
+                    labels[label] = model = apps.get_model(label)
+                except (LookupError, ValueError):
+                    raise DeserializationError(f"Invalid model identifier: '{label}'")
+                if model._meta.label in backup_engine.DERIVED_MODELS:
+                    labels[label] = None
+                    continue
+                if model._meta.parents:
+                    raise DeserializationError(f"{label} uses multi-table inheritance; restore it with loaddata")
+                spools[model] = tempfile.SpooledTemporaryFile(SPOOL_MAX_SIZE, mode='w+', encoding='utf-8')
+            if labels[label] is None:
+                continue
+            spools[labels[label]].write(line if line.endswith('\n') else line + '\n')
+
+        models = [model for model in spools if router.allow_migrate_model(using, model)]
+        keys = NaturalKeys(using)
+        stats = {}
+        loaded_pks = {}
+        with connection.constraint_checks_disabled():
+            for model in get_restore_order(models):
+                spool = spools[model]
+                spool.seek(0)
+                start_time = time.time()
+                rows, loaded_pks[model._meta.label] = load_model(model, spool, keys, batch_size, using)
+                elapsed = time.time() - start_time
+                stats[model._meta.label] = {
+                    'rows': rows,
+                    'elapsed': elapsed,
+                    'rows_per_second': rows / elapsed if elapsed else float(rows),
+                }
+                if progress:
+                    progress(model, rows, elapsed)
+        tables = [model._meta.db_table for model in models]
+        tables += [field.remote_field.through._meta.db_table for model in models for field in model._meta.local_many_to_many]
+        connection.check_constraints(table_names=tables)
+    finally:
+        for spool in spools.values():
+            spool.close()
+
+    reset_sequences(models, using)
+
+    for label in replace_models:
+        model = apps.get_model(label)
+        pks = loaded_pks.get(label, set())
+        stale = list(set(model._default_manager.using(using).values_list('pk', flat=True)) - pks)
+        for start in range(0, len(stale), backup_engine.DEFAULT_CHUNK_SIZE):
+            model._default_manager.using(using).filter(pk__in=stale[start:start + backup_engine.DEFAULT_CHUNK_SIZE]).delete()
+    return stats
+
+
+def finish_restore(using=DEFAULT_DB_ALIAS):
+    """Bring derived data up to date once the rows are back (no signals ran for them)."""
+    from experiences.models import Participation, Person
+
+    # cached_str is rebuilt with bulk_update, which does not touch last_modified
+    Person.objects.using(using).rebuild_cached_str()
+    # ParticipationYear is not backed up (backup_engine.DERIVED_MODELS)
+    Participation.objects.using(using).sync_years()
+    # Every cached list, index and tag generation may describe rows that changed
+    cache.clear()
+
+
+def restore(fileobj, using=DEFAULT_DB_ALIAS, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """
+    Restore the backup read from the binary ``fileobj`` (JSON or JSON Lines,
+    optionally gzip-compressed) in one transaction.
+
+    Returns a summary with the per-model statistics of ``load``, total rows
+    and elapsed seconds.
+    """
+    start_time = time.time()
+    compressed = fileobj.read(2) == b'\x1f\x8b'
+    fileobj.seek(0)
+    stream = backup_engine.open_dump(fileobj) if compressed else io.TextIOWrapper(fileobj, encoding='utf-8')
+    try:
+        with transaction.atomic(using=using):
+            models = load(stream, using=using, batch_size=batch_size, progress=progress)
+            finish_restore(using)
+    finally:
+        # Either way the caller's file stays open
+        if compressed:
+            stream.close()
+        else:
+            stream.detach()
+    return {
+        'models': models,
+        'rows': sum(entry['rows'] for entry in models.values()),
+        'elapsed': time.time() - start_time,
+    }
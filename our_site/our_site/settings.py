@@ -66,6 +66,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'experiences.middleware.PrincipalMiddleware',  # request.principal, after AuthenticationMiddleware
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',  # Add Django Debug Toolbar middleware
@@ -161,7 +162,17 @@ CONSTANCE_BACKEND = 'constance.backends.database.DatabaseBackend'
 
 # Cache configuration
 CACHES = {
+    # In-process L1 in front of the shared file cache (see our_site/cache_backends.py)
     'default': {
+        'BACKEND': 'our_site.cache_backends.TieredCache',
+        'OPTIONS': {
+            'SHARED_CACHE': 'shared',
+            'L1_MAX_ENTRIES': 1000,
+            'L1_TIMEOUT': 30,  # Max seconds another process' write can go unseen
+            'L1_POLICY': 'lru',  # 'lru', 'lfu' or 'fifo'
+        }
+    },
+    'shared': {
         'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
         'LOCATION': os.path.join(BASE_DIR, 'tmp'),
         'TIMEOUT': 60 * 60 * 24 * 7,  # 1 week cache timeout
@@ -171,6 +182,36 @@ CACHES = {
     }
 }
 
+# Backups (see our_site/backup_chain.py)
+# Incremental/differential archives after a full snapshot before the next backup is full again
+BACKUP_CHAIN_LENGTH = 7
+# Media snapshots kept by `gc_media_store` (see our_site/media_store.py)
+BACKUP_MEDIA_SNAPSHOTS_KEEP = 14
+# Backups run by the background job runner at once, per process (see our_site/backup_jobs.py)
+BACKUP_JOB_WORKERS = 2
+# Seconds without progress after which a running backup job is marked failed
+BACKUP_JOB_STALE_AFTER = 600
+# Let the front-end server send backup downloads: None, 'x-accel-redirect' (nginx) or 'x-sendfile'
+# (see our_site/backup_downloads.py)
+BACKUP_DOWNLOAD_ACCEL = None
+# nginx `internal` location mapped to the backups directory, for 'x-accel-redirect'
+BACKUP_DOWNLOAD_INTERNAL_LOCATION = '/internal/backups/'
+
+# People imports (see experiences/people_import.py)
+# Processes hashing the passwords of new users; None uses every core, 1 hashes in the request thread
+# (see experiences/password_hashing.py)
+PASSWORD_HASH_WORKERS = None
+# Imports run by the background job runner at once, per process (see experiences/import_jobs.py)
+IMPORT_JOB_WORKERS = 1
+# Rows written per transaction and checkpoint
+IMPORT_CHUNK_SIZE = 500
+# Seconds without a checkpoint after which a running import can be resumed
+IMPORT_JOB_STALE_AFTER = 300
+# Seconds after a job finished during which its new users' credentials can be downloaded
+IMPORT_CREDENTIALS_EXPIRE_AFTER = 60 * 60 * 24
+# Seconds after a job finished after which its files (upload, report) are deleted
+IMPORT_FILES_EXPIRE_AFTER = 60 * 60 * 24 * 30
+
 CONSTANCE_CONFIG = {
     'SITE_FAVICON': ('', 'Optional site favicon path', str),
     'ADMIN_SITE_ICON': ('', 'Optional admin site icon path \n(leave empty to use SITE_FAVICON)', str),
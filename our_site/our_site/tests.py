@@ -0,0 +1,994 @@
+import gzip
+import hashlib
+import csv
+import datetime
+import io
+import json
+import os
+import tarfile
+import tempfile
+import threading
+import zipfile
+from unittest import mock
+
+from django.contrib.auth.models import Group as AuthGroup, User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.serializers.base import DeserializationError
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from experiences.models import Group, Participation, ParticipationYear, Person, Role
+
+from . import backup_catalog, backup_chain, backup_engine, backup_jobs, csv_backup, media_store, restore_engine, views
+from .cache_backends import LocalStore, SQLiteCache, _local_stores
+from .models import BackupJob
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def tiered_caches(policy='lru', max_entries=3):
+    return {
+        'default': {
+            'BACKEND': 'our_site.cache_backends.TieredCache',
+            'OPTIONS': {
+                'SHARED_CACHE': 'shared',
+                'L1_MAX_ENTRIES': max_entries,
+                'L1_TIMEOUT': 30,
+                'L1_POLICY': policy,
+            },
+        },
+        'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tiered-tests'},
+    }
+
+
+@override_settings(CACHES=tiered_caches())
+class TieredCacheTests(SimpleTestCase):
+    def setUp(self):
+        _local_stores.clear()
+        caches['default'].clear()
+
+    def test_hot_key_read_from_shared_store_once(self):
+        caches['shared'].set('facilitator_role_ids', [1, 2])
+        with mock.patch.object(type(caches['shared']), 'get', wraps=caches['shared'].get) as shared_get:
+            for _ in range(5):
+                self.assertEqual(caches['default'].get('facilitator_role_ids'), [1, 2])
+        self.assertEqual(shared_get.call_count, 1)
+
+    def test_writes_go_through_to_shared_store(self):
+        caches['default'].set('key', 'value')
+        self.assertTrue(caches['default'].add('counter', 1))
+        caches['default'].incr('counter')
+        self.assertEqual(caches['shared'].get('key'), 'value')
+        self.assertEqual(caches['shared'].get('counter'), 2)
+        caches['default'].delete('key')
+        self.assertIsNone(caches['default'].get('key'))
+
+    def test_l1_entries_expire(self):
+        caches['default'].set('key', 'old')
+        caches['shared'].set('key', 'new')
+        with mock.patch('our_site.cache_backends.time.monotonic', return_value=10 ** 9):
+            self.assertEqual(caches['default'].get('key'), 'new')
+
+    def test_lru_evicts_least_recently_used(self):
+        store = LocalStore(2, 'lru')
+        store.set('a', 1, 60)
+        store.set('b', 2, 60)
+        store.get('a')
+        store.set('c', 3, 60)
+        self.assertEqual((store.get('a'), store.get('c')), (1, 3))
+        self.assertNotEqual(store.get('b'), 2)
+
+    def test_lfu_evicts_least_frequently_used(self):
+        store = LocalStore(2, 'lfu')
+        store.set('a', 1, 60)
+        store.set('b', 2, 60)
+        store.get('b')
+        store.get('b')
+        store.get('a')
+        store.set('c', 3, 60)
+        self.assertNotEqual(store.get('a'), 1)
+        self.assertEqual(store.get('b'), 2)
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            LocalStore(2, 'random')
+
+
+class SQLiteCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        location = os.path.join(self.tmpdir.name, 'cache.sqlite3')
+        settings = {'sqlite': {
+            'BACKEND': 'our_site.cache_backends.SQLiteCache',
+            'LOCATION': location,
+            'OPTIONS': {'MAX_ENTRIES': 10, 'CULL_FREQUENCY': 2},
+        }}
+        override = override_settings(CACHES=settings)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.cache = caches['sqlite']
+
+    def test_basic_operations(self):
+        self.assertTrue(self.cache.add('key', {'a': 1}))
+        self.assertFalse(self.cache.add('key', 'other'))
+        self.assertEqual(self.cache.get('key'), {'a': 1})
+        self.assertFalse(self.cache.has_key('missing'))
+        self.cache.set('n', 1)
+        self.assertEqual(self.cache.incr('n', 5), 6)
+        self.assertEqual(self.cache.get_many(['key', 'n', 'nope']), {'key': {'a': 1}, 'n': 6})
+        self.assertTrue(self.cache.delete('key'))
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_expired_entries_are_misses(self):
+        self.cache.set('key', 'value', timeout=0)
+        self.assertIsNone(self.cache.get('key'))
+        with self.assertRaises(ValueError):
+            self.cache.incr('key')
+
+    def test_culls_when_full(self):
+        for i in range(25):
+            self.cache.set(f'key{i}', i)
+        count = self.cache._connection().execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        self.assertLessEqual(count, 10)
+        self.assertEqual(self.cache.get('key24'), 24)
+
+    def test_counts_entries_every_cull_every_writes(self):
+        cache = SQLiteCache(self.cache._path, {'OPTIONS': {'MAX_ENTRIES': 1000}})
+        self.assertEqual(cache._cull_every, 10)
+        counts = []
+        cache._connection().set_trace_callback(lambda sql: counts.append(sql) if 'COUNT(*)' in sql else None)
+        for i in range(100):
+            cache.set(f'key{i}', i)
+        self.assertEqual(len(counts), 10)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BackupEngineTests(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'db_backup.jsonl.gz')
+        self.add_people(3)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def add_people(self, count):
+        role, _ = Role.objects.get_or_create(title='Student')
+        start = User.objects.count()
+        for i in range(start, start + count):
+            user = User.objects.create(username=f'user{i}')
+            user.groups.add(AuthGroup.objects.get_or_create(name='Students')[0])
+            Person.objects.create(user=user, role=role)
+
+    def read_backup(self):
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            return [json.loads(line) for line in f]
+
+    def test_writes_compact_json_lines_with_natural_keys(self):
+        result = backup_engine.backup_database(self.path, chunk_size=2)
+        records = self.read_backup()
+        self.assertEqual(result['rows'], len(records))
+        self.assertEqual(result['models']['experiences.Person'], 3)
+        self.assertFalse(any(r['model'] == 'auth.permission' for r in records))
+        self.assertFalse(any(r['model'].startswith('contenttypes.') for r in records))
+
+        user = next(r for r in records if r['model'] == 'auth.user')
+        self.assertNotIn('pk', user)  # natural primary key
+        self.assertEqual(user['fields']['groups'], [['Students']])
+        person = next(r for r in records if r['model'] == 'experiences.person')
+        self.assertEqual(person['fields']['user'], ['user0'])
+        # Users are written before the people that refer to them
+        models = [r['model'] for r in records]
+        self.assertLess(models.index('auth.user'), models.index('experiences.person'))
+
+    def test_queries_do_not_grow_with_rows(self):
+        with CaptureQueriesContext(connection) as small:
+            backup_engine.backup_database(self.path, chunk_size=100)
+        self.add_people(20)
+        with CaptureQueriesContext(connection) as large:
+            backup_engine.backup_database(self.path, chunk_size=100)
+        self.assertEqual(len(small), len(large))
+
+    def test_backup_loads_with_loaddata(self):
+        backup_engine.backup_database(self.path)
+        Person.objects.all().delete()
+        User.objects.all().delete()
+
+        call_command('loaddata', self.path, verbosity=0)
+        self.assertEqual(Person.objects.count(), 3)
+        self.assertEqual(
+            list(Person.objects.order_by('user__username').values_list('user__username', flat=True)),
+            ['user0', 'user1', 'user2'],
+        )
+        self.assertEqual(User.objects.get(username='user1').groups.get().name, 'Students')
+
+    def test_backup_all_adds_dump_and_media_in_one_archive(self):
+        media_root = os.path.join(self.temp_dir.name, 'media')
+        os.makedirs(os.path.join(media_root, 'badges'))
+        with open(os.path.join(media_root, 'badges', 'gold.png'), 'wb') as f:
+            f.write(b'png')
+        archive_path = os.path.join(self.temp_dir.name, 'full_backup.tar.gz')
+
+        with override_settings(MEDIA_ROOT=media_root):
+            result = backup_engine.backup_all(archive_path)
+
+        self.assertEqual(result['media_files'], 1)
+        # No temp directory or partial archive is left behind
+        self.assertEqual(sorted(os.listdir(self.temp_dir.name)), ['full_backup.tar.gz', 'media'])
+        with tarfile.open(archive_path) as archive:
+            names = archive.getnames()
+            root = names[0].split('/')[0]
+            self.assertIn(f'{root}/media/badges/gold.png', names)
+            dump = archive.extractfile(f'{root}/db_backup.jsonl.gz').read()
+        records = [json.loads(line) for line in gzip.decompress(dump).decode().splitlines()]
+        self.assertEqual(len(records), result['rows'])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CSVBackupTests(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'db_csv_backup.zip')
+        self.add_people(3)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    add_people = BackupEngineTests.add_people
+
+    def read_member(self, archive, name):
+        return list(csv.reader(io.TextIOWrapper(archive.open(name), encoding='utf-8', newline='')))
+
+    def test_writes_one_member_per_model_and_m2m_table(self):
+        result = csv_backup.backup(self.path, chunk_size=2)
+        self.assertEqual(result['models']['experiences.Person'], 3)
+        with zipfile.ZipFile(self.path) as archive:
+            manifest = json.loads(archive.read(csv_backup.MANIFEST))
+            members = [entry['member'] for entry in manifest['models']]
+            self.assertNotIn('auth.permission.csv', members)
+            self.assertNotIn('sessions.session.csv', members)
+            # Users are written before the people that refer to them
+            self.assertLess(members.index('auth.user.csv'), members.index('experiences.person.csv'))
+
+            people = self.read_member(archive, 'experiences.person.csv')
+            self.assertIn('user_id', people[0])
+            self.assertNotIn('guardians', people[0])
+            self.assertEqual(len(people), 4)
+            graduating_year = people[0].index('graduating_year')
+            self.assertEqual({row[graduating_year] for row in people[1:]}, {csv_backup.NULL})
+
+            groups = self.read_member(archive, 'auth.user.groups.csv')
+            self.assertEqual(groups[0], ['user_id', 'group_id'])
+            self.assertEqual(len(groups), 4)
+        self.assertFalse(os.path.exists(f'{self.path}.part'))
+
+    def test_queries_do_not_grow_with_rows(self):
+        with CaptureQueriesContext(connection) as small:
+            csv_backup.backup(self.path, chunk_size=100)
+        self.add_people(20)
+        with CaptureQueriesContext(connection) as large:
+            csv_backup.backup(self.path, chunk_size=100)
+        self.assertEqual(len(small), len(large))
+
+    def restore(self, **kwargs):
+        with open(self.path, 'rb') as f:
+            return csv_backup.restore(f, **kwargs)
+
+    def test_restore_round_trip(self):
+        csv_backup.backup(self.path)
+        last_modified = dict(Person.objects.values_list('user__username', 'last_modified'))
+        Person.objects.all().delete()
+        User.objects.all().delete()
+
+        result = self.restore(batch_size=2)
+        self.assertEqual(result['models']['experiences.Person']['rows'], 3)
+        self.assertEqual(result['models']['auth.User_groups']['rows'], 3)
+        self.assertGreater(result['models']['auth.User']['rows_per_second'], 0)
+        people = Person.objects.select_related('user').order_by('user__username')
+        self.assertEqual([person.user.username for person in people], ['user0', 'user1', 'user2'])
+        self.assertEqual([person.cached_str for person in people], [person.build_cached_str() for person in people])
+        self.assertEqual({person.user.username: person.last_modified for person in people}, last_modified)
+        self.assertIsNone(people[0].graduating_year)
+        self.assertEqual(User.objects.get(username='user1').groups.get().name, 'Students')
+
+    def test_restore_replaces_m2m_rows_of_restored_objects(self):
+        csv_backup.backup(self.path)
+        user = User.objects.get(username='user0')
+        user.groups.set([AuthGroup.objects.create(name='Guardians')])
+
+        self.restore()
+        self.assertEqual(list(user.groups.values_list('name', flat=True)), ['Students'])
+
+    def test_restore_sends_no_signals_and_queries_do_not_grow_with_rows(self):
+        csv_backup.backup(self.path)
+        with mock.patch.object(Person, 'update_cached_str') as update_cached_str:
+            with CaptureQueriesContext(connection) as small:
+                self.restore()
+        update_cached_str.assert_not_called()
+
+        self.add_people(20)
+        csv_backup.backup(self.path)
+        with CaptureQueriesContext(connection) as large:
+            self.restore()
+        self.assertEqual(len(small), len(large))
+
+    def test_restores_over_participations_changed_since_the_backup(self):
+        participation = Participation.objects.create(
+            person=Person.objects.first(), group=Group.objects.create(name='Band'), years=[2023, 2024],
+        )
+        # An archive written while the derived table was still backed up
+        excluded = tuple(label for label in backup_engine.EXCLUDED_MODELS if label not in backup_engine.DERIVED_MODELS)
+        with mock.patch.object(backup_engine, 'EXCLUDED_MODELS', excluded):
+            csv_backup.backup(self.path)
+        with zipfile.ZipFile(self.path) as archive:
+            self.assertIn('experiences.participationyear.csv', archive.namelist())
+        participation.years = [2024]
+        participation.save()
+        participation.years = [2023, 2024, 2025]
+        participation.save()
+
+        result = self.restore()
+        self.assertNotIn('experiences.ParticipationYear', result['models'])
+        self.assertEqual(Participation.objects.get().years, [2023, 2024])
+        self.assertEqual(sorted(ParticipationYear.objects.values_list('year', flat=True)), [2023, 2024])
+
+        csv_backup.backup(self.path)
+        with zipfile.ZipFile(self.path) as archive:
+            self.assertNotIn('experiences.participationyear.csv', archive.namelist())
+
+    def test_failed_restore_changes_nothing(self):
+        csv_backup.backup(self.path)
+        with zipfile.ZipFile(self.path) as archive:
+            members = {name: archive.read(name) for name in archive.namelist()}
+        members['experiences.person.csv'] += b'999,too,few\r\n'
+        with zipfile.ZipFile(self.path, 'w') as archive:
+            for name, data in members.items():
+                archive.writestr(name, data)
+        User.objects.filter(username='user0').update(first_name='Changed')
+
+        with self.assertRaises(DeserializationError):
+            self.restore()
+        self.assertEqual(User.objects.get(username='user0').first_name, 'Changed')
+
+    def test_restore_view(self):
+        csv_backup.backup(self.path)
+        Person.objects.all().delete()
+        staff = User.objects.create(username='staff', is_staff=True, is_superuser=True)
+        self.client.force_login(staff)
+        # The management page the view redirects to reads the backup catalog
+        with open(self.path, 'rb') as f, override_settings(BASE_DIR=self.temp_dir.name):
+            response = self.client.post(reverse('restore_database_from_flat_csv'), {'file': f}, follow=True)
+        self.assertContains(response, 'Restored')
+        self.assertEqual(Person.objects.count(), 3)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RestoreEngineTests(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'db_backup.jsonl.gz')
+        self.role = Role.objects.create(title='Student')
+        students = AuthGroup.objects.create(name='Students')
+        for i in range(3):
+            user = User.objects.create(username=f'user{i}', first_name=f'First{i}')
+            user.groups.add(students)
+            Person.objects.create(user=user, role=self.role)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def restore(self, path=None, **kwargs):
+        with open(path or self.path, 'rb') as f:
+            return restore_engine.restore(f, **kwargs)
+
+    def test_restores_rows_relations_and_timestamps(self):
+        backup_engine.backup_database(self.path)
+        last_modified = dict(Person.objects.values_list('user__username', 'last_modified'))
+        Person.objects.all().delete()
+        User.objects.all().delete()
+
+        result = self.restore(batch_size=2)
+        self.assertEqual(result['models']['experiences.Person']['rows'], 3)
+        self.assertGreater(result['models']['auth.User']['rows_per_second'], 0)
+        self.assertEqual(result['rows'], sum(entry['rows'] for entry in result['models'].values()))
+        people = Person.objects.select_related('user').order_by('user__username')
+        self.assertEqual([person.user.username for person in people], ['user0', 'user1', 'user2'])
+        self.assertEqual([person.cached_str for person in people], [person.build_cached_str() for person in people])
+        # auto_now fields keep their backed-up values (JSON holds milliseconds)
+        self.assertEqual(
+            {person.user.username: person.last_modified for person in people},
+            {name: value.replace(microsecond=value.microsecond // 1000 * 1000) for name, value in last_modified.items()},
+        )
+        self.assertEqual(User.objects.get(username='user1').groups.get().name, 'Students')
+
+    def test_replaces_existing_rows(self):
+        backup_engine.backup_database(self.path)
+        User.objects.filter(username='user0').update(first_name='Changed')
+        Group.objects.create(name='Created after the backup')
+
+        self.restore()
+        self.assertEqual(User.objects.count(), 3)
+        self.assertEqual(User.objects.get(username='user0').first_name, 'First0')
+        # Like loaddata, rows that are not in the backup are kept
+        self.assertTrue(Group.objects.filter(name='Created after the backup').exists())
+
+    def test_restores_over_participations_changed_since_the_backup(self):
+        participation = Participation.objects.create(
+            person=Person.objects.first(), group=Group.objects.create(name='Band'), years=[2023, 2024],
+        )
+        backup_engine.backup_database(self.path)
+        # Derived rows with other ids than in the backup
+        participation.years = [2024]
+        participation.save()
+        participation.years = [2023, 2024, 2025]
+        participation.hours = 7
+        participation.save()
+        # Rows of the derived table in a backup written before it was excluded are skipped
+        with gzip.open(self.path, 'at', encoding='utf-8') as f:
+            f.write(f'{{"model":"experiences.participationyear","pk":1,"fields":{{"participation":{participation.pk},"year":1999}}}}\n')
+
+        result = self.restore()
+        self.assertNotIn('experiences.ParticipationYear', result['models'])
+        self.assertEqual(Participation.objects.get().years, [2023, 2024])
+        self.assertEqual(sorted(ParticipationYear.objects.values_list('year', flat=True)), [2023, 2024])
+
+    def test_no_per_row_signals_and_queries_do_not_grow_with_rows(self):
+        backup_engine.backup_database(self.path)
+        with mock.patch.object(Person, 'update_cached_str') as update_cached_str:
+            with CaptureQueriesContext(connection) as small:
+                self.restore()
+        update_cached_str.assert_not_called()
+
+        for i in range(3, 30):
+            Person.objects.create(user=User.objects.create(username=f'user{i}'), role=self.role)
+        backup_engine.backup_database(self.path)
+        with CaptureQueriesContext(connection) as large:
+            self.restore()
+        self.assertEqual(len(small), len(large))
+
+    def test_reads_dumpdata_json(self):
+        path = os.path.join(self.temp_dir.name, 'dump.json')
+        call_command(
+            'dumpdata', 'auth.group', 'auth.user', 'experiences.role', 'experiences.person',
+            natural_foreign=True, natural_primary=True, output=path, verbosity=0,
+        )
+        Person.objects.all().delete()
+        User.objects.all().delete()
+
+        result = self.restore(path)
+        self.assertEqual(result['models']['experiences.Person']['rows'], 3)
+        self.assertEqual(Person.objects.filter(user__username='user2').count(), 1)
+
+    def test_orders_models_by_dependency(self):
+        order = restore_engine.get_restore_order([Person, User, Role, AuthGroup])
+        self.assertLess(order.index(User), order.index(Person))
+        self.assertLess(order.index(Role), order.index(Person))
+        self.assertLess(order.index(AuthGroup), order.index(User))
+
+    def test_failed_restore_changes_nothing(self):
+        backup_engine.backup_database(self.path)
+        with gzip.open(self.path, 'at', encoding='utf-8') as f:
+            f.write('{"model":"experiences.person","pk":999,"fields":{"user":["missing"],"role":1}}\n')
+        User.objects.filter(username='user0').update(first_name='Changed')
+
+        with self.assertRaises(DeserializationError):
+            self.restore()
+        self.assertEqual(User.objects.get(username='user0').first_name, 'Changed')
+
+    def test_restore_view(self):
+        backup_engine.backup_database(self.path)
+        Person.objects.all().delete()
+        staff = User.objects.create(username='staff', is_staff=True, is_superuser=True)
+        self.client.force_login(staff)
+        # The management page the view redirects to reads the backup catalog
+        with open(self.path, 'rb') as f, override_settings(BASE_DIR=self.temp_dir.name):
+            response = self.client.post(reverse('restore_database'), {'file': f}, follow=True)
+        self.assertContains(response, 'Restored')
+        self.assertEqual(Person.objects.count(), 3)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BackupChainTests(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.media_root = os.path.join(self.temp_dir.name, 'media')
+        os.makedirs(self.media_root)
+        self.write_media('old.png')
+        self.settings = override_settings(BASE_DIR=self.temp_dir.name, MEDIA_ROOT=self.media_root)
+        self.settings.enable()
+        role = Role.objects.create(title='Student')
+        self.people = [
+            Person.objects.create(user=User.objects.create(username=f'user{i}'), role=role)
+            for i in range(3)
+        ]
+
+    def tearDown(self):
+        self.settings.disable()
+        self.temp_dir.cleanup()
+
+    def write_media(self, name, content=b'png'):
+        with open(os.path.join(self.media_root, name), 'wb') as f:
+            f.write(content)
+
+    def read_archive(self, entry):
+        path = os.path.join(self.temp_dir.name, 'backups', entry['name'])
+        with tarfile.open(path) as archive:
+            names = archive.getnames()
+            dump = archive.extractfile(f"{entry['root']}/db_backup.jsonl.gz").read()
+            tombstones = archive.extractfile(f"{entry['root']}/tombstones.jsonl").read().decode()
+        records = [json.loads(line) for line in gzip.decompress(dump).decode().splitlines()]
+        return names, records, [json.loads(line) for line in tombstones.splitlines()]
+
+    def test_incremental_holds_changed_rows_deletions_and_media(self):
+        full = backup_chain.backup(backup_chain.INCREMENTAL)
+        self.assertEqual(full['type'], backup_chain.FULL)  # no chain yet
+
+        self.people[0].graduating_year = 2030
+        self.people[0].save()
+        self.people[2].delete()
+        self.write_media('new.png')
+        incremental = backup_chain.backup(backup_chain.INCREMENTAL)
+
+        self.assertEqual(incremental['type'], backup_chain.INCREMENTAL)
+        self.assertEqual(incremental['tombstones'], 1)
+        self.assertEqual(incremental['media_files'], 1)
+        names, records, tombstones = self.read_archive(incremental)
+        people = [r for r in records if r['model'] == 'experiences.person']
+        self.assertEqual([p['pk'] for p in people], [self.people[0].pk])
+        # Models without last_modified are copied in full
+        self.assertEqual(len([r for r in records if r['model'] == 'auth.user']), 3)
+        self.assertEqual(tombstones[0]['model'], 'experiences.Person')
+        self.assertIn(f"{incremental['root']}/media/new.png", names)
+        self.assertNotIn(f"{incremental['root']}/media/old.png", names)
+
+    def test_restore_replays_the_chain(self):
+        backup_chain.backup(backup_chain.FULL)
+        self.people[0].graduating_year = 2030
+        self.people[0].save()
+        self.people[1].delete()
+        added = Person.objects.create(user=User.objects.create(username='added'))
+        self.write_media('new.png')
+        backup_chain.backup(backup_chain.INCREMENTAL)
+
+        # Wreck the database and media after the last backup
+        Person.objects.filter(pk=self.people[0].pk).update(graduating_year=1999)
+        Person.objects.create(user=User.objects.create(username='after'))
+        added.delete()
+        os.remove(os.path.join(self.media_root, 'new.png'))
+
+        backup_chain.restore()
+        self.assertEqual(
+            set(Person.objects.values_list('user__username', flat=True)),
+            {'user0', 'user2', 'added'},
+        )
+        self.assertEqual(Person.objects.get(user__username='user0').graduating_year, 2030)
+        self.assertFalse(User.objects.filter(username='after').exists())
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, 'new.png')))
+
+    def test_incremental_holds_changed_participations_only(self):
+        group = Group.objects.create(name='Band')
+        participations = [
+            Participation.objects.create(person=person, group=group, years=[2024]) for person in self.people
+        ]
+        backup_chain.backup(backup_chain.FULL)
+        participations[1].hours = 10
+        participations[1].save()
+        Participation.objects.filter(pk=participations[2].pk).update(is_public=True)
+        deleted_pk = participations[0].pk
+        participations[0].delete()
+
+        names, records, tombstones = self.read_archive(backup_chain.backup(backup_chain.INCREMENTAL))
+        self.assertEqual(
+            sorted(r['pk'] for r in records if r['model'] == 'experiences.participation'),
+            [participations[1].pk, participations[2].pk],
+        )
+        self.assertEqual(
+            [t['object_pk'] for t in tombstones if t['model'] == 'experiences.Participation'],
+            [str(deleted_pk)],
+        )
+
+    def test_failed_archive_rolls_back_the_whole_chain(self):
+        backup_chain.backup(backup_chain.FULL)
+        self.people[0].graduating_year = 2030
+        self.people[0].save()
+        self.write_media('new.png')
+        backup_chain.backup(backup_chain.INCREMENTAL)
+        Person.objects.create(user=User.objects.create(username='after'))
+        os.remove(os.path.join(self.media_root, 'new.png'))
+
+        load = restore_engine.load
+        calls = []
+
+        def fail_second_archive(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 2:
+                raise ValueError('corrupt archive')
+            return load(*args, **kwargs)
+
+        with mock.patch.object(restore_engine, 'load', fail_second_archive):
+            with self.assertRaises(ValueError):
+                backup_chain.restore()
+        # Not the full snapshot without the incremental, nor its media
+        self.assertTrue(User.objects.filter(username='after').exists())
+        self.assertEqual(Person.objects.get(pk=self.people[0].pk).graduating_year, 2030)
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'new.png')))
+
+    def test_restore_sequence_uses_latest_differential(self):
+        kinds = [backup_chain.FULL, backup_chain.INCREMENTAL, backup_chain.DIFFERENTIAL, backup_chain.INCREMENTAL]
+        entries = [{'name': f'{i}.tar.gz', 'type': kind} for i, kind in enumerate(kinds)]
+        sequence = backup_chain.get_restore_sequence(entries=entries)
+        self.assertEqual([entry['name'] for entry in sequence], ['0.tar.gz', '2.tar.gz', '3.tar.gz'])
+        sequence = backup_chain.get_restore_sequence('1.tar.gz', entries)
+        self.assertEqual([entry['name'] for entry in sequence], ['0.tar.gz', '1.tar.gz'])
+        with self.assertRaises(ValueError):
+            backup_chain.get_restore_sequence('missing.tar.gz', entries)
+
+    @override_settings(BACKUP_CHAIN_LENGTH=1)
+    def test_chain_length_forces_a_new_full_backup(self):
+        backup_chain.backup(backup_chain.FULL)
+        self.assertEqual(backup_chain.backup(backup_chain.INCREMENTAL)['type'], backup_chain.INCREMENTAL)
+        self.assertEqual(backup_chain.backup(backup_chain.INCREMENTAL)['type'], backup_chain.FULL)
+        self.assertEqual(len(backup_chain.get_chain()), 3)
+
+    def test_management_page_shows_the_chain(self):
+        full = backup_chain.backup(backup_chain.FULL)
+        incremental = backup_chain.backup(backup_chain.INCREMENTAL)
+        self.client.force_login(User.objects.create(username='staff', is_staff=True, is_superuser=True))
+        response = self.client.get(reverse('backup_management'))
+        self.assertContains(response, full['name'])
+        self.assertContains(response, incremental['name'])
+        self.assertContains(response, '2 archives')
+        self.assertNotContains(response, 'backup_chain.json')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BackupCatalogTests(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.backup_dir = os.path.join(self.temp_dir.name, 'backups')
+        self.settings = override_settings(BASE_DIR=self.temp_dir.name, MEDIA_ROOT=os.path.join(self.temp_dir.name, 'media'))
+        self.settings.enable()
+        self.staff = User.objects.create(username='staff', is_staff=True, is_superuser=True)
+        Person.objects.create(user=self.staff, role=Role.objects.create(title='Staff'))
+
+    def tearDown(self):
+        self.settings.disable()
+        self.temp_dir.cleanup()
+
+    def write_file(self, name, content=b'backup'):
+        os.makedirs(self.backup_dir, exist_ok=True)
+        with open(os.path.join(self.backup_dir, name), 'wb') as f:
+            f.write(content)
+
+    def test_backups_are_recorded_when_they_complete(self):
+        result = backup_engine.backup_database()
+        csv_backup.backup()
+        database, = backup_catalog.filter_entries(backup_catalog.get_entries(), 'database')
+        self.assertEqual(database['name'], os.path.basename(result['path']))
+        self.assertEqual((database['size'], database['rows']), (result['size'], result['rows']))
+        self.assertEqual(database['models']['experiences.Person'], 1)
+        with open(result['path'], 'rb') as f:
+            self.assertEqual(database['sha256'], hashlib.sha256(f.read()).hexdigest())
+        self.assertEqual([entry['type'] for entry in backup_catalog.get_entries()], ['csv', 'database'])
+
+    def test_catalog_is_parsed_once_until_it_changes(self):
+        backup_engine.backup_database()
+        entries = backup_catalog.get_entries()
+        with mock.patch('os.listdir', side_effect=AssertionError('the backup directory was listed')):
+            self.assertIs(backup_catalog.get_entries(), entries)
+        csv_backup.backup()
+        self.assertEqual(len(backup_catalog.get_entries()), 2)
+
+    def test_catalog_is_built_from_disk_when_missing(self):
+        self.write_file('db_backup_20250101_020000.jsonl.gz')
+        self.write_file('notes.bin')
+        self.write_file('README.md')
+        entries = backup_catalog.get_entries()
+        self.assertEqual(sorted((entry['name'], entry['type']) for entry in entries), [
+            ('db_backup_20250101_020000.jsonl.gz', 'database'),
+            ('notes.bin', 'other'),
+        ])
+        self.assertTrue(os.path.exists(os.path.join(self.backup_dir, backup_catalog.CATALOG_FILE)))
+
+    def test_rebuild_drops_deleted_files_and_keeps_details(self):
+        result = backup_engine.backup_database()
+        self.write_file('db_backup_20250101_020000.jsonl.gz')
+        os.remove(os.path.join(self.backup_dir, 'db_backup_20250101_020000.jsonl.gz'))
+        self.write_file('full_backup_20250101_020000.tar.gz')
+
+        entries = backup_catalog.rebuild()
+        by_name = {entry['name']: entry for entry in entries}
+        self.assertEqual(set(by_name), {os.path.basename(result['path']), 'full_backup_20250101_020000.tar.gz'})
+        self.assertEqual(by_name[os.path.basename(result['path'])]['rows'], result['rows'])
+        self.assertEqual(by_name['full_backup_20250101_020000.tar.gz']['sha256'], hashlib.sha256(b'backup').hexdigest())
+
+    def test_list_view_filters_and_pages(self):
+        os.makedirs(self.backup_dir)
+        backup_catalog.save([
+            {'name': f'{prefix}{i:03}.gz', 'type': kind, 'size': 1, 'sha256': None, 'rows': None,
+             'models': None, 'elapsed': None, 'created': f'2025-01-01T02:{i % 60:02}:00'}
+            for prefix, kind in (('db_backup_', 'database'), ('db_csv_backup_', 'csv'))
+            for i in range(60)
+        ])
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('list_backups'), {'type': 'csv', 'page': 2})
+        self.assertEqual(response.context['page_obj'].paginator.count, 60)
+        self.assertEqual(len(response.context['backup_files']), 60 - views.BACKUPS_PER_PAGE)
+        self.assertTrue(all(entry['type'] == 'csv' for entry in response.context['backup_files']))
+
+        response = self.client.get(reverse('list_backups'), {'q': 'DB_BACKUP_007'})
+        self.assertEqual([entry['name'] for entry in response.context['backup_files']], ['db_backup_007.gz'])
+
+        response = self.client.get(reverse('backup_management'))
+        self.assertEqual(len(response.context['backup_files']), views.RECENT_BACKUPS)
+        self.assertContains(response, 'All backups (120)')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BackupDownloadTests(TestCase):
+    content = bytes(range(256)) * 4
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.settings = override_settings(BASE_DIR=self.temp_dir.name)
+        self.settings.enable()
+        os.makedirs(os.path.join(self.temp_dir.name, 'backups'))
+        with open(os.path.join(self.temp_dir.name, 'backups', 'full_backup_1.tar.gz'), 'wb') as f:
+            f.write(self.content)
+        self.client.force_login(User.objects.create(username='staff', is_staff=True, is_superuser=True))
+
+    def tearDown(self):
+        self.settings.disable()
+        self.temp_dir.cleanup()
+
+    def download(self, filename='full_backup_1.tar.gz', **headers):
+        response = self.client.get(reverse('download_backup', args=[filename]), headers=headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_whole_file(self):
+        response, body = self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.content)
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="full_backup_1.tar.gz"')
+
+    def test_ranges(self):
+        for header, first, last in (('bytes=10-19', 10, 19), ('bytes=1000-', 1000, 1023), ('bytes=-5', 1019, 1023),
+                                    ('bytes=1020-5000', 1020, 1023)):
+            response, body = self.download(Range=header)
+            self.assertEqual(response.status_code, 206, header)
+            self.assertEqual(response['Content-Range'], f'bytes {first}-{last}/1024')
+            self.assertEqual(int(response['Content-Length']), last - first + 1)
+            self.assertEqual(body, self.content[first:last + 1])
+
+    def test_unsatisfiable_and_ignored_ranges(self):
+        response, _ = self.download(Range='bytes=1024-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1024')
+        # Several ranges: the whole file
+        response, body = self.download(Range='bytes=0-1,5-6')
+        self.assertEqual((response.status_code, body), (200, self.content))
+
+    def test_if_range(self):
+        etag = self.download()[0]['ETag']
+        response, body = self.download(Range='bytes=0-9', If_Range=etag)
+        self.assertEqual((response.status_code, body), (206, self.content[:10]))
+        # The file changed since the partial download: start over
+        response, body = self.download(Range='bytes=0-9', If_Range='"0-0"')
+        self.assertEqual((response.status_code, body), (200, self.content))
+
+    def test_front_end_server_sends_the_file(self):
+        with override_settings(BACKUP_DOWNLOAD_ACCEL='x-accel-redirect', BACKUP_DOWNLOAD_INTERNAL_LOCATION='/protected/'):
+            response, body = self.download()
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/full_backup_1.tar.gz')
+        self.assertEqual(body, b'')
+        with override_settings(BACKUP_DOWNLOAD_ACCEL='x-sendfile'):
+            response, body = self.download()
+        self.assertEqual(response['X-Sendfile'], os.path.realpath(os.path.join(self.temp_dir.name, 'backups', 'full_backup_1.tar.gz')))
+        self.assertEqual(body, b'')
+
+    def test_files_outside_the_backup_dir(self):
+        self.assertEqual(self.download('../backups_other/file')[0].status_code, 404)
+        self.assertEqual(self.download('missing.tar.gz')[0].status_code, 404)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BackupJobTests(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.settings = override_settings(BASE_DIR=self.temp_dir.name, MEDIA_ROOT=self.temp_dir.name)
+        self.settings.enable()
+        self.staff = User.objects.create(username='staff', is_staff=True, is_superuser=True)
+        Person.objects.create(user=self.staff, role=Role.objects.create(title='Staff'))
+
+    def tearDown(self):
+        self.settings.disable()
+        self.temp_dir.cleanup()
+
+    def test_view_queues_job_without_running_it(self):
+        self.client.force_login(self.staff)
+        executor = mock.Mock()
+        with mock.patch.object(backup_jobs, 'get_executor', return_value=executor):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.get(reverse('backup_database'))
+        self.assertRedirects(response, reverse('backup_management'), fetch_redirect_response=False)
+        job = BackupJob.objects.get()
+        self.assertEqual((job.kind, job.state, job.created_by), ('database', BackupJob.QUEUED, self.staff))
+        executor.submit.assert_called_once_with(backup_jobs.work, job.pk)
+
+    def test_run_job_records_progress_and_result(self):
+        job = backup_jobs.run_job(backup_jobs.submit('database', self.staff).pk)
+        self.assertEqual(job.state, BackupJob.SUCCEEDED)
+        self.assertTrue(job.result.endswith('.jsonl.gz'))
+        self.assertTrue(os.path.exists(os.path.join(self.temp_dir.name, 'backups', job.result)))
+        self.assertGreater(job.rows_processed, 0)
+        self.assertGreater(job.bytes_processed, 0)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_run_job_records_errors(self):
+        job = backup_jobs.submit('database')
+        with mock.patch.object(backup_engine, 'backup_database', side_effect=OSError('disk full')):
+            job = backup_jobs.run_job(job.pk)
+        self.assertEqual(job.state, BackupJob.FAILED)
+        self.assertIn('disk full', job.errors)
+
+    def test_status_endpoint(self):
+        running = BackupJob.objects.create(kind='all', state=BackupJob.RUNNING, rows_processed=42)
+        BackupJob.objects.create(kind='media', state=BackupJob.SUCCEEDED)
+        self.client.force_login(self.staff)
+        data = self.client.get(reverse('backup_job_status')).json()
+        self.assertTrue(data['active'])
+        self.assertEqual(len(data['jobs']), 2)
+
+        data = self.client.get(reverse('backup_job_status'), {'id': running.pk}).json()
+        self.assertEqual([(job['id'], job['rows_processed']) for job in data['jobs']], [(running.pk, 42)])
+        data = self.client.get(reverse('backup_job_status'), {'id': 'x'}).json()
+        self.assertEqual(data, {'jobs': [], 'active': False})
+
+    def test_jobs_without_progress_fail(self):
+        long_ago = timezone.now() - datetime.timedelta(seconds=backup_jobs.DEFAULT_STALE_AFTER + 1)
+        dead = BackupJob.objects.create(kind='all', state=BackupJob.RUNNING, progress_at=long_ago)
+        waiting = backup_jobs.submit('database')
+        BackupJob.objects.filter(pk=waiting.pk).update(created_at=long_ago)
+        alive = BackupJob.objects.create(kind='media', state=BackupJob.RUNNING, progress_at=timezone.now())
+        self.client.force_login(self.staff)
+
+        data = self.client.get(reverse('backup_job_status')).json()
+        states = {job['id']: job['state'] for job in data['jobs']}
+        # A queued job may just be waiting for a worker
+        self.assertEqual(states, {dead.pk: BackupJob.FAILED, waiting.pk: BackupJob.QUEUED, alive.pk: BackupJob.RUNNING})
+        self.assertIn('no progress', BackupJob.objects.get(pk=dead.pk).errors)
+
+        self.assertEqual(backup_jobs.run_job(waiting.pk).state, BackupJob.SUCCEEDED)
+        BackupJob.objects.filter(pk=alive.pk).update(state=BackupJob.SUCCEEDED)
+        self.assertFalse(self.client.get(reverse('backup_job_status')).json()['active'])
+
+
+    def test_job_failed_as_stale_stays_failed(self):
+        job = backup_jobs.submit('database')
+
+        def run_too_long(progress):
+            BackupJob.objects.filter(pk=job.pk).update(progress_at=timezone.now() - datetime.timedelta(days=1))
+            backup_jobs.fail_stale_jobs()
+            return 'late.jsonl.gz', 1, 1
+
+        with mock.patch.dict(backup_jobs.RUNNERS, {'database': run_too_long}):
+            job = backup_jobs.run_job(job.pk)
+        self.assertEqual(job.state, BackupJob.FAILED)
+        self.assertIn('no progress', job.errors)
+        self.assertIn('The job finished after all: succeeded (late.jsonl.gz).', job.errors)
+
+    def test_engines_report_progress_within_models_and_media(self):
+        for i in range(5):
+            Role.objects.create(title=f'Role {i}')
+        with open(os.path.join(self.temp_dir.name, 'photo.png'), 'wb') as f:
+            f.write(b'photo')
+        rows, media = [], []
+        backup_engine.write_archive(
+            os.path.join(self.temp_dir.name, 'archive.tar.gz'), 'backup', chunk_size=2,
+            progress=lambda model, count: rows.append((model._meta.label, count)),
+            media_progress=lambda name, size: media.append((os.path.basename(name), size)),
+        )
+        self.assertEqual([count for label, count in rows if label == 'experiences.Role'], [2, 2, 2, 0])
+        self.assertIn(('photo.png', 5), media)
+
+
+class MediaStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.media_root = os.path.join(self.temp_dir.name, 'media')
+        os.makedirs(os.path.join(self.media_root, 'badges'))
+        self.settings = override_settings(BASE_DIR=self.temp_dir.name, MEDIA_ROOT=self.media_root)
+        self.settings.enable()
+        self.write_media('badges/gold.png', b'gold')
+        self.write_media('badges/copy.png', b'gold')
+        self.write_media('profile.png', b'profile')
+
+    def tearDown(self):
+        self.settings.disable()
+        self.temp_dir.cleanup()
+
+    def write_media(self, name, content):
+        with open(os.path.join(self.media_root, name), 'wb') as f:
+            f.write(content)
+
+    def count_blobs(self):
+        return sum(len(files) for _, _, files in os.walk(media_store.get_store_dir('blobs')))
+
+    def test_snapshots_store_each_content_once(self):
+        first = media_store.snapshot()
+        self.assertEqual((first['files'], first['new_blobs']), (3, 2))
+
+        with mock.patch.object(media_store, 'hash_file', wraps=media_store.hash_file) as hash_file:
+            second = media_store.snapshot()
+        self.assertEqual(second['new_blobs'], 0)
+        hash_file.assert_not_called()  # unchanged sizes and mtimes are not re-read
+
+        self.write_media('badges/silver.png', b'silver')
+        third = media_store.snapshot()
+        self.assertEqual((third['files'], third['new_blobs'], third['new_bytes']), (4, 1, 6))
+        self.assertEqual(self.count_blobs(), 3)
+
+    def test_blobs_are_named_after_the_copied_bytes(self):
+        # The file is rewritten after it was hashed and before it is copied
+        stale = hashlib.sha256(b'profile').hexdigest()
+        self.write_media('profile.png', b'rewritten')
+        with mock.patch.object(media_store, 'hash_file', return_value=stale):
+            name = media_store.snapshot()['manifest']
+        digest = media_store.read_manifest(name)['files']['profile.png']['sha256']
+        self.assertEqual(digest, hashlib.sha256(b'rewritten').hexdigest())
+        with open(media_store.get_blob_path(digest), 'rb') as f:
+            self.assertEqual(f.read(), b'rewritten')
+        self.assertFalse(os.path.exists(media_store.get_blob_path(stale)))
+        self.assertEqual(os.listdir(media_store.get_store_dir('tmp')), [])
+
+    def test_restore_writes_snapshot_files(self):
+        name = media_store.snapshot()['manifest']
+        self.write_media('profile.png', b'changed')
+        os.remove(os.path.join(self.media_root, 'badges', 'gold.png'))
+
+        self.assertEqual(media_store.restore(name), 3)
+        with open(os.path.join(self.media_root, 'profile.png'), 'rb') as f:
+            self.assertEqual(f.read(), b'profile')
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, 'badges', 'gold.png')))
+        with self.assertRaises(ValueError):
+            media_store.restore('missing.json')
+
+    def test_garbage_collection_keeps_blobs_of_retained_snapshots(self):
+        media_store.snapshot()
+        self.write_media('profile.png', b'new profile')
+        media_store.snapshot()
+        self.assertEqual(self.count_blobs(), 3)
+
+        self.assertEqual(media_store.collect_garbage(keep=1, dry_run=True), (1, 1, 7))
+        self.assertEqual(self.count_blobs(), 3)
+        self.assertEqual(media_store.collect_garbage(keep=1), (1, 1, 7))
+        self.assertEqual(self.count_blobs(), 2)
+        self.assertEqual(len(media_store.list_manifests()), 1)
+        self.assertEqual(media_store.restore(), 3)
+
+    def test_garbage_collection_waits_for_running_snapshots(self):
+        media_store.snapshot()
+        self.write_media('profile.png', b'new profile')
+        collector = threading.Thread(target=media_store.collect_garbage, kwargs={'keep': 1})
+
+        def start_collector(path, size):
+            # The snapshot's new blob is written but not yet in any manifest
+            if path == 'profile.png':
+                collector.start()
+                collector.join(0.2)
+                self.assertTrue(collector.is_alive())
+
+        media_store.snapshot(progress=start_collector)
+        collector.join()
+        # Run after the snapshot, the collector keeps its manifest and blobs and drops the old ones
+        self.assertEqual(len(media_store.list_manifests()), 1)
+        self.assertEqual(self.count_blobs(), 2)
+        self.assertEqual(media_store.restore(), 3)
@@ -27,6 +27,8 @@ from .views import (
     random_quote_view, backup_database, backup_media, 
     restore_database, restore_media, list_backups, download_backup,
     backup_all,  # Add the new backup_all view
+    backup_incremental,
+    backup_job_status,
     backup_database_flat_csv, restore_database_from_flat_csv, # Add CSV views
     backup_management_view # Add the new management view
 )
@@ -53,10 +55,13 @@ backup_urlpatterns = [
     path('backup/database/', backup_database, name='backup_database'),
     path('backup/media/', backup_media, name='backup_media'),
     path('backup/all/', backup_all, name='backup_all'),
+    path('backup/incremental/', backup_incremental, name='backup_incremental'),
     path('backup/database/csv/', backup_database_flat_csv, name='backup_database_flat_csv'),
+    path('backup/jobs/status/', backup_job_status, name='backup_job_status'),
     path('restore/database/', restore_database, name='restore_database'),
     path('restore/media/', restore_media, name='restore_media'),
     path('restore/database/csv/', restore_database_from_flat_csv, name='restore_database_from_flat_csv'),
+    path('backups/', list_backups, name='list_backups'),
     path('backups/download/<path:filename>', download_backup, name='download_backup'),
     path('', backup_management_view, name='backup_management'), # Add the main management view URL
 ]